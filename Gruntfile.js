@@ -62,13 +62,26 @@ module.exports = function(grunt) {
         command: ['python', 'build/run_python_tests.py',
                   app_engine_path, out_app_engine_dir].join(' ')
       },
+      runPythonBenchmarks: {
+        command: ['python', 'build/run_python_benchmarks.py',
+                  app_engine_path, out_app_engine_dir].join(' ')
+      },
+      runLoadGenerator: {
+        command: ['python', 'build/run_load_generator.py',
+                  app_engine_path, out_app_engine_dir].join(' ')
+      },
+      runStandaloneServer: {
+        command: ['python', 'build/run_standalone_server.py',
+                  app_engine_path, out_app_engine_dir].join(' ')
+      },
       buildAppEnginePackage: {
         command: ['python', './build/build_app_engine_package.py', 'src',
-                  out_app_engine_dir].join(' ')
+                  out_app_engine_dir, '--sdk-path', app_engine_path].join(' ')
       },
       buildAppEnginePackageWithTests: {
         command: ['python', './build/build_app_engine_package.py', 'src',
-                  out_app_engine_dir, '--include-tests'].join(' ')
+                  out_app_engine_dir, '--sdk-path', app_engine_path,
+                  '--include-tests'].join(' ')
       },
       removePythonTestsFromOutAppEngineDir: {
         command: ['python', './build/remove_python_tests.py',
@@ -107,6 +120,19 @@ module.exports = function(grunt) {
                                         'shell:buildAppEnginePackageWithTests',
                                         'shell:runPythonTests',
                                         'shell:removePythonTestsFromOutAppEngineDir']);
+  grunt.registerTask('runPythonBenchmarks', [
+                     'shell:ensureGcloudSDKIsInstalled',
+                     'shell:buildAppEnginePackageWithTests',
+                     'shell:runPythonBenchmarks',
+                     'shell:removePythonTestsFromOutAppEngineDir']);
+  grunt.registerTask('runLoadGenerator', [
+                     'shell:ensureGcloudSDKIsInstalled',
+                     'shell:buildAppEnginePackage',
+                     'shell:runLoadGenerator']);
+  grunt.registerTask('runStandaloneServer', [
+                     'shell:ensureGcloudSDKIsInstalled',
+                     'build',
+                     'shell:runStandaloneServer']);
   grunt.registerTask('runUnitTests', [
                      'shell:genJsEnums', 'shell:copyAdapter', 'shell:runUnitTests']),
   grunt.registerTask('build', ['shell:buildAppEnginePackage',
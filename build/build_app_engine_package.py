@@ -13,11 +13,13 @@ import sys
 
 import test_file_herder
 
-USAGE = """%prog src_path dest_path
+USAGE = """%prog src_path dest_path [--sdk-path sdk_path]
 Build the GAE source code package.
 
 src_path     Path to the source code root directory.
-dest_path    Path to the root directory to push/deploy GAE from."""
+dest_path    Path to the root directory to push/deploy GAE from.
+sdk_path     Path to the App Engine SDK, whose Jinja the page templates are
+             precompiled with."""
 
 
 def call_cmd_and_return_output_lines(cmd):
@@ -67,7 +69,7 @@ def copyPako(dest_path):
   shutil.copy('node_modules/pako/dist/pako.min.js', dest_js_path)
 
 
-def CopyApprtcSource(src_path, dest_path):
+def CopyApprtcSource(src_path, dest_path, sdk_path=None):
   if os.path.exists(dest_path):
     shutil.rmtree(dest_path)
   os.makedirs(dest_path)
@@ -91,31 +93,55 @@ def CopyApprtcSource(src_path, dest_path):
     elif dirpath.endswith('app_engine'):
       for name in files:
         if (name.endswith('.py') and 'test' not in name
-            or name.endswith('.yaml')):
+            and 'benchmark' not in name or name.endswith('.yaml')):
           shutil.copy(os.path.join(dirpath, name), dest_path)
-    elif dirpath.endswith('js'):
-      for name in files:
-        # loopback.js is not compiled by Closure
-        # and need to be copied separately.
-        if name in ['loopback.js']:
-          dest_js_path = os.path.join(dest_path, 'js')
-          if not os.path.exists(dest_js_path):
-              os.makedirs(dest_js_path)
-          shutil.copy(os.path.join(dirpath, name), dest_js_path)
 
   build_version_info_file(os.path.join(dest_path, 'version_info.json'))
+  if sdk_path:
+    precompile_templates(sdk_path, dest_path)
+  else:
+    print 'Templates not precompiled: no SDK path'
+
+
+# Jinja only loads bytecode written by its own version, so the templates are
+# compiled with the Jinja of the SDK, the version app.yaml requests.
+PRECOMPILE_SCRIPT = """
+import sys
+sys.path.insert(0, sys.argv[1])
+import dev_appserver
+dev_appserver.fix_sys_path()
+sys.path.insert(0, sys.argv[2])
+import template_cache
+print ', '.join(template_cache.precompile_templates(sys.argv[2]))
+"""
+
+
+def precompile_templates(sdk_path, dest_path):
+  """Writes the Jinja bytecode of the page templates, see template_cache.py.
+  Instances compile the templates themselves if this fails."""
+  process = subprocess.Popen(
+      [sys.executable, '-c', PRECOMPILE_SCRIPT, sdk_path, dest_path],
+      stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+  output = process.communicate()[0].strip()
+  if process.returncode == 0:
+    print 'Precompiled templates: %s' % output
+  else:
+    print 'Templates not precompiled: %s' % output
 
 
 def main():
   parser = optparse.OptionParser(USAGE)
   parser.add_option("-t", "--include-tests", action="store_true",
                     help='Also copy python tests to the out dir.')
+  parser.add_option("-s", "--sdk-path",
+                    help='Precompile the page templates with the Jinja of '
+                    'this App Engine SDK.')
   options, args = parser.parse_args()
   if len(args) != 2:
     parser.error('Error: Exactly 2 arguments required.')
 
   src_path, dest_path = args[0:2]
-  CopyApprtcSource(src_path, dest_path)
+  CopyApprtcSource(src_path, dest_path, options.sdk_path)
   #copyPako(dest_path)
   if options.include_tests:
     app_engine_code = os.path.join(src_path, 'app_engine')
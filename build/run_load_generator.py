@@ -0,0 +1,248 @@
+#!/usr/bin/python
+
+import json
+import optparse
+import os
+import sys
+import threading
+import time
+
+USAGE = """%prog [options] sdk_path app_path
+Drive call setups against the AppRTC WSGI app in-process and report its
+throughput.
+
+sdk_path     Path to the SDK installation.
+app_path     Path to the built App Engine package.
+
+Every simulated call joins a room, sends an offer and candidates, joins the
+second client, sends an answer and leaves with both clients. With --batch the
+candidates are posted together to /messages, as the web client does,
+instead of one /message each. Memcache is the SDK stub, messages forwarded to
+collider are accepted by a fake sink, and the ICE servers and the active
+collider host are already stored."""
+
+ROUTES = ['join', 'message', 'messages', 'leave']
+ICE_SERVERS = [{'urls': ['turn:turn.example.com:3478?transport=udp'],
+                'username': '1456789012:load', 'credential': 'secret'}]
+PERCENTILES = [50, 95, 99]
+SRC_APP_ENGINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'app_engine')
+
+
+class ColliderSink(object):
+  """Stands in for collider by accepting every forwarded message."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.num_posts = 0
+
+  def create_rpc(self, deadline=None):
+    import test_util
+    return test_util.FakeRpc(test_util.FakeFetchResult(200), deadline)
+
+  def make_fetch_call(self, rpc, url, payload=None, method=None):
+    with self.lock:
+      self.num_posts += 1
+
+
+class LoadGenerator(object):
+  """Runs simulated calls from several threads and times every request."""
+
+  def __init__(self, app, num_rooms, num_threads, num_candidates, batch):
+    self.app = app
+    self.num_rooms = num_rooms
+    self.num_threads = num_threads
+    self.num_candidates = num_candidates
+    self.batch = batch
+    self.lock = threading.Lock()
+    self.next_room = 0
+    self.latencies = dict((route, []) for route in ROUTES)
+    self.errors = dict((route, 0) for route in ROUTES)
+
+  def Post(self, test_app, route, path, body=''):
+    start = time.time()
+    response = test_app.post(path, body, headers={'User-Agent': 'Chrome'},
+                             expect_errors=True)
+    latency = time.time() - start
+    # /leave responds with an empty body.
+    ok = (response.status_int == 200 and
+          (not response.body or
+           json.loads(response.body)['result'] == 'SUCCESS'))
+    with self.lock:
+      self.latencies[route].append(latency)
+      if not ok:
+        self.errors[route] += 1
+    return response
+
+  def RunCall(self, test_app, room_id):
+    response = self.Post(test_app, 'join', '/join/' + room_id)
+    caller_id = json.loads(response.body)['params']['client_id']
+    caller_path = '/message/%s/%s' % (room_id, caller_id)
+    self.Post(test_app, 'message', caller_path,
+              json.dumps({'type': 'offer', 'sdp': 'v=0\r\n' * 100}))
+    candidates = [
+        {'type': 'candidate', 'label': label % 2, 'id': str(label % 2),
+         'candidate': 'candidate:%d 1 udp 2122260223 10.0.0.1 %d typ host'
+                      % (label, 50000 + label)}
+        for label in xrange(self.num_candidates)]
+    if self.batch and candidates:
+      self.Post(test_app, 'messages',
+                '/messages/%s/%s' % (room_id, caller_id),
+                json.dumps(candidates))
+    else:
+      for candidate in candidates:
+        self.Post(test_app, 'message', caller_path, json.dumps(candidate))
+
+    response = self.Post(test_app, 'join', '/join/' + room_id)
+    callee_id = json.loads(response.body)['params']['client_id']
+    self.Post(test_app, 'message', '/message/%s/%s' % (room_id, callee_id),
+              json.dumps({'type': 'answer', 'sdp': 'v=0\r\n' * 100}))
+    self.Post(test_app, 'leave', '/leave/%s/%s' % (room_id, callee_id))
+    self.Post(test_app, 'leave', '/leave/%s/%s' % (room_id, caller_id))
+
+  def RunThread(self):
+    import webtest
+    test_app = webtest.TestApp(self.app)
+    while True:
+      with self.lock:
+        if self.next_room >= self.num_rooms:
+          return
+        room_id = 'load%d' % self.next_room
+        self.next_room += 1
+      self.RunCall(test_app, room_id)
+
+  def Run(self):
+    threads = [threading.Thread(target=self.RunThread)
+               for _ in xrange(self.num_threads)]
+    start = time.time()
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return time.time() - start
+
+
+def GetPercentile(sorted_values, percentile):
+  if not sorted_values:
+    return 0
+  index = int(round(percentile / 100.0 * (len(sorted_values) - 1)))
+  return sorted_values[index]
+
+
+def MakeReport(generator, elapsed_sec, contention, sink):
+  num_requests = sum(len(values) for values in generator.latencies.values())
+  routes = {}
+  for route in ROUTES:
+    latencies = sorted(generator.latencies[route])
+    routes[route] = {'requests': len(latencies),
+                     'errors': generator.errors[route]}
+    for percentile in PERCENTILES:
+      routes[route]['p%d_ms' % percentile] = (
+          GetPercentile(latencies, percentile) * 1000)
+  return {
+      'rooms': generator.num_rooms,
+      'threads': generator.num_threads,
+      'batch': generator.batch,
+      'elapsed_sec': elapsed_sec,
+      'requests': num_requests,
+      'requests_per_sec': num_requests / elapsed_sec,
+      'routes': routes,
+      'collider_posts': sink.num_posts,
+      'cas_loops': contention['loops'],
+      'cas_exhausted': contention['exhausted'],
+      'cas_retry_histogram': contention['retry_histogram']
+  }
+
+
+def PrintReport(report):
+  print 'Rooms %d, threads %d, %s candidates, %.2f s' % (
+      report['rooms'], report['threads'],
+      'batched' if report['batch'] else 'single', report['elapsed_sec'])
+  print 'Requests %d, %.1f requests/s, %d collider posts' % (
+      report['requests'], report['requests_per_sec'],
+      report['collider_posts'])
+  print '  %-10s %8s %8s %10s %10s %10s' % (
+      'route', 'requests', 'errors', 'p50_ms', 'p95_ms', 'p99_ms')
+  for route in ROUTES:
+    stats = report['routes'][route]
+    print '  %-10s %8d %8d %10.3f %10.3f %10.3f' % (
+        route, stats['requests'], stats['errors'], stats['p50_ms'],
+        stats['p95_ms'], stats['p99_ms'])
+  print 'CAS loops %d, exhausted %d' % (report['cas_loops'],
+                                        report['cas_exhausted'])
+  histogram = report['cas_retry_histogram']
+  print '  retries ' + ', '.join(
+      '%s: %d' % (bucket, histogram[bucket])
+      for bucket in sorted(histogram, key=lambda bucket: (
+          bucket.startswith('>'), int(bucket.strip('<=>')))))
+
+
+def main(sdk_path, app_path, options):
+  if not os.path.exists(sdk_path):
+    return 'Missing %s: try grunt shell:getPythonTestDeps.' % sdk_path
+  if not os.path.exists(app_path):
+    return 'Missing %s: try grunt build.' % app_path
+
+  sys.path.insert(0, sdk_path)
+  import dev_appserver
+  dev_appserver.fix_sys_path()
+  sys.path.insert(0, app_path)
+  # For the URL fetch fakes of test_util, which builds without tests lack.
+  sys.path.append(SRC_APP_ENGINE_PATH)
+  from google.appengine.ext import testbed
+  import analytics
+  import apprtc
+  import cas_retry
+  import constants
+  import ice_config
+  import probers
+  from google.appengine.api import memcache
+
+  bed = testbed.Testbed()
+  bed.activate()
+  bed.init_memcache_stub()
+  constants.ROOM_STORE_BACKEND = options.store
+  analytics.report_event = lambda *args, **kwargs: None
+  sink = ColliderSink()
+  apprtc.urlfetch.create_rpc = sink.create_rpc
+  apprtc.urlfetch.make_fetch_call = sink.make_fetch_call
+  ice_config.cache.set(apprtc.get_default_ice_server_url(), ICE_SERVERS, 3600)
+  # As stored by the collider prober, so that joins do not fall back.
+  memcache.set(constants.WSS_HOST_ACTIVE_HOST_KEY,
+               constants.WSS_HOST_PORT_PAIRS[0])
+  probers.active_host_cache.invalidate()
+  cas_retry.contention_stats.reset()
+
+  generator = LoadGenerator(apprtc.app, options.rooms, options.threads,
+                            options.candidates, options.batch)
+  elapsed_sec = generator.Run()
+  report = MakeReport(generator, elapsed_sec,
+                      cas_retry.contention_stats.get_stats(), sink)
+  bed.deactivate()
+
+  PrintReport(report)
+  if options.output:
+    with open(options.output, 'w') as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+  return 0
+
+
+if __name__ == '__main__':
+  parser = optparse.OptionParser(USAGE)
+  parser.add_option('--rooms', type='int', default=200,
+                    help='Number of calls to set up.')
+  parser.add_option('--threads', type='int', default=8,
+                    help='Number of calls set up concurrently.')
+  parser.add_option('--candidates', type='int', default=10,
+                    help='Number of candidates sent by the caller.')
+  parser.add_option('--batch', action='store_true', default=False,
+                    help='Post the candidates together to /messages.')
+  parser.add_option('--store', default='memcache',
+                    help='Room store backend, memcache or inprocess.')
+  parser.add_option('--output', help='Also write the report as JSON here.')
+  options, args = parser.parse_args()
+  if len(args) != 2:
+    parser.error('Error: Exactly 2 arguments required.')
+
+  sdk_path, app_path = args[0:2]
+  sys.exit(main(sdk_path, app_path, options))
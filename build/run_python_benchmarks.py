@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+import glob
+import json
+import optparse
+import os
+import sys
+
+USAGE = """%prog [options] sdk_path benchmark_path
+Run the Python benchmarks of App Engine apps.
+
+sdk_path         Path to the SDK installation.
+benchmark_path   Path to package containing *_benchmark.py modules.
+
+Every function named benchmark_* in those modules is run and returns a
+dictionary of measurements. Results can be written as JSON, and compared to
+the JSON results of an earlier run: the run fails if a time measurement,
+named *_usec, got slower than the threshold allows."""
+
+# Fraction by which a time measurement may exceed its baseline.
+DEFAULT_THRESHOLD = 0.2
+
+
+def RunBenchmarks(benchmark_path):
+  results = {}
+  pattern = os.path.join(benchmark_path, '*_benchmark.py')
+  for module_path in sorted(glob.glob(pattern)):
+    module_name = os.path.splitext(os.path.basename(module_path))[0]
+    module = __import__(module_name)
+    for name in sorted(dir(module)):
+      function = getattr(module, name)
+      if name.startswith('benchmark_') and callable(function):
+        benchmark_name = '%s.%s' % (module_name, name[len('benchmark_'):])
+        print 'Running %s' % benchmark_name
+        results[benchmark_name] = function()
+  return results
+
+
+def PrintResults(results):
+  for benchmark_name in sorted(results):
+    print benchmark_name
+    measurements = results[benchmark_name]
+    for measurement in sorted(measurements):
+      print '  %-30s %12.3f' % (measurement, measurements[measurement])
+
+
+def FindRegressions(results, baseline, threshold):
+  """Returns descriptions of the time measurements of results that exceed
+  their baseline by more than threshold."""
+  regressions = []
+  for benchmark_name in sorted(results):
+    baseline_measurements = baseline.get(benchmark_name, {})
+    for measurement, value in sorted(results[benchmark_name].iteritems()):
+      baseline_value = baseline_measurements.get(measurement)
+      if not measurement.endswith('_usec') or not baseline_value:
+        continue
+      if value > baseline_value * (1 + threshold):
+        regressions.append('%s.%s: %.3f, baseline %.3f (%+.0f%%)' % (
+            benchmark_name, measurement, value, baseline_value,
+            (value / baseline_value - 1) * 100))
+  return regressions
+
+
+def main(sdk_path, benchmark_path, options):
+  if not os.path.exists(sdk_path):
+    return 'Missing %s: try grunt shell:getPythonTestDeps.' % sdk_path
+  if not os.path.exists(benchmark_path):
+    return 'Missing %s: try grunt build.' % benchmark_path
+
+  sys.path.insert(0, sdk_path)
+  import dev_appserver
+  dev_appserver.fix_sys_path()
+  sys.path.insert(0, benchmark_path)
+  results = RunBenchmarks(benchmark_path)
+  PrintResults(results)
+  if options.output:
+    with open(options.output, 'w') as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+  if options.baseline:
+    with open(options.baseline) as f:
+      baseline = json.load(f)
+    regressions = FindRegressions(results, baseline, options.threshold)
+    if regressions:
+      print 'Regressions over %.0f%%:' % (options.threshold * 100)
+      for regression in regressions:
+        print '  ' + regression
+      return 1
+    print 'No regressions over %.0f%%.' % (options.threshold * 100)
+  return 0
+
+
+if __name__ == '__main__':
+  parser = optparse.OptionParser(USAGE)
+  parser.add_option('--output', help='Write the results as JSON here.')
+  parser.add_option('--baseline',
+                    help='JSON results to compare the results to.')
+  parser.add_option('--threshold', type='float', default=DEFAULT_THRESHOLD,
+                    help='Allowed slowdown compared to the baseline, as a '
+                         'fraction. Defaults to %default.')
+  options, args = parser.parse_args()
+  if len(args) != 2:
+    parser.error('Error: Exactly 2 arguments required.')
+
+  sdk_path, benchmark_path = args[0:2]
+  sys.exit(main(sdk_path, benchmark_path, options))
@@ -0,0 +1,279 @@
+#!/usr/bin/python
+
+import hmac
+import logging
+import mimetypes
+import optparse
+import os
+import re
+import SocketServer
+import sys
+import threading
+import time
+import wsgiref.simple_server
+import wsgiref.util
+
+USAGE = """%prog [options] sdk_path app_path
+Serve the built AppRTC App Engine package outside App Engine, on a threaded
+WSGI server.
+
+sdk_path     Path to the SDK installation.
+app_path     Path to the built App Engine package.
+
+The handlers of app.yaml are served in order, and the jobs of cron.yaml are
+run from a background thread. The App Engine services are replaced by the
+local implementations of the SDK: memcache and the task queue are kept in
+this process and mails are logged. URL fetches are made by this process, or
+answered with an empty 200 response without a request with --urlfetch=sink.
+
+Handlers with login: admin are only served to requests carrying the token of
+--admin-token in the X-AppRTC-Admin-Token header, or coming from one of the
+addresses of --admin-addresses, and to the cron jobs. Behind a reverse proxy
+every request comes from the address of the proxy, so use a token rather than
+listing it. Without either option, admin handlers are only run by cron. Every
+process keeps its own memcache, so the requests of a room must always reach
+the same process, e.g. by hashing the room ID in the path."""
+
+URLFETCH_HTTP = 'http'
+URLFETCH_SINK = 'sink'
+CRON_SCHEDULE_RE = re.compile(r'every (\d+) (minutes|hours)')
+ADMIN_TOKEN_HEADER = 'HTTP_X_APPRTC_ADMIN_TOKEN'
+# Set in the environment of the requests made by CronRunner. Keys of request
+# headers all start with HTTP_, so clients cannot set it.
+CRON_ENVIRON_KEY = 'apprtc.cron'
+
+
+def SinkFetch(url, payload, method, headers, request, response, **kwargs):
+  """Accepts every URL fetch without a request, e.g. to benchmark without
+  collider."""
+  response.set_statuscode(200)
+
+
+def SetUpServices(app_path, options):
+  """Registers the local implementations of the App Engine services."""
+  from google.appengine.ext import testbed
+  bed = testbed.Testbed()
+  bed.activate()
+  bed.setup_env(app_id=options.app_id, server_software='Standalone/1.0',
+                overwrite=True)
+  bed.init_app_identity_stub()
+  bed.init_mail_stub()
+  bed.init_memcache_stub()
+  bed.init_taskqueue_stub(root_path=app_path)
+  if options.urlfetch == URLFETCH_SINK:
+    bed.init_urlfetch_stub(urlmatchers=[(lambda url: True, SinkFetch)])
+  else:
+    bed.init_urlfetch_stub()
+  return bed
+
+
+def LoadYaml(app_path, name):
+  import yaml
+  path = os.path.join(app_path, name)
+  if not os.path.exists(path):
+    return {}
+  with open(path) as f:
+    return yaml.safe_load(f) or {}
+
+
+def SetEnvironmentVariables(app_config):
+  """Sets the env_variables of app.yaml that the environment does not
+  override."""
+  for name, value in (app_config.get('env_variables') or {}).iteritems():
+    if name not in os.environ:
+      os.environ[name] = str(value)
+
+
+class Dispatcher(object):
+  """Dispatches requests to the static files and scripts of app.yaml."""
+
+  def __init__(self, app_path, handlers, admin_token=None,
+               admin_addresses=()):
+    self.app_path = os.path.abspath(app_path)
+    self.admin_token = admin_token
+    self.admin_addresses = frozenset(admin_addresses)
+    self.handlers = []
+    for handler in handlers:
+      url = handler['url']
+      app = None
+      if 'script' in handler:
+        module_name, app_name = handler['script'].rsplit('.', 1)
+        app = getattr(__import__(module_name), app_name)
+      self.handlers.append((re.compile('^' + url + '$'),
+                            re.compile('^' + url + '(/.*)?$'), handler, app))
+
+  def __call__(self, environ, start_response):
+    path = environ.get('PATH_INFO') or '/'
+    for url_re, dir_re, handler, app in self.handlers:
+      if 'static_dir' in handler:
+        match = dir_re.match(path)
+      else:
+        match = url_re.match(path)
+      if match is None:
+        continue
+      if handler.get('login') == 'admin' and not self.IsAdmin(environ):
+        return self.Respond(start_response, '403 Forbidden')
+      if app is not None:
+        return app(environ, start_response)
+      if 'static_dir' in handler:
+        root = handler['static_dir']
+        file_path = root + (match.group(1) or '')
+      else:
+        root = os.path.dirname(handler['static_files'])
+        file_path = match.expand(handler['static_files'])
+      return self.ServeFile(root, file_path, start_response)
+    return self.Respond(start_response, '404 Not Found')
+
+  def IsAdmin(self, environ):
+    if environ.get(CRON_ENVIRON_KEY):
+      return True
+    if environ.get('REMOTE_ADDR') in self.admin_addresses:
+      return True
+    token = environ.get(ADMIN_TOKEN_HEADER)
+    return bool(self.admin_token and token and
+                hmac.compare_digest(str(token), self.admin_token))
+
+  def Respond(self, start_response, status):
+    start_response(status, [('Content-Type', 'text/plain'),
+                            ('Content-Length', str(len(status)))])
+    return [status]
+
+  def ServeFile(self, root, file_path, start_response):
+    root_path = os.path.join(self.app_path, root)
+    path = os.path.normpath(os.path.join(self.app_path, file_path))
+    # Files outside the static directory, e.g. sources, are not served.
+    if not path.startswith(root_path + os.sep) or not os.path.isfile(path):
+      return self.Respond(start_response, '404 Not Found')
+    with open(path, 'rb') as f:
+      body = f.read()
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    start_response('200 OK', [('Content-Type', content_type),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+
+class CronRunner(object):
+  """Runs the jobs of cron.yaml with the interval of their schedule."""
+
+  def __init__(self, dispatcher, jobs):
+    self.dispatcher = dispatcher
+    self.jobs = []
+    for job in jobs:
+      match = CRON_SCHEDULE_RE.match(job['schedule'])
+      if match is None:
+        logging.warning('Unsupported cron schedule: %s', job['schedule'])
+        continue
+      interval_sec = int(match.group(1)) * 60
+      if match.group(2) == 'hours':
+        interval_sec *= 60
+      self.jobs.append((job['url'], interval_sec))
+
+  def RunJob(self, url):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': url,
+               'REMOTE_ADDR': '127.0.0.1', 'HTTP_X_APPENGINE_CRON': 'true',
+               CRON_ENVIRON_KEY: True}
+    wsgiref.util.setup_testing_defaults(environ)
+    status = []
+    self.dispatcher(environ, lambda s, headers: status.append(s))
+    logging.info('Ran cron job %s: %s', url, status[0] if status else '')
+
+  def Run(self):
+    next_runs = dict((url, time.time() + interval_sec)
+                     for url, interval_sec in self.jobs)
+    while True:
+      time.sleep(1)
+      for url, interval_sec in self.jobs:
+        if time.time() >= next_runs[url]:
+          next_runs[url] += interval_sec
+          try:
+            self.RunJob(url)
+          except Exception as e:
+            logging.error('Cron job %s failed: %s', url, e)
+
+  def Start(self):
+    thread = threading.Thread(target=self.Run)
+    thread.daemon = True
+    thread.start()
+
+
+class ThreadingWSGIServer(SocketServer.ThreadingMixIn,
+                          wsgiref.simple_server.WSGIServer):
+  """Handles every request in its own thread."""
+  daemon_threads = True
+  request_queue_size = 128
+
+
+class QuietRequestHandler(wsgiref.simple_server.WSGIRequestHandler):
+  def log_message(self, format, *args):
+    pass
+
+
+def main(sdk_path, app_path, options):
+  if not os.path.exists(sdk_path):
+    return 'Missing %s: try grunt shell:getPythonTestDeps.' % sdk_path
+  if not os.path.exists(app_path):
+    return 'Missing %s: try grunt build.' % app_path
+  logging.basicConfig(level=logging.INFO)
+
+  sys.path.insert(0, sdk_path)
+  import dev_appserver
+  dev_appserver.fix_sys_path()
+  sys.path.insert(0, app_path)
+
+  app_config = LoadYaml(app_path, 'app.yaml')
+  SetEnvironmentVariables(app_config)
+  SetUpServices(app_path, options)
+  admin_addresses = [address for address in options.admin_addresses.split(',')
+                     if address]
+  dispatcher = Dispatcher(app_path, app_config.get('handlers') or [],
+                          options.admin_token, admin_addresses)
+  if options.cron:
+    CronRunner(dispatcher,
+               LoadYaml(app_path, 'cron.yaml').get('cron') or []).Start()
+
+  handler_class = (wsgiref.simple_server.WSGIRequestHandler
+                   if options.log_requests else QuietRequestHandler)
+  server = wsgiref.simple_server.make_server(
+      options.host, options.port, dispatcher,
+      server_class=ThreadingWSGIServer, handler_class=handler_class)
+  print 'Serving %s on http://%s:%d' % (app_path, options.host, options.port)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  return 0
+
+
+if __name__ == '__main__':
+  parser = optparse.OptionParser(USAGE)
+  parser.add_option('--host', default='localhost',
+                    help='Address to listen on.')
+  parser.add_option('--port', type='int', default=8080,
+                    help='Port to listen on.')
+  parser.add_option('--app-id', default='dev~apprtc-standalone',
+                    help='Application ID reported by the app identity '
+                         'service. IDs starting with dev report analytics '
+                         'like the development server, with the credentials '
+                         'of secrets.json, if any.')
+  parser.add_option('--urlfetch', default=URLFETCH_HTTP,
+                    choices=[URLFETCH_HTTP, URLFETCH_SINK],
+                    help='How URL fetches are made, http or sink.')
+  parser.add_option('--no-cron', dest='cron', action='store_false',
+                    default=True, help='Do not run the jobs of cron.yaml.')
+  parser.add_option('--admin-token',
+                    default=os.environ.get('APPRTC_ADMIN_TOKEN'),
+                    help='Token of the X-AppRTC-Admin-Token header that '
+                         'grants access to the login: admin handlers. '
+                         'Defaults to $APPRTC_ADMIN_TOKEN.')
+  parser.add_option('--admin-addresses', default='',
+                    help='Comma separated client addresses granted access '
+                         'to the login: admin handlers, e.g. 127.0.0.1,::1. '
+                         'Do not list the address of a reverse proxy.')
+  parser.add_option('--log-requests', action='store_true', default=False,
+                    help='Log every request.')
+  options, args = parser.parse_args()
+  if len(args) != 2:
+    parser.error('Error: Exactly 2 arguments required.')
+
+  sdk_path, app_path = args[0:2]
+  sys.exit(main(sdk_path, app_path, options))
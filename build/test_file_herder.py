@@ -7,7 +7,9 @@ import shutil
 
 
 def _IsPythonTest(filename):
-  return 'test' in filename and filename.endswith('.py')
+  # Benchmarks are handled like tests: only copied for local runs.
+  return (('test' in filename or 'benchmark' in filename) and
+          filename.endswith('.py'))
 
 
 def CopyTests(src_path, dest_path):
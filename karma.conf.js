@@ -17,7 +17,6 @@ module.exports = function(config) {
       'src/web_app/js/appwindow.js',
       'src/web_app/js/call.js',
       'src/web_app/js/infobox.js',
-      'src/web_app/js/loopback.js',
       'src/web_app/js/peerconnectionclient.js',
       'src/web_app/js/roomselection.js',
       'src/web_app/js/signalingchannel.js',
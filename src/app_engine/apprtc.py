@@ -11,10 +11,10 @@ import cgi
 import json
 import logging
 import os
-import random
+import re
 import threading
+import time
 
-import jinja2
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import memcache
@@ -22,18 +22,26 @@ from google.appengine.api import urlfetch
 
 import analytics
 import analytics_page
+import cas_retry
 import compute_page
 import constants
-
-jinja_environment = jinja2.Environment(
-    loader=jinja2.FileSystemLoader(os.path.dirname(__file__)))
+import ice_config
+import ice_filter
+import id_allocator
+import lru_cache
+import message_inbox
+import probers
+import request_metrics
+import request_profiler
+import room_index
+import room_stats
+import room_store
+import template_cache
+import turn_credentials
 
 
 def generate_random(length):
-  word = ''
-  for _ in range(length):
-    word += random.choice('0123456789')
-  return word
+  return id_allocator.generate_id(length)
 
 # HD is on by default for desktop Chrome, but not Android or Firefox (yet)
 def get_hd_default(user_agent):
@@ -135,8 +143,7 @@ def get_wss_parameters(request):
   if not wss_host_port_pair:
     # Attempt to get a wss server from the status provided by prober,
     # if that fails, use fallback value.
-    memcache_client = memcache.Client()
-    wss_active_host = memcache_client.get(constants.WSS_HOST_ACTIVE_HOST_KEY)
+    wss_active_host = probers.get_active_host()
     if wss_active_host in constants.WSS_HOST_PORT_PAIRS:
       wss_host_port_pair = wss_active_host
     else:
@@ -166,17 +173,102 @@ def get_version_info():
     logging.info('version_info.json cannot be opened: ' + str(e))
   return None
 
+# version_info.json is written at build time, so it is read once per process.
+version_info_json = None
+
+def get_version_info_json():
+  global version_info_json
+  if version_info_json is None:
+    version_info_json = json.dumps(get_version_info())
+  return version_info_json
+
+# The query parameters that the room independent parameters depend on. They
+# also depend on the user agent, through get_hd_default.
+ROOM_PARAMETER_QUERY_KEYS = (
+    'it', 'tt', 'ts', 'apikey', 'audio', 'video', 'firefox_fake_device', 'hd',
+    'minre', 'maxre', 'dtls', 'dscp', 'ipv6', 'debug')
+
+# Caches the room independent parameters of the most common URL variants.
+room_parameters_cache = lru_cache.LruCache(
+    constants.ROOM_PARAMETERS_CACHE_SIZE)
+
 # Returns appropriate room parameters based on query parameters in the request.
 # TODO(tkchin): move query parameter parsing to JS code.
 def get_room_parameters(request, room_id, client_id, is_initiator):
+  user_agent = request.headers['User-Agent']
+  key = tuple(request.get(name, default_value=None)
+              for name in ROOM_PARAMETER_QUERY_KEYS)
+  key += (get_hd_default(user_agent),)
+  # The cached parameters are shared, copy them before adding to them.
+  params = dict(room_parameters_cache.get(
+      key, lambda: get_room_independent_parameters(request)))
+  params['error_messages'] = list(params['error_messages'])
+  params['warning_messages'] = list(params['warning_messages'])
+
+  wss_url, wss_post_url = get_wss_parameters(request)
+  params['wss_url'] = wss_url
+  params['wss_post_url'] = wss_post_url
+
+  if room_id is not None:
+    room_link = maybe_use_https_host_url(request) + '/r/' + room_id
+    room_link = append_url_arguments(request, room_link)
+    params['room_id'] = room_id
+    params['room_link'] = room_link
+  if client_id is not None:
+    params['client_id'] = client_id
+  if is_initiator is not None:
+    params['is_initiator'] = json.dumps(is_initiator)
+  add_ice_servers(request, params)
+  return params
+
+def get_default_ice_server_url():
+  return constants.ICE_SERVER_URL_TEMPLATE % \
+      (constants.ICE_SERVER_BASE_URL, constants.ICE_SERVER_API_KEY)
+
+# Unless TURN credentials are minted, the ICE servers served by this app only
+# depend on constants, so they are built once per process.
+static_ice_servers = None
+
+def get_static_ice_servers():
+  global static_ice_servers
+  if static_ice_servers is None:
+    if constants.ICE_SERVER_OVERRIDE:
+      static_ice_servers = constants.ICE_SERVER_OVERRIDE
+    else:
+      static_ice_servers = [{'urls': constants.ICE_SERVER_URLS}]
+  return static_ice_servers
+
+def get_ice_servers(ice_server_url, now):
+  """Returns the ICE servers known without a request of the client: the
+  override, the minted TURN servers, or the cached ICE servers of the default
+  ICE server provider. Clients keep requesting other providers."""
+  if constants.ICE_SERVER_OVERRIDE:
+    return get_static_ice_servers()
+  if ice_server_url != get_default_ice_server_url():
+    return None
+  if turn_credentials.is_enabled():
+    return turn_credentials.get_ice_servers(now)[0]
+  return ice_config.get_ice_servers(ice_server_url)
+
+def add_ice_servers(request, params):
+  """Adds the ICE servers, filtered and ordered for the client, to the peer
+  connection config, so that the client does not request them."""
+  ice_servers = get_ice_servers(params['ice_server_url'], time.time())
+  if not ice_servers:
+    return
+  pc_config = json.loads(params['pc_config'])
+  pc_config['iceServers'] = ice_filter.get_ice_servers(
+      ice_servers, params['ice_server_transports'],
+      pc_config.get('iceTransports'), request.remote_addr)
+  params['pc_config'] = json.dumps(pc_config)
+
+def get_room_independent_parameters(request):
+  """Returns the parameters that only depend on the query parameters in
+  ROOM_PARAMETER_QUERY_KEYS and the user agent class."""
   error_messages = []
   warning_messages = []
-  # Get the base url without arguments.
-  base_url = request.path_url
   user_agent = request.headers['User-Agent']
 
-  # HTML or JSON.
-  response_type = request.get('t')
   # Which ICE candidates to allow. This is useful for forcing a call to run
   # over TURN, by setting it=relay.
   ice_transports = request.get('it')
@@ -254,14 +346,7 @@ def get_room_parameters(request, room_id, client_id, is_initiator):
   if debug == 'loopback':
     # Set dtls to false as DTLS does not work for loopback.
     dtls = 'false'
-    include_loopback_js = '<script src="/js/loopback.js"></script>'
-  else:
-    include_loopback_js = ''
 
-  # TODO(tkchin): We want to provide a ICE request url on the initial get,
-  # but we don't provide client_id until a join. For now just generate
-  # a random id, but we should make this better.
-  username = client_id if client_id is not None else generate_random(9)
   if len(ice_server_base_url) > 0:
     api_key = request.get('apikey', default_value=constants.ICE_SERVER_API_KEY)
     ice_server_url = constants.ICE_SERVER_URL_TEMPLATE % \
@@ -278,7 +363,6 @@ def get_room_parameters(request, room_id, client_id, is_initiator):
   offer_options = {}
   media_constraints = make_media_stream_constraints(audio, video,
                                                     firefox_fake_device)
-  wss_url, wss_post_url = get_wss_parameters(request)
 
   bypass_join_confirmation = 'BYPASS_JOIN_CONFIRMATION' in os.environ and \
       os.environ['BYPASS_JOIN_CONFIRMATION'] == 'True'
@@ -294,45 +378,49 @@ def get_room_parameters(request, room_id, client_id, is_initiator):
     'media_constraints': json.dumps(media_constraints),
     'ice_server_url': ice_server_url,
     'ice_server_transports': ice_server_transports,
-    'include_loopback_js' : include_loopback_js,
-    'wss_url': wss_url,
-    'wss_post_url': wss_post_url,
     'bypass_join_confirmation': json.dumps(bypass_join_confirmation),
-    'version_info': json.dumps(get_version_info())
+    'version_info': get_version_info_json()
   }
-
-  if room_id is not None:
-    room_link = maybe_use_https_host_url(request) + '/r/' + room_id
-    room_link = append_url_arguments(request, room_link)
-    params['room_id'] = room_id
-    params['room_link'] = room_link
-  if client_id is not None:
-    params['client_id'] = client_id
-  if is_initiator is not None:
-    params['is_initiator'] = json.dumps(is_initiator)
   return params
 
-# For now we have (room_id, client_id) pairs are 'unique' but client_ids are
-# not. Uniqueness is not enforced however and bad things may happen if RNG
-# generates non-unique numbers. We also have a special loopback client id.
-# TODO(tkchin): Generate room/client IDs in a unique way while handling
-# loopback scenario correctly.
-class Client:
-  def __init__(self, is_initiator):
+# Client IDs are unique within their room: they are drawn from a CSPRNG, see
+# id_allocator.py, IDs already in the room are drawn again, see
+# generate_client_id, and the room CAS that adds a client fails if another
+# client joined in the meantime. The loopback client has the reserved
+# LOOPBACK_CLIENT_ID.
+# Messages of a client are not stored in the room, but in its inbox, see
+# message_inbox.py.
+# Rooms are stored with encode_room() rather than pickled, see below.
+class Client(object):
+  __slots__ = ('is_initiator', 'inbox_epoch', 'legacy_messages')
+  def __init__(self, is_initiator=False, inbox_epoch=0):
     self.is_initiator = is_initiator
-    self.messages = []
-  def add_message(self, msg):
-    self.messages.append(msg)
-  def clear_messages(self):
-    self.messages = []
+    self.inbox_epoch = inbox_epoch
+    # Messages saved in clients pickled before the versioned encoding. They
+    # are not encoded, but handed to the client joining the room.
+    self.legacy_messages = []
   def set_initiator(self, initiator):
     self.is_initiator = initiator
+  def start_new_inbox(self):
+    self.inbox_epoch += 1
+  def __getstate__(self):
+    return {'is_initiator': self.is_initiator,
+            'inbox_epoch': self.inbox_epoch,
+            'messages': self.legacy_messages}
+  def __setstate__(self, state):
+    # Also restores clients pickled before the versioned encoding.
+    self.is_initiator = state.get('is_initiator', False)
+    self.inbox_epoch = state.get('inbox_epoch', 0)
+    self.legacy_messages = state.get('messages', [])
   def __str__(self):
-    return '{%r, %d}' % (self.is_initiator, len(self.messages))
+    return '{%r, %d}' % (self.is_initiator, self.inbox_epoch)
 
-class Room:
+class Room(object):
+  __slots__ = ('clients', 'last_activity')
   def __init__(self):
     self.clients = {}
+    # When a client last joined or left, in seconds since the epoch.
+    self.last_activity = 0
   def add_client(self, client_id, client):
     self.clients[client_id] = client
   def remove_client(self, client_id):
@@ -348,74 +436,147 @@ class Room:
       if key is not client_id:
         return client
     return None
+  def get_other_client_id(self, client_id):
+    for key in self.clients.keys():
+      if key != client_id:
+        return key
+    return None
+  def __getstate__(self):
+    return {'clients': self.clients, 'last_activity': self.last_activity}
+  def __setstate__(self, state):
+    # Also restores rooms pickled before the versioned encoding.
+    self.clients = state.get('clients', {})
+    self.last_activity = state.get('last_activity', 0)
   def __str__(self):
     return str(self.clients.keys())
 
+# Rooms are stored as '<version>|<last_activity>|<client>,<client>' where
+# every client is '<client_id>:<is_initiator>:<inbox_epoch>'. This is several
+# times smaller and faster than pickling the Room. Bump the version when
+# changing the format, and keep decoding the previous one until the rooms
+# written with it have expired. Version 1 had no last_activity.
+ROOM_ENCODING_VERSION = '2'
+
+def encode_room(room):
+  return '%s|%d|%s' % (ROOM_ENCODING_VERSION, room.last_activity, ','.join(
+      '%s:%d:%d' % (client_id, client.is_initiator, client.inbox_epoch)
+      for client_id, client in room.clients.iteritems()))
+
+def decode_room(value):
+  """Returns the Room for a value returned by the room store, or None."""
+  if value is None or isinstance(value, Room):
+    # Rooms written before the versioned encoding are unpickled by memcache.
+    return value
+  version, _, payload = value.partition('|')
+  room = Room()
+  if version == ROOM_ENCODING_VERSION:
+    last_activity, _, payload = payload.partition('|')
+    room.last_activity = int(last_activity)
+  elif version != '1':
+    raise ValueError('Unsupported room encoding version: ' + version)
+  if payload:
+    for entry in payload.split(','):
+      client_id, is_initiator, inbox_epoch = entry.split(':')
+      room.add_client(client_id,
+                      Client(is_initiator == '1', int(inbox_epoch)))
+  return room
+
 def get_memcache_key_for_room(host, room_id):
   return '%s/%s' % (host, room_id)
 
+def get_inbox_key_for_client(room_key, room, client_id):
+  return message_inbox.get_inbox_key(
+      room_key, client_id, room.get_client(client_id).inbox_epoch)
+
+def generate_client_id(room):
+  """Returns a new client ID that is not used in room. The ID is reserved by
+  the CAS that adds the client to the room."""
+  while True:
+    client_id = generate_random(constants.CLIENT_ID_LENGTH)
+    if (not room.has_client(client_id) and
+        client_id != constants.LOOPBACK_CLIENT_ID):
+      return client_id
+
+# Adds a client to a room. If client_id is None, a new client ID is allocated
+# and returned in the result.
 def add_client_to_room(request, room_id, client_id, is_loopback):
   key = get_memcache_key_for_room(request.host_url, room_id)
-  memcache_client = memcache.Client()
-  error = None
-  retries = 0
-  room = None
-  # Compare and set retry loop.
-  while True:
+  store = room_store.create_room_store()
+
+  def attempt(retries):
     is_initiator = None
     messages = []
-    room_state = ''
-    room = memcache_client.gets(key)
+    room = decode_room(store.gets(key))
     if room is None:
       # 'set' and another 'gets' are needed for CAS to work.
-      if not memcache_client.set(key, Room()):
-        logging.warning('memcache.Client.set failed for key ' + key)
-        error = constants.RESPONSE_ERROR
-        break
-      room = memcache_client.gets(key)
+      if not store.set(key, encode_room(Room())):
+        logging.warning('RoomStore.set failed for key ' + key)
+        return {'error': constants.RESPONSE_ERROR, 'is_initiator': None,
+                'messages': [], 'room_state': str(room)}
+      room = decode_room(store.gets(key))
 
     occupancy = room.get_occupancy()
     if occupancy >= 2:
-      error = constants.RESPONSE_ROOM_FULL
-      break
-    if room.has_client(client_id):
-      error = constants.RESPONSE_DUPLICATE_CLIENT
-      break
+      return {'error': constants.RESPONSE_ROOM_FULL, 'is_initiator': None,
+              'messages': [], 'room_state': str(room)}
+    new_client_id = client_id
+    if new_client_id is None:
+      new_client_id = generate_client_id(room)
+    elif room.has_client(new_client_id):
+      return {'error': constants.RESPONSE_DUPLICATE_CLIENT,
+              'is_initiator': None, 'messages': [], 'room_state': str(room)}
 
     if occupancy == 0:
       is_initiator = True
-      room.add_client(client_id, Client(is_initiator))
+      room.add_client(new_client_id, Client(is_initiator))
       if is_loopback:
         room.add_client(constants.LOOPBACK_CLIENT_ID, Client(False))
     else:
       is_initiator = False
-      other_client = room.get_other_client(client_id)
-      messages = other_client.messages
-      room.add_client(client_id, Client(is_initiator))
-      other_client.clear_messages()
-
-    if memcache_client.cas(key, room, constants.ROOM_MEMCACHE_EXPIRATION_SEC):
-      logging.info('Added client %s in room %s, retries = %d' \
-          %(client_id, room_id, retries))
-
-      if room.get_occupancy() == 2:
-        analytics.report_event(analytics.EventType.ROOM_SIZE_2,
-                               room_id,
-                               host=request.host)
-      success = True
-      break
-    else:
-      retries = retries + 1
-  return {'error': error, 'is_initiator': is_initiator,
-          'messages': messages, 'room_state': str(room)}
+      other_client_id = room.get_other_client_id(new_client_id)
+      # Saved in the room before the inbox, so they come first.
+      messages = list(room.get_client(other_client_id).legacy_messages)
+      room.add_client(new_client_id, Client(is_initiator))
+
+    room.last_activity = int(time.time())
+    if not store.cas(key, encode_room(room),
+                     constants.ROOM_MEMCACHE_EXPIRATION_SEC):
+      return cas_retry.RETRY
+    logging.info('Added client %s in room %s, retries = %d' \
+        %(new_client_id, room_id, retries))
+    room_index.add_room(store, key, room.last_activity)
+    changes = room_stats.get_occupancy_changes(occupancy, room.get_occupancy())
+    changes[room_stats.JOINS] = 1
+    room_stats.record(store, changes)
+
+    if not is_initiator:
+      # Hand off the messages the other client sent while it was alone.
+      messages.extend(message_inbox.drain_messages(
+          store, get_inbox_key_for_client(key, room, other_client_id)))
+      if constants.COALESCE_CANDIDATE_MESSAGES:
+        messages = message_inbox.coalesce_candidates(messages)
+
+    if room.get_occupancy() == 2:
+      analytics.report_event(analytics.EventType.ROOM_SIZE_2,
+                             room_id,
+                             host=request.host)
+    return {'error': None, 'is_initiator': is_initiator,
+            'messages': messages, 'room_state': str(room),
+            'client_id': new_client_id}
+
+  # Compare and set retry loop.
+  try:
+    return cas_retry.run_cas_loop(key, attempt)
+  except cas_retry.CasRetryLimitExceeded:
+    return {'error': constants.RESPONSE_ERROR, 'is_initiator': None,
+            'messages': [], 'room_state': ''}
 
 def remove_client_from_room(host, room_id, client_id):
   key = get_memcache_key_for_room(host, room_id)
-  memcache_client = memcache.Client()
-  retries = 0
-  # Compare and set retry loop.
-  while True:
-    room = memcache_client.gets(key)
+  store = room_store.create_room_store()
+
+  def attempt(retries):
+    room = decode_room(store.gets(key))
     if room is None:
       logging.warning('remove_client_from_room: Unknown room ' + room_id)
       return {'error': constants.RESPONSE_UNKNOWN_ROOM, 'room_state': None}
@@ -424,49 +585,238 @@ def remove_client_from_room(host, room_id, client_id):
           ' for room ' + room_id)
       return {'error': constants.RESPONSE_UNKNOWN_CLIENT, 'room_state': None}
 
+    stale_inbox_keys = [get_inbox_key_for_client(key, room, client_id)]
+    old_occupancy = room.get_occupancy()
     room.remove_client(client_id)
     if room.has_client(constants.LOOPBACK_CLIENT_ID):
       room.remove_client(constants.LOOPBACK_CLIENT_ID)
     if room.get_occupancy() > 0:
-      room.get_other_client(client_id).set_initiator(True)
+      other_client_id = room.get_other_client_id(client_id)
+      stale_inbox_keys.append(
+          get_inbox_key_for_client(key, room, other_client_id))
+      other_client = room.get_client(other_client_id)
+      other_client.set_initiator(True)
+      # The other client is alone again, its messages go to a fresh inbox.
+      other_client.start_new_inbox()
+      room.last_activity = int(time.time())
     else:
       room = None
 
-    if memcache_client.cas(key, room, constants.ROOM_MEMCACHE_EXPIRATION_SEC):
-      logging.info('Removed client %s from room %s, retries=%d' \
-          %(client_id, room_id, retries))
-      return {'error': None, 'room_state': str(room)}
-    retries = retries + 1
+    # An empty room is stored as None, which is treated as a missing room.
+    value = encode_room(room) if room is not None else None
+    if not store.cas(key, value, constants.ROOM_MEMCACHE_EXPIRATION_SEC):
+      return cas_retry.RETRY
+    logging.info('Removed client %s from room %s, retries=%d' \
+        %(client_id, room_id, retries))
+    if room is not None:
+      room_index.add_room(store, key, room.last_activity)
+    changes = room_stats.get_occupancy_changes(
+        old_occupancy, room.get_occupancy() if room is not None else 0)
+    changes[room_stats.LEAVES] = 1
+    room_stats.record(store, changes)
+    for inbox_key in stale_inbox_keys:
+      message_inbox.delete_inbox(store, inbox_key)
+    return {'error': None, 'room_state': str(room)}
+
+  # Compare and set retry loop.
+  try:
+    return cas_retry.run_cas_loop(key, attempt)
+  except cas_retry.CasRetryLimitExceeded:
+    return {'error': constants.RESPONSE_ERROR, 'room_state': None}
+
+def is_idle_room(room, now, has_messages=False):
+  """Returns whether a room can be deleted by the sweeper. Clients in a call
+  do not touch their room, nor do waiting clients that save messages, so
+  those rooms are only idle once they would have expired."""
+  if room.get_occupancy() >= 2 or has_messages:
+    timeout_sec = constants.ROOM_MEMCACHE_EXPIRATION_SEC
+  else:
+    timeout_sec = constants.ROOM_IDLE_TIMEOUT_SEC
+  return room.last_activity + timeout_sec <= now
+
+def room_has_messages(store, key, room):
+  """Returns whether a client of a room saved messages for the next one."""
+  if any(client.legacy_messages for client in room.clients.itervalues()):
+    return True
+  return message_inbox.has_messages(
+      store, [get_inbox_key_for_client(key, room, client_id)
+              for client_id in room.clients])
+
+def delete_idle_room(store, key, now):
+  """Deletes a room and the messages saved in it, unless a client joined or
+  left it in the meantime. Returns whether the room is gone."""
+  def attempt(retries):
+    room = decode_room(store.gets(key))
+    if room is None:
+      return True
+    if not is_idle_room(room, now, room_has_messages(store, key, room)):
+      return False
+    if not store.cas(key, None, constants.ROOM_MEMCACHE_EXPIRATION_SEC):
+      return cas_retry.RETRY
+    logging.info('Deleted idle room %s with state %s' % (key, str(room)))
+    room_stats.record(
+        store, room_stats.get_occupancy_changes(room.get_occupancy(), 0))
+    for client_id in room.clients:
+      message_inbox.delete_inbox(
+          store, get_inbox_key_for_client(key, room, client_id))
+    return True
 
-def save_message_from_client(host, room_id, client_id, message):
-  text = None
   try:
-      text = message.encode(encoding='utf-8', errors='strict')
-  except Exception as e:
-    return {'error': constants.RESPONSE_ERROR, 'saved': False}
+    return cas_retry.run_cas_loop(key, attempt)
+  except cas_retry.CasRetryLimitExceeded:
+    return False
+
+def sweep_idle_rooms(store, now):
+  """Deletes the idle rooms, see is_idle_room, of the buckets of the room
+  index that are due.
+
+  Returns:
+    A dict with the number of indexed rooms that were checked and deleted.
+  """
+  num_indexed = 0
+  num_deleted = 0
+  for bucket in room_index.get_buckets_to_sweep(store, now):
+    room_keys = room_index.get_rooms(store, bucket)
+    num_indexed += len(room_keys)
+    for batch in room_index.get_batches(room_keys):
+      rooms = store.get_multi(batch)
+      for key in batch:
+        room = decode_room(rooms.get(key))
+        # Rooms that were left by every client or expired are gone, and
+        # rooms added again are checked with their later bucket.
+        if (room is not None and is_idle_room(room, now) and
+            delete_idle_room(store, key, now)):
+          num_deleted += 1
+    room_index.set_swept_bucket(store, bucket)
+  logging.info('Deleted %d idle rooms of %d indexed rooms' \
+      %(num_deleted, num_indexed))
+  return {'indexed': num_indexed, 'deleted': num_deleted}
+
+LOOPBACK_CRYPTO_LINE_RE = re.compile(r'a=crypto:[1-9]+ .*\r\n')
+
+def save_message_from_client(host, room_id, client_id, message):
+  result = save_messages_from_client(host, room_id, client_id, [message])
+  if result['error'] is not None:
+    return {'error': result['error'], 'saved': False, 'loopback': False}
+  return {'error': result['messages'][0]['error'],
+          'saved': result['messages'][0]['saved'],
+          'loopback': result['loopback']}
+
+def save_messages_from_client(host, room_id, client_id, messages):
+  """Saves messages sent by a client for the other client of the room.
+
+  Returns:
+    A dict with the error of the whole request, if any, the list of the
+    results of the messages, in order, and whether the other client is the
+    loopback client. A message that is not saved and has no error must be
+    forwarded to collider, or echoed with get_loopback_messages in loopback
+    rooms.
+  """
+  texts = []
+  for message in messages:
+    try:
+      texts.append(message.encode(encoding='utf-8', errors='strict'))
+    except Exception as e:
+      return {'error': constants.RESPONSE_ERROR, 'messages': None,
+              'loopback': False}
 
   key = get_memcache_key_for_room(host, room_id)
-  memcache_client = memcache.Client()
-  retries = 0
-  # Compare and set retry loop.
-  while True:
-    room = memcache_client.gets(key)
-    if room is None:
-      logging.warning('Unknown room: ' + room_id)
-      return {'error': constants.RESPONSE_UNKNOWN_ROOM, 'saved': False}
-    if not room.has_client(client_id):
-      logging.warning('Unknown client: ' + client_id)
-      return {'error': constants.RESPONSE_UNKNOWN_CLIENT, 'saved': False}
-    if room.get_occupancy() > 1:
-      return {'error': None, 'saved': False}
-
-    client = room.get_client(client_id)
-    client.add_message(text)
-    if memcache_client.cas(key, room, constants.ROOM_MEMCACHE_EXPIRATION_SEC):
-      logging.info('Saved message for client %s:%s in room %s, retries=%d' \
-          %(client_id, str(client), room_id, retries))
-      return {'error': None, 'saved': True}
-    retries = retries + 1
+  store = room_store.create_room_store()
+  # Only the inbox is written, so the room does not need to be CAS-ed.
+  room = decode_room(store.get(key))
+  if room is None:
+    logging.warning('Unknown room: ' + room_id)
+    return {'error': constants.RESPONSE_UNKNOWN_ROOM, 'messages': None,
+            'loopback': False}
+  if not room.has_client(client_id):
+    logging.warning('Unknown client: ' + client_id)
+    return {'error': constants.RESPONSE_UNKNOWN_CLIENT, 'messages': None,
+            'loopback': False}
+  if room.get_occupancy() > 1:
+    room_stats.record(store, {room_stats.MESSAGES: len(texts)})
+    return {'error': None,
+            'messages': [{'error': None, 'saved': False}] * len(texts),
+            'loopback': room.has_client(constants.LOOPBACK_CLIENT_ID)}
+
+  inbox_key = get_inbox_key_for_client(key, room, client_id)
+  results = []
+  for result in message_inbox.append_messages(store, inbox_key, texts):
+    if result == message_inbox.FAILED:
+      results.append({'error': constants.RESPONSE_ERROR, 'saved': False})
+    elif result == message_inbox.FULL:
+      results.append(
+          {'error': constants.RESPONSE_MESSAGE_BACKLOG_FULL, 'saved': False})
+    elif result == message_inbox.SAVED:
+      results.append({'error': None, 'saved': True})
+    else:
+      # The other client joined in the meantime, the message must be
+      # forwarded.
+      results.append({'error': None, 'saved': False})
+  room_stats.record(store, {room_stats.MESSAGES: len(
+      [result for result in results if result['error'] is None])})
+  num_saved = len([result for result in results if result['saved']])
+  if num_saved:
+    logging.info('Saved %d messages for client %s in room %s' \
+        %(num_saved, client_id, room_id))
+  return {'error': None, 'messages': results, 'loopback': False}
+
+def get_loopback_messages(message):
+  """Returns the messages the loopback client answers a message with: an
+  answer reusing the SDP of an offer, or the same candidate."""
+  try:
+    message_obj = json.loads(message)
+  except ValueError:
+    return []
+  if not isinstance(message_obj, dict):
+    return []
+  if message_obj.get('type') == 'offer':
+    sdp = message_obj.get('sdp', '').replace(
+        'a=ice-options:google-ice\r\n', '', 1)
+    # Chrome adds SDES crypto methods that a negotiated answer would drop,
+    # see https://bugs.chromium.org/p/chromium/issues/detail?id=616263.
+    sdp = LOOPBACK_CRYPTO_LINE_RE.sub('', sdp)
+    message_obj['type'] = 'answer'
+    message_obj['sdp'] = sdp
+    return [json.dumps(message_obj)]
+  if message_obj.get('type') == 'candidate':
+    return [message]
+  return []
+
+def wants_loopback_answers(request):
+  """Returns whether the client takes the answers of the loopback client from
+  the response, instead of through collider."""
+  return request.get(constants.LOOPBACK_ANSWERS_PARAM) == 'true'
+
+def start_forward_to_collider(request, room_id, client_id, payload):
+  """Starts posting a message to collider, which relays it to the other client
+  of the room. Several forwards can be started before waiting for them with
+  finish_forward_to_collider, so that they are made in parallel. The URL Fetch
+  service keeps the connections to the collider hosts alive between requests.
+
+  Returns:
+    The RPC to pass to finish_forward_to_collider.
+  """
+  logging.info('Forwarding message to collider for room ' + room_id +
+               ' client ' + client_id)
+  wss_url, wss_post_url = get_wss_parameters(request)
+  url = wss_post_url + '/' + room_id + '/' + client_id
+  rpc = urlfetch.create_rpc(deadline=constants.COLLIDER_FORWARD_DEADLINE_SEC)
+  urlfetch.make_fetch_call(rpc, url, payload=payload, method=urlfetch.POST)
+  return rpc
+
+def finish_forward_to_collider(rpc):
+  """Waits for a forward started by start_forward_to_collider. Returns whether
+  collider accepted the message."""
+  try:
+    result = rpc.get_result()
+  except urlfetch.Error as e:
+    logging.error('Failed to send message to collider: %s' % str(e))
+    return False
+  if result.status_code != 200:
+    logging.error(
+        'Failed to send message to collider: %d' % (result.status_code))
+    return False
+  return True
 
 class LeavePage(webapp2.RequestHandler):
   def post(self, room_id, client_id):
@@ -476,21 +826,17 @@ class LeavePage(webapp2.RequestHandler):
       logging.info('Room ' + room_id + ' has state ' + result['room_state'])
 
 class MessagePage(webapp2.RequestHandler):
-  def write_response(self, result):
-    content = json.dumps({ 'result' : result })
-    self.response.write(content)
+  def write_response(self, result, messages=None):
+    response = { 'result' : result }
+    if messages is not None:
+      response['messages'] = messages
+    self.response.write(json.dumps(response))
 
   def send_message_to_collider(self, room_id, client_id, message):
-    logging.info('Forwarding message to collider for room ' + room_id +
-                 ' client ' + client_id)
-    wss_url, wss_post_url = get_wss_parameters(self.request)
-    url = wss_post_url + '/' + room_id + '/' + client_id
-    result = urlfetch.fetch(url=url,
-                            payload=message,
-                            method=urlfetch.POST)
-    if result.status_code != 200:
-      logging.error(
-          'Failed to send message to collider: %d' % (result.status_code))
+    # The response tells whether collider accepted the message, so there is
+    # nothing to do while waiting for it.
+    rpc = start_forward_to_collider(self.request, room_id, client_id, message)
+    if not finish_forward_to_collider(rpc):
       # TODO(tkchin): better error handling.
       self.error(500)
       return
@@ -503,16 +849,78 @@ class MessagePage(webapp2.RequestHandler):
     if result['error'] is not None:
       self.write_response(result['error'])
       return
-    if not result['saved']:
+    if result['loopback'] and wants_loopback_answers(self.request):
+      # Answer for the loopback client in the response, instead of a round
+      # trip through collider to the same browser.
+      self.write_response(constants.RESPONSE_SUCCESS,
+                          get_loopback_messages(message_json))
+    elif not result['saved']:
       # Other client joined, forward to collider. Do this outside the lock.
       # Note: this may fail in local dev server due to not having the right
       # certificate file locally for SSL validation.
-      # Note: loopback scenario follows this code path.
-      # TODO(tkchin): consider async fetch here.
       self.send_message_to_collider(room_id, client_id, message_json)
     else:
       self.write_response(constants.RESPONSE_SUCCESS)
 
+class MessageBatchPage(webapp2.RequestHandler):
+  """Handles an ordered JSON array of messages in one request. Messages are
+  saved together, and the ones for a present client are forwarded to
+  collider with one POST per message, made in parallel, so that the other
+  client still gets one message per frame. In loopback rooms the answers of
+  the loopback client are returned instead, if the client asks for them."""
+
+  def write_response(self, result, results=None, messages=None):
+    response = { 'result' : result }
+    if results is not None:
+      response['results'] = results
+    if messages is not None:
+      response['messages'] = messages
+    self.response.write(json.dumps(response))
+
+  def post(self, room_id, client_id):
+    try:
+      messages = json.loads(self.request.body)
+    except ValueError:
+      messages = None
+    if (not isinstance(messages, list) or not messages or
+        len(messages) > constants.MAX_MESSAGES_PER_BATCH or
+        not all(isinstance(message, dict) for message in messages)):
+      self.write_response(constants.RESPONSE_INVALID_REQUEST)
+      return
+
+    texts = [json.dumps(message) for message in messages]
+    result = save_messages_from_client(
+        self.request.host_url, room_id, client_id, texts)
+    if result['error'] is not None:
+      self.write_response(result['error'])
+      return
+
+    forwarded_indices = [
+        index for index, message_result in enumerate(result['messages'])
+        if message_result['error'] is None and not message_result['saved']]
+    rpcs = {}
+    loopback_messages = None
+    if result['loopback'] and wants_loopback_answers(self.request):
+      loopback_messages = []
+      for index in forwarded_indices:
+        loopback_messages.extend(get_loopback_messages(texts[index]))
+    else:
+      # All the forwards are started before waiting for any of them.
+      for index in forwarded_indices:
+        rpcs[index] = start_forward_to_collider(
+            self.request, room_id, client_id, texts[index])
+
+    results = []
+    for message_result in result['messages']:
+      if message_result['error'] is not None:
+        results.append(message_result['error'])
+      else:
+        results.append(constants.RESPONSE_SUCCESS)
+    for index, rpc in rpcs.iteritems():
+      if not finish_forward_to_collider(rpc):
+        results[index] = constants.RESPONSE_ERROR
+    self.write_response(constants.RESPONSE_SUCCESS, results, loopback_messages)
+
 class JoinPage(webapp2.RequestHandler):
   def write_response(self, result, params, messages):
     # TODO(tkchin): Clean up response format. For simplicity put everything in
@@ -528,15 +936,16 @@ class JoinPage(webapp2.RequestHandler):
     self.write_response('SUCCESS', params, messages)
 
   def post(self, room_id):
-    client_id = generate_random(8)
     is_loopback = self.request.get('debug') == 'loopback'
-    result = add_client_to_room(self.request, room_id, client_id, is_loopback)
+    result = add_client_to_room(self.request, room_id, None, is_loopback)
     if result['error'] is not None:
       logging.info('Error adding client to room: ' + result['error'] + \
           ', room_state=' + result['room_state'])
       self.write_response(result['error'], {}, [])
       return
 
+    client_id = result['client_id']
+
     self.write_room_parameters(
         room_id, client_id, result['messages'], result['is_initiator'])
     logging.info('User ' + client_id + ' joined room ' + room_id)
@@ -544,8 +953,7 @@ class JoinPage(webapp2.RequestHandler):
 
 class MainPage(webapp2.RequestHandler):
   def write_response(self, target_page, params={}):
-    template = jinja_environment.get_template(target_page)
-    content = template.render(params)
+    content = template_cache.render_page(target_page, params)
     self.response.out.write(content)
 
   def get(self):
@@ -559,16 +967,15 @@ class MainPage(webapp2.RequestHandler):
 
 class RoomPage(webapp2.RequestHandler):
   def write_response(self, target_page, params={}):
-    template = jinja_environment.get_template(target_page)
-    content = template.render(params)
+    content = template_cache.render_page(target_page, params)
     self.response.out.write(content)
 
   def get(self, room_id):
     """Renders index.html or full.html."""
     checkIfRedirect(self)
     # Check if room is full.
-    room = memcache.get(
-        get_memcache_key_for_room(maybe_use_https_host_url(self.request), room_id))
+    room = decode_room(room_store.create_room_store().get(
+        get_memcache_key_for_room(maybe_use_https_host_url(self.request), room_id)))
     if room is not None:
       logging.info('Room ' + room_id + ' has state ' + str(room))
       if room.get_occupancy() >= 2:
@@ -581,6 +988,109 @@ class RoomPage(webapp2.RequestHandler):
     # so the client will launch the requested room.
     self.write_response('index_template.html', params)
 
+class SweepRoomsPage(webapp2.RequestHandler):
+  """Deletes idle rooms, run by cron."""
+
+  def get(self):
+    result = sweep_idle_rooms(room_store.create_room_store(), time.time())
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.write(json.dumps(result))
+
+class RefreshIceConfigPage(webapp2.RequestHandler):
+  """Fetches the ICE servers of the default ICE server provider when they are
+  due for refresh, run by cron."""
+
+  def get(self):
+    if constants.ICE_SERVER_OVERRIDE or turn_credentials.is_enabled():
+      return
+    ice_config.refresh_ice_servers(get_default_ice_server_url())
+
+class MetricsPage(webapp2.RequestHandler):
+  """Exports the request metrics of this instance."""
+
+  def get(self):
+    self.response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+    self.response.write(request_metrics.registry.format_metrics())
+
+class ProfilePage(webapp2.RequestHandler):
+  """Downloads the merged profile of a route, or lists the number of
+  profiles of every profiled route."""
+
+  def get(self):
+    route = self.request.get('route')
+    if not route:
+      self.response.headers['Content-Type'] = 'application/json'
+      self.response.write(json.dumps(request_profiler.get_profile_counts(),
+                                     indent=2, sort_keys=True))
+      return
+    if route not in constants.PROFILED_ROUTES:
+      self.error(404)
+      return
+    profile = request_profiler.get_profile(route)
+    if profile is None:
+      self.error(404)
+      return
+    self.response.headers['Content-Type'] = 'application/octet-stream'
+    self.response.headers['Content-Disposition'] = str(
+        'attachment; filename="apprtc%s.prof"' %
+        route.replace('/', '_').rstrip('_'))
+    self.response.write(profile)
+
+  def delete(self):
+    request_profiler.delete_profiles()
+
+class ColliderHistoryPage(webapp2.RequestHandler):
+  """Reports the active collider host and the recent probes of every collider
+  host."""
+
+  def get(self):
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.write(json.dumps({
+        'active_host': memcache.get(constants.WSS_HOST_ACTIVE_HOST_KEY),
+        'histories': probers.get_probe_histories()
+    }, indent=2, sort_keys=True))
+
+class IceServerHealthPage(webapp2.RequestHandler):
+  """Reports, or lets monitoring report, the health of ICE servers as a JSON
+  object mapping host:port to objects with 'is_up' and optionally 'rtt_ms'."""
+
+  def get(self):
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.write(json.dumps(ice_filter.get_health(), indent=2,
+                                   sort_keys=True))
+
+  def post(self):
+    try:
+      health = json.loads(self.request.body)
+    except ValueError:
+      health = None
+    if not ice_filter.is_valid_health(health):
+      self.error(400)
+      return
+    ice_filter.set_health(health)
+
+class StatsPage(webapp2.RequestHandler):
+  """Reports room statistics, and the CAS contention of this instance. Rates
+  are averaged since the time and totals of earlier statistics, passed in the
+  time, joins, leaves and messages query parameters."""
+
+  def get_previous_stats(self):
+    try:
+      return {
+          'time': float(self.request.get('time')),
+          'totals': dict((event, long(self.request.get(event)))
+                         for event in room_stats.EVENTS)
+      }
+    except ValueError:
+      return None
+
+  def get(self):
+    stats = room_stats.get_stats(room_store.create_room_store(), time.time(),
+                                 self.get_previous_stats())
+    stats['cas_contention'] = cas_retry.contention_stats.get_stats()
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.write(json.dumps(stats, indent=2, sort_keys=True))
+
 class ParamsPage(webapp2.RequestHandler):
   def get(self):
     # Return room independent room parameters.
@@ -600,24 +1110,42 @@ def checkIfRedirect(self):
     redirect_url = constants.REDIRECT_URL + self.request.path + parsed_args
     webapp2.redirect(redirect_url, permanent=True, abort=True)
 
+def get_ice_configuration(request, now):
+  """Returns the ICE configuration served to clients, filtered and ordered by
+  the tt and it query parameters and the address of the client."""
+  configuration = {}
+  if not constants.ICE_SERVER_OVERRIDE and turn_credentials.is_enabled():
+    ice_servers, expiry = turn_credentials.get_ice_servers(now)
+    configuration['lifetimeDuration'] = '%ds' % (expiry - int(now))
+  else:
+    ice_servers = get_static_ice_servers()
+  configuration['iceServers'] = ice_filter.get_ice_servers(
+      ice_servers, request.get('tt'), request.get('it'), request.remote_addr)
+  return configuration
+
 class IceConfigurationPage(webapp2.RequestHandler):
   def post(self):
-    ice_config = {}
-    if constants.ICE_SERVER_OVERRIDE:
-      ice_config = {"iceServers": constants.ICE_SERVER_OVERRIDE}
-    else:
-      ice_config = {"iceServers": [{"urls": constants.ICE_SERVER_URLS}]}
-    self.response.write(json.dumps(ice_config))
+    self.response.write(json.dumps(
+        get_ice_configuration(self.request, time.time())))
 
 
-app = webapp2.WSGIApplication([
+app = request_metrics.MetricsMiddleware(
+    request_profiler.ProfilerMiddleware(webapp2.WSGIApplication([
     ('/', MainPage),
     ('/a/', analytics_page.AnalyticsPage),
+    ('/admin/collider_history', ColliderHistoryPage),
+    ('/admin/ice_server_health', IceServerHealthPage),
+    ('/admin/metrics', MetricsPage),
+    ('/admin/profile', ProfilePage),
+    ('/admin/refresh_ice_config', RefreshIceConfigPage),
+    ('/admin/stats', StatsPage),
+    ('/admin/sweep_rooms', SweepRoomsPage),
     ('/compute/(\w+)/(\S+)/(\S+)', compute_page.ComputePage),
     ('/join/([a-zA-Z0-9-_]+)', JoinPage),
     ('/leave/([a-zA-Z0-9-_]+)/([a-zA-Z0-9-_]+)', LeavePage),
     ('/message/([a-zA-Z0-9-_]+)/([a-zA-Z0-9-_]+)', MessagePage),
+    ('/messages/([a-zA-Z0-9-_]+)/([a-zA-Z0-9-_]+)', MessageBatchPage),
     ('/params', ParamsPage),
     ('/v1alpha/iceconfig', IceConfigurationPage),
     ('/r/([a-zA-Z0-9-_]+)', RoomPage),
-], debug=True)
+], debug=True)), 'apprtc')
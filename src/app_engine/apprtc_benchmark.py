@@ -0,0 +1,147 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+"""Benchmarks of the functions on the signaling path of apprtc.py.
+
+Rooms are stored in the in-process room store, and the active collider host
+is read from the memcache stub. Run with build/run_python_benchmarks.py, which
+can compare the results to those of an earlier run.
+"""
+
+import json
+
+import webapp2
+
+import analytics
+import apprtc
+import benchmark_util
+import constants
+import ice_config
+import probers
+import room_store
+
+from google.appengine.api import memcache
+from google.appengine.ext import testbed
+
+NUMBER = 2000
+ROOM_URL = '/r/benchmark?hd=true&audio=googEchoCancellation=false&stereo=true'
+ICE_SERVERS = [{'urls': ['turn:turn.example.com:3478?transport=udp',
+                         'turn:turn.example.com:3478?transport=tcp'],
+                'username': '1456789012:benchmark',
+                'credential': 'c2VjcmV0c2VjcmV0c2VjcmV0'}]
+USER_AGENT = ('Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/47.0.2526.73 Safari/537.36')
+
+
+def make_request(path):
+  return webapp2.Request.blank(path, headers={'User-Agent': USER_AGENT})
+
+
+def run_with_stubs(function):
+  """Runs function with the memcache stub, the in-process room store, cached
+  ICE servers and no analytics."""
+  bed = testbed.Testbed()
+  bed.activate()
+  bed.init_memcache_stub()
+  memcache.set(constants.WSS_HOST_ACTIVE_HOST_KEY,
+               constants.WSS_HOST_PORT_PAIRS[0])
+  probers.active_host_cache.invalidate()
+  ice_config.cache.set(apprtc.get_default_ice_server_url(), ICE_SERVERS, 3600)
+  backend = constants.ROOM_STORE_BACKEND
+  report_event = analytics.report_event
+  constants.ROOM_STORE_BACKEND = constants.ROOM_STORE_BACKEND_IN_PROCESS
+  analytics.report_event = lambda *args, **kwargs: None
+  try:
+    return function()
+  finally:
+    analytics.report_event = report_event
+    constants.ROOM_STORE_BACKEND = backend
+    room_store.InProcessRoomStore().flush_all()
+    probers.active_host_cache.invalidate()
+    ice_config.cache.clear()
+    bed.deactivate()
+
+
+def benchmark_get_room_parameters():
+  request = make_request(ROOM_URL)
+
+  def uncached():
+    apprtc.room_parameters_cache.clear()
+    return apprtc.get_room_parameters(request, 'benchmark', None, None)
+
+  def measure():
+    return {
+        'cached_usec': benchmark_util.time_per_call_usec(
+            lambda: apprtc.get_room_parameters(
+                request, 'benchmark', None, None), NUMBER),
+        'uncached_usec': benchmark_util.time_per_call_usec(
+            uncached, NUMBER)
+    }
+  return run_with_stubs(measure)
+
+
+def benchmark_make_media_stream_constraints():
+  return {
+      'default_usec': benchmark_util.time_per_call_usec(
+          lambda: apprtc.make_media_stream_constraints('', '', None),
+          NUMBER),
+      'constraints_usec': benchmark_util.time_per_call_usec(
+          lambda: apprtc.make_media_stream_constraints(
+              'googEchoCancellation=false,googAutoGainControl=true',
+              'mandatory:minWidth=1280,mandatory:minHeight=720', None),
+          NUMBER)
+  }
+
+
+def benchmark_append_url_arguments():
+  request = make_request(ROOM_URL)
+  return {
+      'append_usec': benchmark_util.time_per_call_usec(
+          lambda: apprtc.append_url_arguments(
+              request, 'https://localhost/r/benchmark'), NUMBER)
+  }
+
+
+def benchmark_call_setup():
+  """Times a join, a saved message, a second join and two leaves, and saving
+  messages."""
+  request = make_request('/join/benchmark')
+  host = request.host_url
+
+  def set_up_call():
+    caller = apprtc.add_client_to_room(request, 'benchmark', None, False)
+    apprtc.save_message_from_client(
+        host, 'benchmark', caller['client_id'], u'{"type":"offer"}')
+    callee = apprtc.add_client_to_room(request, 'benchmark', None, False)
+    apprtc.remove_client_from_room(host, 'benchmark', callee['client_id'])
+    apprtc.remove_client_from_room(host, 'benchmark', caller['client_id'])
+
+  def measure():
+    call_setup_usec = benchmark_util.time_per_call_usec(set_up_call, NUMBER)
+    caller_id = apprtc.add_client_to_room(
+        request, 'benchmark', None, False)['client_id']
+    # Stay under the saved message limit, so that every message is saved.
+    save_message_usec = benchmark_util.time_per_call_usec(
+        lambda: apprtc.save_message_from_client(
+            host, 'benchmark', caller_id, u'{"type":"candidate"}'),
+        constants.MAX_SAVED_MESSAGES_PER_CLIENT / benchmark_util.REPEAT)
+    return {
+        'call_setup_usec': call_setup_usec,
+        'save_message_usec': save_message_usec
+    }
+  return run_with_stubs(measure)
+
+
+def benchmark_join_response():
+  def measure():
+    params = apprtc.get_room_parameters(
+        make_request(ROOM_URL), 'benchmark', '12345678', False)
+    params['messages'] = ['{"type":"candidate","label":0,"id":"audio",'
+                          '"candidate":"candidate:1 1 udp 1 10.0.0.1 1 typ '
+                          'host"}'] * 10
+    response = {'result': constants.RESPONSE_SUCCESS, 'params': params}
+    return {
+        'bytes': len(json.dumps(response)),
+        'serialize_usec': benchmark_util.time_per_call_usec(
+            lambda: json.dumps(response), NUMBER)
+    }
+  return run_with_stubs(measure)
@@ -1,6 +1,8 @@
 # Copyright 2014 Google Inc. All Rights Reserved.
 
 import json
+import marshal
+import pickle
 import time
 import unittest
 
@@ -9,9 +11,18 @@ import webtest
 import analytics
 import apprtc
 import constants
+import ice_config
+import ice_filter
 import probers
+import request_profiler
+import room_store
 from test_util import CapturingFunction
+from test_util import FakeFetchResult
+from test_util import FakeRpc
+from test_util import OldClient
+from test_util import OldRoom
 from test_util import ReplaceFunction
+from test_util import run_with_old_room_classes
 
 from google.appengine.api import memcache
 from google.appengine.ext import testbed
@@ -38,6 +49,62 @@ class AppRtcUnitTest(unittest.TestCase):
     self.assertEqual(17, len(apprtc.generate_random(17)))
     self.assertEqual(23, len(apprtc.generate_random(23)))
 
+  def testGenerateClientIdSkipsClientsInRoom(self):
+    room = apprtc.Room()
+    room.add_client('a', apprtc.Client(True))
+    ids = ['a', constants.LOOPBACK_CLIENT_ID, 'b']
+    replacement = ReplaceFunction(
+        apprtc, 'generate_random', lambda length: ids.pop(0))
+    try:
+      self.assertEqual('b', apprtc.generate_client_id(room))
+    finally:
+      del replacement
+
+  def testEncodeAndDecodeRoom(self):
+    room = apprtc.Room()
+    room.add_client('123', apprtc.Client(True))
+    room.add_client('456', apprtc.Client(False, 3))
+    value = apprtc.encode_room(room)
+    self.assertTrue(value.startswith(apprtc.ROOM_ENCODING_VERSION + '|'))
+
+    decoded_room = apprtc.decode_room(value)
+    self.assertEqual(2, decoded_room.get_occupancy())
+    self.assertTrue(decoded_room.get_client('123').is_initiator)
+    self.assertEqual(0, decoded_room.get_client('123').inbox_epoch)
+    self.assertFalse(decoded_room.get_client('456').is_initiator)
+    self.assertEqual(3, decoded_room.get_client('456').inbox_epoch)
+
+  def testLastActivityIsEncoded(self):
+    room = apprtc.Room()
+    room.last_activity = 1234567890
+    room.add_client('123', apprtc.Client(True))
+    decoded_room = apprtc.decode_room(apprtc.encode_room(room))
+    self.assertEqual(1234567890, decoded_room.last_activity)
+
+  def testDecodeVersion1Room(self):
+    room = apprtc.decode_room('1|123:1:0,456:0:2')
+    self.assertEqual(2, room.get_occupancy())
+    self.assertEqual(2, room.get_client('456').inbox_epoch)
+    self.assertEqual(0, room.last_activity)
+
+  def testEncodeAndDecodeEmptyRoom(self):
+    room = apprtc.decode_room(apprtc.encode_room(apprtc.Room()))
+    self.assertEqual(0, room.get_occupancy())
+
+  def testDecodeRoom(self):
+    self.assertIsNone(apprtc.decode_room(None))
+    room = apprtc.Room()
+    self.assertIs(room, apprtc.decode_room(room))
+    self.assertRaises(ValueError, apprtc.decode_room, '0|123:1:0')
+
+  def testPickledRoomCanBeRestored(self):
+    room = apprtc.Room()
+    room.add_client('123', apprtc.Client(True, 2))
+    for protocol in xrange(pickle.HIGHEST_PROTOCOL + 1):
+      restored_room = pickle.loads(pickle.dumps(room, protocol))
+      self.assertTrue(restored_room.get_client('123').is_initiator)
+      self.assertEqual(2, restored_room.get_client('123').inbox_epoch)
+
 
 class AppRtcPageHandlerTest(unittest.TestCase):
 
@@ -52,6 +119,14 @@ class AppRtcPageHandlerTest(unittest.TestCase):
     self.testbed.init_memcache_stub()
 
     self.test_app = webtest.TestApp(apprtc.app)
+    probers.active_host_cache.invalidate()
+    apprtc.room_parameters_cache.clear()
+    ice_config.cache.clear()
+    ice_filter.health_cache.invalidate()
+    ice_filter.filtered_ice_servers_cache.clear()
+    apprtc.static_ice_servers = None
+    self.fetch_ice_config_replacement = ReplaceFunction(
+        ice_config, 'fetch_ice_config', CapturingFunction((None, None)))
 
     # Fake out event reporting.
     self.time_now = time.time()
@@ -65,6 +140,7 @@ class AppRtcPageHandlerTest(unittest.TestCase):
   def tearDown(self):
     self.testbed.deactivate()
     del self.report_event_replacement
+    del self.fetch_ice_config_replacement
 
   def makeGetRequest(self, path):
     # PhantomJS uses WebKit, so Safari is closest to the thruth.
@@ -87,6 +163,39 @@ class AppRtcPageHandlerTest(unittest.TestCase):
     self.assertEqual([], params['warning_messages'])
     return caller_id
 
+  def testOldPickledRoomCanBeRestored(self):
+    room = OldRoom()
+    room.clients['123'] = OldClient(True)
+    room.clients['123'].messages.append('offer')
+    room.clients['456'] = OldClient(False)
+
+    for protocol in xrange(pickle.HIGHEST_PROTOCOL + 1):
+      value = run_with_old_room_classes(
+          lambda: pickle.dumps(room, protocol))
+      self.assertIn('messages', value)
+      restored_room = apprtc.decode_room(pickle.loads(value))
+      self.assertIsInstance(restored_room, apprtc.Room)
+      self.assertEqual(0, restored_room.last_activity)
+      self.assertEqual('456', restored_room.get_other_client_id('123'))
+      client = restored_room.get_client('123')
+      self.assertTrue(client.is_initiator)
+      self.assertEqual(0, client.inbox_epoch)
+      self.assertEqual(['offer'], client.legacy_messages)
+      self.assertEqual(2, apprtc.decode_room(
+          apprtc.encode_room(restored_room)).get_occupancy())
+
+    # A caller waiting alone in a room written to memcache by the old
+    # version, whose messages are handed to the callee joining after the
+    # deploy.
+    del room.clients['456']
+    room_store.create_room_store().set('http://localhost/old', pickle.loads(
+        run_with_old_room_classes(lambda: pickle.dumps(room))))
+    self.makePostRequest('/message/old/123', 'candidate')
+    response = self.makePostRequest('/join/old')
+    self.verifyJoinSuccessResponse(response, False, 'old')
+    self.assertEqual(['offer', 'candidate'],
+                     json.loads(response.body)['params']['messages'])
+
   def testConnectingWithoutRoomIdServesIndex(self):
     response = self.makeGetRequest('/')
     self.assertEqual(response.status_int, 200)
@@ -97,6 +206,139 @@ class AppRtcPageHandlerTest(unittest.TestCase):
     self.assertEqual(response.status_int, 200)
     self.assertRegexpMatches(response.body, 'roomId: \'testRoom\'')
 
+  def testRoomParametersAreCached(self):
+    response = self.makeGetRequest('/params?hd=true')
+    params = json.loads(response.body)
+    self.assertNotIn('room_id', params)
+    response = self.makePostRequest('/join/foo?hd=true')
+    params = json.loads(response.body)['params']
+    self.assertEqual('foo', params['room_id'])
+    self.assertTrue(len(params['client_id']) > 0)
+    self.assertEqual(1, apprtc.room_parameters_cache.hits)
+    self.assertEqual(1, apprtc.room_parameters_cache.misses)
+
+    # Other query parameters are cached separately.
+    response = self.makeGetRequest('/params?hd=false')
+    self.assertEqual(2, apprtc.room_parameters_cache.misses)
+    self.assertNotEqual(params['media_constraints'],
+                        json.loads(response.body)['media_constraints'])
+
+  def testCachedRoomParametersKeepWarnings(self):
+    response = self.makeGetRequest('/params?hd=true&video=true')
+    params = json.loads(response.body)
+    self.assertEqual(1, len(params['warning_messages']))
+    response = self.makeGetRequest('/params?hd=true&video=true')
+    self.assertEqual(params, json.loads(response.body))
+
+  def testIceServersAreAddedToPeerConnectionConfig(self):
+    ice_servers = [{'urls': ['turn:turn.example.com:3478?transport=udp']}]
+    ice_config.cache.set(apprtc.get_default_ice_server_url(), ice_servers,
+                         3600)
+    response = self.makePostRequest('/join/foo')
+    params = json.loads(response.body)['params']
+    self.assertEqual(ice_servers, json.loads(params['pc_config'])['iceServers'])
+    response = self.makeGetRequest('/r/foo')
+    self.assertIn('turn:turn.example.com:3478?transport=udp', response.body)
+
+    # Servers of other providers are left to the client.
+    response = self.makePostRequest('/join/bar?ts=https://ice.example.com')
+    params = json.loads(response.body)['params']
+    self.assertEqual([], json.loads(params['pc_config'])['iceServers'])
+
+  def testIceServersAreFilteredAndOrdered(self):
+    ice_servers = [{'urls': ['turn:turn.example.com:443?transport=tcp',
+                             'turn:turn.example.com:3478?transport=udp']},
+                   {'urls': ['stun:stun.example.com:19302']}]
+    ice_config.cache.set(apprtc.get_default_ice_server_url(), ice_servers,
+                         3600)
+    response = self.makePostRequest('/join/foo')
+    params = json.loads(response.body)['params']
+    self.assertEqual(
+        [{'urls': ['stun:stun.example.com:19302']},
+         {'urls': ['turn:turn.example.com:3478?transport=udp',
+                   'turn:turn.example.com:443?transport=tcp']}],
+        json.loads(params['pc_config'])['iceServers'])
+
+    response = self.makePostRequest('/join/bar?it=relay&tt=tcp')
+    params = json.loads(response.body)['params']
+    self.assertEqual(
+        [{'urls': ['turn:turn.example.com:443?transport=tcp']}],
+        json.loads(params['pc_config'])['iceServers'])
+
+  def testMintedTurnServers(self):
+    secret = constants.TURN_SHARED_SECRET
+    urls = constants.TURN_SERVER_URLS
+    constants.TURN_SHARED_SECRET = 'secret'
+    constants.TURN_SERVER_URLS = ['turn:turn.example.com:3478?transport=udp']
+    try:
+      response = self.makePostRequest('/join/foo')
+      params = json.loads(response.body)['params']
+      ice_servers = json.loads(params['pc_config'])['iceServers']
+      self.assertEqual(constants.TURN_SERVER_URLS, ice_servers[0]['urls'])
+      self.assertEqual(0, ice_config.fetch_ice_config.num_calls)
+
+      response = self.makePostRequest('/v1alpha/iceconfig')
+      ice_configuration = json.loads(response.body)
+      self.assertEqual(ice_servers, ice_configuration['iceServers'])
+      lifetime_sec = int(ice_configuration['lifetimeDuration'].rstrip('s'))
+      self.assertTrue(lifetime_sec >= constants.TURN_CREDENTIAL_LIFETIME_SEC)
+    finally:
+      constants.TURN_SHARED_SECRET = secret
+      constants.TURN_SERVER_URLS = urls
+
+  def testIceServersAreRefreshedByCron(self):
+    # Pages do not wait for the ICE server provider.
+    response = self.makePostRequest('/join/foo')
+    params = json.loads(response.body)['params']
+    self.assertEqual([], json.loads(params['pc_config'])['iceServers'])
+    self.assertEqual(0, ice_config.fetch_ice_config.num_calls)
+
+    ice_servers = [{'urls': ['turn:turn.example.com:3478?transport=udp']}]
+    fetch = CapturingFunction((ice_servers, 3600))
+    replacement = ReplaceFunction(ice_config, 'fetch_ice_config', fetch)
+    try:
+      self.makeGetRequest('/admin/refresh_ice_config')
+    finally:
+      del replacement
+    self.assertEqual(apprtc.get_default_ice_server_url(), fetch.last_args[0])
+    response = self.makePostRequest('/join/bar')
+    params = json.loads(response.body)['params']
+    self.assertEqual(ice_servers, json.loads(params['pc_config'])['iceServers'])
+
+  def testIceConfiguration(self):
+    response = self.makePostRequest('/v1alpha/iceconfig')
+    self.assertEqual({'iceServers': []}, json.loads(response.body))
+
+    replacement = ReplaceFunction(
+        constants, 'ICE_SERVER_URLS',
+        ['turn:turn.example.com:3478', 'stun:stun.example.com:19302'])
+    apprtc.static_ice_servers = None
+    try:
+      response = self.makePostRequest('/v1alpha/iceconfig')
+      self.assertEqual(
+          {'iceServers': [{'urls': ['stun:stun.example.com:19302',
+                                    'turn:turn.example.com:3478']}]},
+          json.loads(response.body))
+      response = self.makePostRequest('/v1alpha/iceconfig?it=relay&tt=tcp')
+      self.assertEqual(
+          {'iceServers': [{'urls': [
+              'turn:turn.example.com:3478?transport=tcp']}]},
+          json.loads(response.body))
+    finally:
+      del replacement
+
+  def testIceServerHealth(self):
+    health = {'turn.example.com:3478': {'is_up': False}}
+    self.makePostRequest('/admin/ice_server_health', json.dumps(health))
+    response = self.makeGetRequest('/admin/ice_server_health')
+    self.assertEqual(health, json.loads(response.body))
+    self.assertEqual(health, memcache.get(constants.ICE_SERVER_HEALTH_KEY))
+
+    for body in ['not json', '[]', '{"turn.example.com:3478": {"is_up": 1}}']:
+      response = self.test_app.post('/admin/ice_server_health', body,
+                                    expect_errors=True)
+      self.assertEqual(400, response.status_int)
+
   def testJoinAndLeave(self):
     room_id = 'foo'
     # Join the caller.
@@ -142,6 +384,307 @@ class AppRtcPageHandlerTest(unittest.TestCase):
     self.makePostRequest('/leave/' + room_id + '/' + caller_id)
     self.makePostRequest('/leave/' + room_id + '/' + callee_id)
 
+  def testMessagesAfterLeaveForwardedToNextCallee(self):
+    room_id = 'foo'
+    response = self.makePostRequest('/join/' + room_id)
+    caller_id = self.verifyJoinSuccessResponse(response, True, room_id)
+    self.makePostRequest('/message/' + room_id + '/' + caller_id, 'offer1')
+    response = self.makePostRequest('/join/' + room_id)
+    callee_id = self.verifyJoinSuccessResponse(response, False, room_id)
+    self.assertEqual(['offer1'],
+                     json.loads(response.body)['params']['messages'])
+    self.makePostRequest('/leave/' + room_id + '/' + callee_id)
+
+    # The caller is alone again, so its messages are saved for the next
+    # callee.
+    response = self.makePostRequest(
+        '/message/' + room_id + '/' + caller_id, 'offer2')
+    self.assertEqual('SUCCESS', json.loads(response.body)['result'])
+    response = self.makePostRequest('/join/' + room_id)
+    self.verifyJoinSuccessResponse(response, False, room_id)
+    self.assertEqual(['offer2'],
+                     json.loads(response.body)['params']['messages'])
+
+  def testBatchedMessagesForwardedToCallee(self):
+    room_id = 'foo'
+    response = self.makePostRequest('/join/' + room_id)
+    caller_id = self.verifyJoinSuccessResponse(response, True, room_id)
+    messages = [{'type': 'offer'}, {'type': 'candidate'}]
+    response = self.makePostRequest(
+        '/messages/' + room_id + '/' + caller_id, json.dumps(messages))
+    response_json = json.loads(response.body)
+    self.assertEqual('SUCCESS', response_json['result'])
+    self.assertEqual(['SUCCESS', 'SUCCESS'], response_json['results'])
+
+    response = self.makePostRequest('/join/' + room_id)
+    self.verifyJoinSuccessResponse(response, False, room_id)
+    received_msgs = json.loads(response.body)['params']['messages']
+    self.assertEqual(messages, [json.loads(msg) for msg in received_msgs])
+
+  def testBatchedMessagesSentToCollider(self):
+    room_id = 'foo'
+    response = self.makePostRequest('/join/' + room_id)
+    caller_id = self.verifyJoinSuccessResponse(response, True, room_id)
+    self.makePostRequest('/join/' + room_id)
+
+    create_rpc = CapturingFunction(FakeRpc(FakeFetchResult(200)))
+    make_fetch_call = CapturingFunction()
+    create_rpc_replacement = ReplaceFunction(
+        apprtc.urlfetch, 'create_rpc', create_rpc)
+    make_fetch_call_replacement = ReplaceFunction(
+        apprtc.urlfetch, 'make_fetch_call', make_fetch_call)
+    try:
+      messages = [{'type': 'candidate', 'label': label}
+                  for label in xrange(3)]
+      path = '/messages/' + room_id + '/' + caller_id
+      response = self.makePostRequest(path, json.dumps(messages))
+      self.assertEqual(['SUCCESS'] * 3,
+                       json.loads(response.body)['results'])
+      # Every message is forwarded in its own request, with a deadline.
+      self.assertEqual(3, make_fetch_call.num_calls)
+      self.assertEqual(constants.COLLIDER_FORWARD_DEADLINE_SEC,
+                       create_rpc.last_kwargs['deadline'])
+      self.assertTrue(make_fetch_call.last_args[1].endswith(
+          '/' + room_id + '/' + caller_id))
+      self.assertEqual(messages[2],
+                       json.loads(make_fetch_call.last_kwargs['payload']))
+
+      for result in [FakeFetchResult(500),
+                     apprtc.urlfetch.DeadlineExceededError()]:
+        create_rpc.return_value = FakeRpc(result)
+        response = self.makePostRequest(path, json.dumps(messages))
+        self.assertEqual(['ERROR'] * 3,
+                         json.loads(response.body)['results'])
+    finally:
+      del create_rpc_replacement
+      del make_fetch_call_replacement
+
+  def testMessageForwardFailure(self):
+    room_id = 'foo'
+    response = self.makePostRequest('/join/' + room_id)
+    caller_id = self.verifyJoinSuccessResponse(response, True, room_id)
+    self.makePostRequest('/join/' + room_id)
+
+    replacements = [
+        ReplaceFunction(apprtc.urlfetch, 'create_rpc', CapturingFunction(
+            FakeRpc(apprtc.urlfetch.DownloadError()))),
+        ReplaceFunction(apprtc.urlfetch, 'make_fetch_call',
+                        CapturingFunction())]
+    try:
+      response = self.test_app.post(
+          '/message/' + room_id + '/' + caller_id, '1', expect_errors=True)
+      self.assertEqual(500, response.status_int)
+    finally:
+      del replacements[:]
+
+  def testLoopbackMessagesAreAnsweredInResponse(self):
+    room_id = 'foo'
+    response = self.makePostRequest('/join/' + room_id + '?debug=loopback')
+    caller_id = self.verifyJoinSuccessResponse(response, True, room_id)
+
+    create_rpc = CapturingFunction()
+    replacement = ReplaceFunction(apprtc.urlfetch, 'create_rpc', create_rpc)
+    try:
+      offer = {'type': 'offer',
+               'sdp': 'v=0\r\na=ice-options:google-ice\r\n'
+                      'a=crypto:1 AES_CM_128_HMAC_SHA1_80 inline:x\r\n'
+                      'a=mid:audio\r\n'}
+      query = '?debug=loopback&loopback_answers=true'
+      response = self.makePostRequest(
+          '/message/' + room_id + '/' + caller_id + query, json.dumps(offer))
+      response_json = json.loads(response.body)
+      self.assertEqual('SUCCESS', response_json['result'])
+      self.assertEqual([{'type': 'answer', 'sdp': 'v=0\r\na=mid:audio\r\n'}],
+                       [json.loads(m) for m in response_json['messages']])
+
+      candidate = {'type': 'candidate', 'label': 0, 'candidate': 'c'}
+      bye = {'type': 'bye'}
+      response = self.makePostRequest(
+          '/messages/' + room_id + '/' + caller_id + query,
+          json.dumps([candidate, bye]))
+      response_json = json.loads(response.body)
+      self.assertEqual(['SUCCESS'] * 2, response_json['results'])
+      self.assertEqual([candidate],
+                       [json.loads(m) for m in response_json['messages']])
+      # Nothing is forwarded to collider.
+      self.assertEqual(0, create_rpc.num_calls)
+    finally:
+      del replacement
+
+  def testLoopbackMessagesAreForwardedByDefault(self):
+    # Clients that did not ask for the answers in the response get them
+    # through collider, from their loopback WebSocket.
+    room_id = 'foo'
+    response = self.makePostRequest('/join/' + room_id + '?debug=loopback')
+    caller_id = self.verifyJoinSuccessResponse(response, True, room_id)
+
+    create_rpc = CapturingFunction(FakeRpc(FakeFetchResult(200)))
+    replacements = [
+        ReplaceFunction(apprtc.urlfetch, 'create_rpc', create_rpc),
+        ReplaceFunction(apprtc.urlfetch, 'make_fetch_call',
+                        CapturingFunction())]
+    try:
+      response = self.makePostRequest(
+          '/message/' + room_id + '/' + caller_id + '?debug=loopback',
+          json.dumps({'type': 'offer', 'sdp': 'sdp'}))
+      self.assertEqual({'result': 'SUCCESS'}, json.loads(response.body))
+      response = self.makePostRequest(
+          '/messages/' + room_id + '/' + caller_id,
+          json.dumps([{'type': 'candidate'}, {'type': 'candidate'}]))
+      response_json = json.loads(response.body)
+      self.assertEqual(['SUCCESS'] * 2, response_json['results'])
+      self.assertNotIn('messages', response_json)
+      self.assertEqual(3, create_rpc.num_calls)
+    finally:
+      del replacements[:]
+
+  def testGetLoopbackMessages(self):
+    self.assertEqual([], apprtc.get_loopback_messages('not json'))
+    self.assertEqual([], apprtc.get_loopback_messages('[]'))
+    self.assertEqual([], apprtc.get_loopback_messages('{"type":"answer"}'))
+    self.assertEqual(['{"type":"candidate"}'],
+                     apprtc.get_loopback_messages('{"type":"candidate"}'))
+
+  def testInvalidBatchedMessages(self):
+    room_id = 'foo'
+    response = self.makePostRequest('/join/' + room_id)
+    caller_id = self.verifyJoinSuccessResponse(response, True, room_id)
+    path = '/messages/' + room_id + '/' + caller_id
+    too_many = [{}] * (constants.MAX_MESSAGES_PER_BATCH + 1)
+    for body in ['', 'not json', '{}', '[]', '["1"]', json.dumps(too_many)]:
+      response = self.makePostRequest(path, body)
+      self.assertEqual('INVALID_REQUEST', json.loads(response.body)['result'])
+
+    response = self.makePostRequest('/messages/bar/' + caller_id, '[{}]')
+    self.assertEqual('UNKNOWN_ROOM', json.loads(response.body)['result'])
+
+  def sweepRoomsLater(self, delay_sec):
+    now = time.time()
+    replacement = ReplaceFunction(time, 'time', lambda: now + delay_sec)
+    try:
+      return json.loads(self.makeGetRequest('/admin/sweep_rooms').body)
+    finally:
+      del replacement
+
+  def testSweepIdleRooms(self):
+    response = self.makePostRequest('/join/idle')
+    self.verifyJoinSuccessResponse(response, True, 'idle')
+    response = self.makePostRequest('/join/waiting')
+    caller_id = self.verifyJoinSuccessResponse(response, True, 'waiting')
+    self.makePostRequest('/message/waiting/' + caller_id, 'offer')
+    response = self.makePostRequest('/join/left')
+    left_id = self.verifyJoinSuccessResponse(response, True, 'left')
+    self.makePostRequest('/leave/left/' + left_id)
+
+    # The rooms are swept once their bucket is past the idle timeout.
+    self.assertEqual({'indexed': 0, 'deleted': 0},
+                     json.loads(self.makeGetRequest('/admin/sweep_rooms').body))
+    delay_sec = (constants.ROOM_IDLE_TIMEOUT_SEC +
+                 constants.ROOM_INDEX_BUCKET_SEC)
+    self.assertEqual({'indexed': 3, 'deleted': 1},
+                     self.sweepRoomsLater(delay_sec))
+    # Every bucket is swept once.
+    self.assertEqual({'indexed': 0, 'deleted': 0},
+                     self.sweepRoomsLater(delay_sec))
+
+    # The idle room is gone.
+    response = self.makePostRequest('/join/idle')
+    self.verifyJoinSuccessResponse(response, True, 'idle')
+    # A client waiting with saved messages keeps its room.
+    response = self.makePostRequest('/join/waiting')
+    self.verifyJoinSuccessResponse(response, False, 'waiting')
+    self.assertEqual(['offer'], json.loads(response.body)['params']['messages'])
+
+  def testSweepChecksRoomsAddedAgain(self):
+    response = self.makePostRequest('/join/room')
+    caller_id = self.verifyJoinSuccessResponse(response, True, 'room')
+    now = time.time()
+    replacement = ReplaceFunction(
+        time, 'time', lambda: now + constants.ROOM_IDLE_TIMEOUT_SEC)
+    try:
+      # The callee joins and leaves just before the room would be idle.
+      response = self.makePostRequest('/join/room')
+      callee_id = self.verifyJoinSuccessResponse(response, False, 'room')
+      self.makePostRequest('/leave/room/' + callee_id)
+    finally:
+      del replacement
+
+    delay_sec = (constants.ROOM_IDLE_TIMEOUT_SEC +
+                 constants.ROOM_INDEX_BUCKET_SEC)
+    self.assertEqual({'indexed': 1, 'deleted': 0},
+                     self.sweepRoomsLater(delay_sec))
+    self.assertEqual({'indexed': 1, 'deleted': 1},
+                     self.sweepRoomsLater(2 * delay_sec))
+    response = self.makePostRequest('/join/room')
+    self.verifyJoinSuccessResponse(response, True, 'room')
+
+  def testSweepKeepsFullRooms(self):
+    response = self.makePostRequest('/join/call')
+    self.verifyJoinSuccessResponse(response, True, 'call')
+    response = self.makePostRequest('/join/call')
+    callee_id = self.verifyJoinSuccessResponse(response, False, 'call')
+
+    # A call longer than the idle timeout keeps its room.
+    self.assertEqual({'indexed': 1, 'deleted': 0}, self.sweepRoomsLater(
+        constants.ROOM_IDLE_TIMEOUT_SEC + constants.ROOM_INDEX_BUCKET_SEC))
+    response = self.makePostRequest('/join/call')
+    self.assertEqual('FULL', json.loads(response.body)['result'])
+    # The clients are still in the room.
+    self.makePostRequest('/leave/call/' + callee_id)
+    response = self.makePostRequest('/join/call')
+    self.verifyJoinSuccessResponse(response, False, 'call')
+
+  def testStats(self):
+    response = self.makePostRequest('/join/foo')
+    caller_id = self.verifyJoinSuccessResponse(response, True, 'foo')
+    self.makePostRequest('/message/foo/' + caller_id, '1')
+    self.makePostRequest('/join/foo')
+    self.makePostRequest('/join/bar')
+    self.makePostRequest('/leave/foo/' + caller_id)
+
+    stats = json.loads(self.makeGetRequest('/admin/stats').body)
+    self.assertEqual({'half_full_rooms': 2, 'full_rooms': 0}, stats['rooms'])
+    self.assertEqual({'joins': 3, 'leaves': 1, 'messages': 1},
+                     stats['totals'])
+    self.assertIn('hot_keys', stats['cas_contention'])
+    self.assertIsNone(stats['interval_sec'])
+
+    # Rates are averaged since the statistics passed back.
+    self.makePostRequest('/join/baz')
+    response = self.makeGetRequest(
+        '/admin/stats?time=%f&joins=3&leaves=1&messages=1' %
+        (stats['time'] - 10))
+    stats = json.loads(response.body)
+    self.assertAlmostEqual(10, stats['interval_sec'], places=0)
+    self.assertAlmostEqual(0.1, stats['rates_per_sec']['joins'], places=2)
+    self.assertEqual(0, stats['rates_per_sec']['leaves'])
+
+  def testMetrics(self):
+    self.makePostRequest('/join/foo')
+    response = self.makeGetRequest('/admin/metrics')
+    self.assertIn('apprtc_responses_total{app="apprtc",route="/join",'
+                  'status="200"}', response.body)
+
+  def testProfile(self):
+    token = constants.PROFILER_TOKEN
+    constants.PROFILER_TOKEN = 'secret'
+    try:
+      self.test_app.post('/join/foo', headers={
+          'User-Agent': 'Safari', request_profiler.PROFILE_HEADER: 'secret'})
+    finally:
+      constants.PROFILER_TOKEN = token
+    counts = json.loads(self.makeGetRequest('/admin/profile').body)
+    self.assertEqual(1, counts['/join'])
+    self.assertEqual(0, counts['/message'])
+
+    response = self.makeGetRequest('/admin/profile?route=/join')
+    self.assertEqual('application/octet-stream', response.content_type)
+    self.assertTrue(marshal.loads(response.body))
+    self.test_app.get('/admin/profile?route=/message', status=404)
+
+    self.test_app.delete('/admin/profile')
+    self.test_app.get('/admin/profile?route=/join', status=404)
+
   def setWssHostStatus(self, index1, status1, index2, status2):
     probing_results = {}
     probing_results[constants.WSS_HOST_PORT_PAIRS[index1]] = {
@@ -166,11 +709,13 @@ class AppRtcPageHandlerTest(unittest.TestCase):
     # With an invalid value in memcache, should use fallback.
     memcache_client = memcache.Client()
     memcache_client.set(constants.WSS_HOST_ACTIVE_HOST_KEY, 'abc')
+    probers.active_host_cache.invalidate()
     self.verifyRequest(0)
 
     # With an invalid value in memcache, should use fallback.
     memcache_client = memcache.Client()
     memcache_client.set(constants.WSS_HOST_ACTIVE_HOST_KEY, ['abc', 'def'])
+    probers.active_host_cache.invalidate()
     self.verifyRequest(0)
 
     # With both hosts failing, should use fallback.
@@ -185,6 +730,56 @@ class AppRtcPageHandlerTest(unittest.TestCase):
     self.setWssHostStatus(1, True, 0, True)
     self.verifyRequest(1)
 
+  def testColliderHistory(self):
+    self.setWssHostStatus(0, False, 1, True)
+    response = self.makeGetRequest('/admin/collider_history')
+    history = json.loads(response.body)
+    self.assertEqual(constants.WSS_HOST_PORT_PAIRS[1], history['active_host'])
+    self.assertEqual(
+        [False],
+        [entry[constants.WSS_HOST_IS_UP_KEY] for entry in
+         history['histories'][constants.WSS_HOST_PORT_PAIRS[0]]])
+
+  def testActiveWssHostIsCached(self):
+    self.setWssHostStatus(0, False, 1, True)
+    self.verifyRequest(1)
+    # Changes made by other instances are seen once the cache expires.
+    memcache.set(constants.WSS_HOST_ACTIVE_HOST_KEY,
+                 constants.WSS_HOST_PORT_PAIRS[0])
+    self.verifyRequest(1)
+    now = time.time()
+    replacement = ReplaceFunction(
+        time, 'time',
+        lambda: now + constants.WSS_HOST_ACTIVE_HOST_CACHE_TTL_SEC + 1)
+    try:
+      self.verifyRequest(0)
+    finally:
+      del replacement
+
+
+class AppRtcInProcessRoomStoreTest(AppRtcPageHandlerTest):
+  """Runs the page handler tests against the in-process room store."""
+
+  def setUp(self):
+    super(AppRtcInProcessRoomStoreTest, self).setUp()
+    self.room_store_replacement = ReplaceFunction(
+        constants,
+        'ROOM_STORE_BACKEND',
+        constants.ROOM_STORE_BACKEND_IN_PROCESS)
+    room_store.InProcessRoomStore().flush_all()
+
+  def tearDown(self):
+    room_store.InProcessRoomStore().flush_all()
+    del self.room_store_replacement
+    super(AppRtcInProcessRoomStoreTest, self).tearDown()
+
+  def testRoomStateIsNotInMemcache(self):
+    response = self.makePostRequest('/join/foo')
+    self.verifyJoinSuccessResponse(response, True, 'foo')
+    key = apprtc.get_memcache_key_for_room('http://localhost', 'foo')
+    self.assertIsNone(memcache.get(key))
+    self.assertIsNotNone(room_store.InProcessRoomStore().get(key))
+
 
 if __name__ == '__main__':
   unittest.main()
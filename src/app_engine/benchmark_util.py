@@ -0,0 +1,15 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+"""Utilities for benchmarks."""
+
+import timeit
+
+# Number of timing runs, the fastest one is reported.
+REPEAT = 3
+
+
+def time_per_call_usec(function, number):
+  """Returns the best time per call of function over REPEAT runs of number
+  calls, in microseconds."""
+  timer = timeit.Timer(function)
+  return min(timer.repeat(REPEAT, number)) / number * 1e6
@@ -0,0 +1,131 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+"""AppRTC compare-and-set retry loop.
+
+This module implements the bounded, backoff-aware retry loop shared by every
+memcache compare-and-set update, and keeps statistics about CAS contention.
+"""
+
+import logging
+import random
+import threading
+import time
+
+import constants
+
+# Returned by a CAS attempt to request another attempt.
+RETRY = object()
+
+# Upper bounds of the retry histogram buckets. The last bucket counts loops
+# that needed more retries than the largest bound.
+RETRY_HISTOGRAM_BOUNDS = [0, 1, 2, 4, 8, 16, 32, 64]
+
+
+class CasRetryLimitExceeded(Exception):
+  """Raised when a CAS loop runs out of retries."""
+
+  def __init__(self, key, retries):
+    super(CasRetryLimitExceeded, self).__init__(
+        'CAS retry limit exceeded for key %s after %d retries' % (key, retries))
+    self.key = key
+    self.retries = retries
+
+
+class ContentionStats(object):
+  """Thread-safe per-process statistics about CAS retries."""
+
+  def __init__(self, max_keys):
+    self.lock = threading.Lock()
+    self.max_keys = max_keys
+    self.reset()
+
+  def reset(self):
+    with self.lock:
+      self.loops = 0
+      self.exhausted = 0
+      self.retry_histogram = [0] * (len(RETRY_HISTOGRAM_BOUNDS) + 1)
+      # Maps key to the number of CAS conflicts seen on it.
+      self.key_conflicts = {}
+
+  def record(self, key, retries, exhausted):
+    bucket = len(RETRY_HISTOGRAM_BOUNDS)
+    for index, bound in enumerate(RETRY_HISTOGRAM_BOUNDS):
+      if retries <= bound:
+        bucket = index
+        break
+    with self.lock:
+      self.loops += 1
+      self.retry_histogram[bucket] += 1
+      if exhausted:
+        self.exhausted += 1
+      if retries == 0:
+        return
+      if (key not in self.key_conflicts and
+          len(self.key_conflicts) >= self.max_keys):
+        # Forget the least contended key to bound memory usage.
+        coldest_key = min(self.key_conflicts, key=self.key_conflicts.get)
+        del self.key_conflicts[coldest_key]
+      self.key_conflicts[key] = self.key_conflicts.get(key, 0) + retries
+
+  def get_stats(self, num_hot_keys=20):
+    """Returns a JSON serializable snapshot of the statistics."""
+    with self.lock:
+      histogram = {}
+      for index, bound in enumerate(RETRY_HISTOGRAM_BOUNDS):
+        histogram['<=%d' % bound] = self.retry_histogram[index]
+      histogram['>%d' % RETRY_HISTOGRAM_BOUNDS[-1]] = self.retry_histogram[-1]
+      hot_keys = sorted(self.key_conflicts.items(),
+                        key=lambda item: item[1], reverse=True)
+      return {
+          'loops': self.loops,
+          'exhausted': self.exhausted,
+          'retry_histogram': histogram,
+          'hot_keys': [{'key': key, 'conflicts': conflicts}
+                       for key, conflicts in hot_keys[:num_hot_keys]]
+      }
+
+
+contention_stats = ContentionStats(constants.CAS_CONTENTION_MAX_TRACKED_KEYS)
+
+
+def get_backoff_delay(retries):
+  """Returns the delay before the given retry, using exponential backoff
+  with full jitter so that competing writers spread out."""
+  max_delay = min(constants.CAS_RETRY_MAX_DELAY_SEC,
+                  constants.CAS_RETRY_BASE_DELAY_SEC * (2 ** retries))
+  return random.uniform(0, max_delay)
+
+
+def run_cas_loop(key, attempt, retry_limit=None):
+  """Runs a compare-and-set update with bounded retries.
+
+  Args:
+    key: The memcache key being updated, used for the contention statistics.
+    attempt: A function taking the number of retries so far. It does one
+      gets/cas round and returns RETRY if the cas failed, or the result of the
+      update otherwise.
+    retry_limit: The maximum number of retries, defaults to
+      constants.MEMCACHE_RETRY_LIMIT.
+
+  Returns:
+    The first value returned by attempt that is not RETRY.
+
+  Raises:
+    CasRetryLimitExceeded: If attempt still requested a retry after
+    retry_limit retries.
+  """
+  if retry_limit is None:
+    retry_limit = constants.MEMCACHE_RETRY_LIMIT
+  retries = 0
+  while True:
+    result = attempt(retries)
+    if result is not RETRY:
+      contention_stats.record(key, retries, False)
+      return result
+    if retries >= retry_limit:
+      contention_stats.record(key, retries, True)
+      logging.error('Giving up CAS update of %s after %d retries',
+                    key, retries)
+      raise CasRetryLimitExceeded(key, retries)
+    time.sleep(get_backoff_delay(retries))
+    retries += 1
@@ -0,0 +1,85 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+import time
+import unittest
+
+import cas_retry
+import constants
+from test_util import CapturingFunction
+from test_util import ReplaceFunction
+
+
+class CasRetryTest(unittest.TestCase):
+  """Test the CAS retry loop."""
+
+  def setUp(self):
+    self.sleep_replacement = ReplaceFunction(time, 'sleep', CapturingFunction())
+    cas_retry.contention_stats.reset()
+
+  def tearDown(self):
+    del self.sleep_replacement
+    cas_retry.contention_stats.reset()
+
+  def makeAttempt(self, num_conflicts, result='done'):
+    calls = []
+    def attempt(retries):
+      calls.append(retries)
+      if len(calls) <= num_conflicts:
+        return cas_retry.RETRY
+      return result
+    return attempt, calls
+
+  def testReturnsFirstResult(self):
+    attempt, calls = self.makeAttempt(0)
+    self.assertEqual('done', cas_retry.run_cas_loop('key', attempt))
+    self.assertEqual([0], calls)
+    self.assertEqual(0, time.sleep.num_calls)
+
+  def testRetriesWithBackoff(self):
+    attempt, calls = self.makeAttempt(3, None)
+    self.assertIsNone(cas_retry.run_cas_loop('key', attempt))
+    self.assertEqual([0, 1, 2, 3], calls)
+    self.assertEqual(3, time.sleep.num_calls)
+
+  def testRetryLimit(self):
+    attempt, calls = self.makeAttempt(10)
+    with self.assertRaises(cas_retry.CasRetryLimitExceeded) as context:
+      cas_retry.run_cas_loop('key', attempt, retry_limit=4)
+    self.assertEqual(4, context.exception.retries)
+    self.assertEqual([0, 1, 2, 3, 4], calls)
+    self.assertEqual(1, cas_retry.contention_stats.get_stats()['exhausted'])
+
+  def testBackoffDelay(self):
+    for retries in xrange(20):
+      delay = cas_retry.get_backoff_delay(retries)
+      self.assertGreaterEqual(delay, 0)
+      self.assertLessEqual(delay, constants.CAS_RETRY_MAX_DELAY_SEC)
+      self.assertLessEqual(
+          delay, constants.CAS_RETRY_BASE_DELAY_SEC * (2 ** retries))
+
+  def testContentionStats(self):
+    cas_retry.run_cas_loop('hot', self.makeAttempt(3)[0])
+    cas_retry.run_cas_loop('hot', self.makeAttempt(1)[0])
+    cas_retry.run_cas_loop('warm', self.makeAttempt(1)[0])
+    cas_retry.run_cas_loop('cold', self.makeAttempt(0)[0])
+
+    stats = cas_retry.contention_stats.get_stats()
+    self.assertEqual(4, stats['loops'])
+    self.assertEqual(0, stats['exhausted'])
+    self.assertEqual(1, stats['retry_histogram']['<=0'])
+    self.assertEqual(2, stats['retry_histogram']['<=1'])
+    self.assertEqual(1, stats['retry_histogram']['<=4'])
+    self.assertEqual([{'key': 'hot', 'conflicts': 4},
+                      {'key': 'warm', 'conflicts': 1}], stats['hot_keys'])
+
+  def testContentionStatsAreBounded(self):
+    stats = cas_retry.ContentionStats(2)
+    stats.record('a', 5, False)
+    stats.record('b', 1, False)
+    stats.record('c', 2, False)
+    hot_keys = [entry['key'] for entry in stats.get_stats()['hot_keys']]
+    self.assertEqual(['a', 'c'], hot_keys)
+
+
+if __name__ == '__main__':
+  unittest.main()
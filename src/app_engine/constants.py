@@ -15,8 +15,77 @@ REDIRECT_URL = 'https://appr.tc'
 
 ROOM_MEMCACHE_EXPIRATION_SEC = 60 * 60 * 24
 MEMCACHE_RETRY_LIMIT = 100
+# Exponential backoff between compare-and-set retries, see cas_retry.py.
+CAS_RETRY_BASE_DELAY_SEC = 0.002
+CAS_RETRY_MAX_DELAY_SEC = 0.1
+# Number of keys for which CAS conflicts are counted.
+CAS_CONTENTION_MAX_TRACKED_KEYS = 1000
+
+# Backend used to store room state, see room_store.py. The in-process backend
+# is only correct when a single process serves all requests, e.g. on single
+# node or test deployments.
+ROOM_STORE_BACKEND_MEMCACHE = 'memcache'
+ROOM_STORE_BACKEND_IN_PROCESS = 'inprocess'
+ROOM_STORE_BACKEND = os.environ.get('ROOM_STORE_BACKEND',
+                                    ROOM_STORE_BACKEND_MEMCACHE)
+# Number of independently locked stripes of the in-process backend.
+ROOM_STORE_NUM_STRIPES = 64
+
+# Rooms with a single client that no client joined or left for this long, and
+# that hold no saved messages, are deleted by the room sweeper cron job, see
+# room_index.py. Clients in a call do not touch their room, and waiting
+# clients only touch their inbox, so other rooms are kept until they would
+# expire, after ROOM_MEMCACHE_EXPIRATION_SEC.
+ROOM_IDLE_TIMEOUT_SEC = 2 * 60 * 60
+# Rooms are added to the room index in buckets of this duration. The sweeper
+# runs as often, and sweeps at most ROOM_SWEEP_MAX_BUCKETS buckets per run
+# when it is behind.
+ROOM_INDEX_BUCKET_SEC = 10 * 60
+ROOM_SWEEP_MAX_BUCKETS = 3
+# Largest number of keys the sweeper reads with one get_multi.
+ROOM_SWEEP_BATCH_SIZE = 500
+# Number of keys every room statistics counter is spread over, see
+# room_stats.py.
+ROOM_STATS_NUM_SHARDS = 16
+
+# Fraction of the requests to PROFILED_ROUTES run under cProfile, see
+# request_profiler.py. Requests whose X-AppRTC-Profile header is
+# PROFILER_TOKEN are always profiled; an empty token disables this.
+PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE') or 0)
+PROFILER_TOKEN = os.environ.get('PROFILER_TOKEN', '')
+PROFILED_ROUTES = ['/', '/join', '/leave', '/message', '/messages', '/r']
 
 LOOPBACK_CLIENT_ID = 'LOOPBACK_CLIENT_ID'
+# Length of the client IDs allocated on join, see id_allocator.py. Every
+# character carries 6 bits.
+CLIENT_ID_LENGTH = 8
+# Number of random bytes read at a time for allocating IDs.
+ID_ALLOCATOR_POOL_BYTES = 4096
+
+# Messages saved for the other client of a room are compressed with zlib when
+# they are at least this long, see message_inbox.py.
+MESSAGE_COMPRESSION_THRESHOLD_BYTES = 1024
+MESSAGE_COMPRESSION_LEVEL = 6
+# Limits on the messages saved for a client waiting alone in a room. Bytes are
+# counted after compression.
+MAX_SAVED_MESSAGES_PER_CLIENT = 200
+MAX_SAVED_MESSAGE_BYTES_PER_CLIENT = 256 * 1024
+# Query parameter of the /message and /messages requests of clients that take
+# the answers of the loopback client from the response. Other clients get them
+# through collider.
+LOOPBACK_ANSWERS_PARAM = 'loopback_answers'
+# The largest number of messages accepted by one /messages request.
+MAX_MESSAGES_PER_BATCH = 100
+# Whether consecutive saved candidate messages are merged into one
+# 'candidates' message when handed to the joining client. Clients that loaded
+# their JS before 'candidates' messages were supported cannot parse them.
+COALESCE_CANDIDATE_MESSAGES = False
+
+# Number of URL variants whose room independent parameters are cached.
+ROOM_PARAMETERS_CACHE_SIZE = 256
+
+# Number of rendered pages cached, see template_cache.py.
+RENDERED_PAGE_CACHE_SIZE = 128
 
 # Turn/Stun server override. This allows AppRTC to connect to turn servers
 # directly rather than retrieving them from an ICE server provider.
@@ -44,6 +113,38 @@ ICE_SERVER_API_KEY = os.environ.get('ICE_SERVER_API_KEY')
 HEADER_MESSAGE = os.environ.get('HEADER_MESSAGE')
 ICE_SERVER_URLS = [url for url in os.environ.get('ICE_SERVER_URLS', '').split(',') if url]
 
+# TURN servers sharing TURN_SHARED_SECRET with AppRTC, which then mints
+# their credentials instead of fetching ICE servers, see turn_credentials.py.
+TURN_SHARED_SECRET = os.environ.get('TURN_SHARED_SECRET', '')
+TURN_SERVER_URLS = [url for url in os.environ.get('TURN_SERVER_URLS', '').split(',') if url]
+TURN_USERNAME = 'apprtc'
+# Credentials are minted once per window, and stay valid for the lifetime
+# after its end.
+TURN_CREDENTIAL_WINDOW_SEC = 60 * 60
+TURN_CREDENTIAL_LIFETIME_SEC = 24 * 60 * 60
+
+# ICE servers fetched from the default ICE server provider are cached for
+# this fraction of the lifetime of their credentials, so that clients get
+# credentials valid for at least the rest of it, see ice_config.py.
+ICE_CONFIG_TTL_LIFETIME_FRACTION = 0.5
+# Lifetime assumed when the provider does not report lifetimeDuration.
+ICE_CONFIG_DEFAULT_LIFETIME_SEC = 2 * 60 * 60
+# Fraction of the TTL after which the stored ICE servers are refreshed by
+# the /admin/refresh_ice_config cron job.
+ICE_CONFIG_REFRESH_AHEAD_FRACTION = 0.8
+ICE_CONFIG_FETCH_DEADLINE_SEC = 5
+# How long instances cache the ICE servers read from memcache.
+ICE_CONFIG_CACHE_TTL_SEC = 30
+
+# memcache key for the health of ICE servers, reported by monitoring to
+# /admin/ice_server_health, see ice_filter.py. Reports expire unless renewed.
+ICE_SERVER_HEALTH_KEY = 'ice_server_health'
+ICE_SERVER_HEALTH_EXPIRATION_SEC = 10 * 60
+# How long instances cache the health of ICE servers.
+ICE_SERVER_HEALTH_CACHE_TTL_SEC = 30
+# Number of filtered and ordered ICE server lists cached per instance.
+ICE_SERVER_FILTER_CACHE_SIZE = 64
+
 # Dictionary keys in the collider instance info constant.
 WSS_INSTANCE_HOST_KEY = 'host_port_pair'
 WSS_INSTANCE_NAME_KEY = 'vm_name'
@@ -60,13 +161,36 @@ WSS_INSTANCES = [{
 
 WSS_HOST_PORT_PAIRS = [ins[WSS_INSTANCE_HOST_KEY] for ins in WSS_INSTANCES]
 
+# Deadline of the requests forwarding messages to collider.
+COLLIDER_FORWARD_DEADLINE_SEC = 5
+
 # memcache key for the active collider host.
 WSS_HOST_ACTIVE_HOST_KEY = 'wss_host_active_host'
+# How long instances cache the active collider host. The prober updates it
+# every few minutes.
+WSS_HOST_ACTIVE_HOST_CACHE_TTL_SEC = 30
 
 # Dictionary keys in the collider probing result.
 WSS_HOST_IS_UP_KEY = 'is_up'
 WSS_HOST_STATUS_CODE_KEY = 'status_code'
 WSS_HOST_ERROR_MESSAGE_KEY = 'error_message'
+WSS_HOST_RESPONSE_MS_KEY = 'response_ms'
+WSS_HOST_TOTAL_MS_KEY = 'total_ms'
+WSS_HOST_PROBE_TIME_KEY = 'time'
+# Probes responding slower than this count as failures.
+WSS_HOST_SLOW_RESPONSE_MS = 2000
+
+# memcache key for the recent probing results of every collider host, see
+# probers.py. The prober runs every 5 minutes, so this keeps an hour.
+WSS_HOST_PROBE_HISTORY_KEY = 'wss_host_probe_history'
+WSS_HOST_PROBE_HISTORY_SIZE = 12
+# The active host is replaced once this many of its last
+# WSS_HOST_FAILOVER_WINDOW probes failed, so that a single failed probe does
+# not make every client reconnect.
+WSS_HOST_FAILOVER_FAILURES = 2
+WSS_HOST_FAILOVER_WINDOW = 3
+# Hosts only become active again once this many consecutive probes passed.
+WSS_HOST_RECOVERY_PROBES = 2
 
 RESPONSE_ERROR = 'ERROR'
 RESPONSE_ROOM_FULL = 'FULL'
@@ -75,6 +199,7 @@ RESPONSE_UNKNOWN_CLIENT = 'UNKNOWN_CLIENT'
 RESPONSE_DUPLICATE_CLIENT = 'DUPLICATE_CLIENT'
 RESPONSE_SUCCESS = 'SUCCESS'
 RESPONSE_INVALID_REQUEST = 'INVALID_REQUEST'
+RESPONSE_MESSAGE_BACKLOG_FULL = 'MESSAGE_BACKLOG_FULL'
 
 IS_DEV_SERVER = os.environ.get('APPLICATION_ID', '').startswith('dev')
 
@@ -0,0 +1,136 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+"""AppRTC ICE Configuration.
+
+Fetches the ICE servers of an ICE server provider on behalf of clients, so
+that the room page and the /join response carry them and clients do not wait
+for their own request before gathering candidates.
+
+Configurations are stored in memcache for
+constants.ICE_CONFIG_TTL_LIFETIME_FRACTION of the lifetime of their
+credentials, and cached by every instance for
+constants.ICE_CONFIG_CACHE_TTL_SEC. Page handlers never fetch: the
+/admin/refresh_ice_config cron job fetches the next configuration once
+constants.ICE_CONFIG_REFRESH_AHEAD_FRACTION of the TTL has passed, and
+retries failed fetches on its next run. Until a configuration is stored,
+clients request the provider themselves.
+"""
+
+import hashlib
+import json
+import logging
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import urlfetch
+
+import constants
+import ttl_cache
+
+MEMCACHE_KEY_PREFIX = 'ice_config/'
+
+
+def get_memcache_key(url):
+  return MEMCACHE_KEY_PREFIX + hashlib.sha1(url).hexdigest()
+
+
+def parse_lifetime(lifetime_duration):
+  """Returns the seconds of a duration like '86400s', or the default lifetime
+  if it is missing or invalid."""
+  if isinstance(lifetime_duration, basestring):
+    try:
+      lifetime_sec = float(lifetime_duration.rstrip('s'))
+      if lifetime_sec > 0:
+        return lifetime_sec
+    except ValueError:
+      pass
+  return constants.ICE_CONFIG_DEFAULT_LIFETIME_SEC
+
+
+def fetch_ice_config(url):
+  """Fetches an ICE configuration the way clients do.
+
+  Returns:
+    A tuple of the list of ICE servers and the lifetime of their credentials
+    in seconds, or (None, None) if the fetch failed.
+  """
+  try:
+    result = urlfetch.fetch(url, method=urlfetch.POST,
+                            deadline=constants.ICE_CONFIG_FETCH_DEADLINE_SEC)
+  except urlfetch.Error as e:
+    logging.warning('Failed to fetch ICE servers from %s: %s' % (url, str(e)))
+    return None, None
+  if result.status_code != 200:
+    logging.warning('Failed to fetch ICE servers from %s: %d'
+                    % (url, result.status_code))
+    return None, None
+  try:
+    config = json.loads(result.content)
+  except ValueError:
+    config = None
+  if (not isinstance(config, dict) or
+      not isinstance(config.get('iceServers'), list) or
+      not config['iceServers']):
+    logging.warning('Invalid ICE servers from %s: %s' % (url, result.content))
+    return None, None
+  return config['iceServers'], parse_lifetime(config.get('lifetimeDuration'))
+
+
+def make_entry(ice_servers, lifetime_sec, now):
+  ttl_sec = lifetime_sec * constants.ICE_CONFIG_TTL_LIFETIME_FRACTION
+  return {
+      'ice_servers': ice_servers,
+      'refresh_at': now + ttl_sec * constants.ICE_CONFIG_REFRESH_AHEAD_FRACTION,
+      'expires_at': now + ttl_sec
+  }
+
+
+class IceConfigCache(object):
+  """A cache of the ICE servers of provider URLs stored in memcache."""
+
+  def __init__(self):
+    # Maps URLs to the entries made by make_entry, or None.
+    self.entries = ttl_cache.TtlCache(constants.ICE_CONFIG_CACHE_TTL_SEC)
+
+  def get(self, url):
+    """Returns the ICE servers of url, or None if none are stored."""
+    entry = self.entries.get(url, lambda: memcache.get(get_memcache_key(url)))
+    if entry is None or entry['expires_at'] <= time.time():
+      return None
+    return entry['ice_servers']
+
+  def set(self, url, ice_servers, lifetime_sec):
+    entry = make_entry(ice_servers, lifetime_sec, time.time())
+    memcache.set(get_memcache_key(url), entry,
+                 time=int(entry['expires_at'] - time.time()) + 1)
+    self.entries.set(url, entry)
+    return entry
+
+  def clear(self):
+    self.entries.invalidate()
+
+  def refresh(self, url):
+    """Fetches the ICE servers of url if none are stored, or if they are due
+    for refresh. Servers that failed to refresh are kept until they expire.
+
+    Returns:
+      Whether url was fetched.
+    """
+    entry = memcache.get(get_memcache_key(url))
+    if entry is not None and entry['refresh_at'] > time.time():
+      return False
+    ice_servers, lifetime_sec = fetch_ice_config(url)
+    if ice_servers is not None:
+      self.set(url, ice_servers, lifetime_sec)
+    return True
+
+
+cache = IceConfigCache()
+
+
+def get_ice_servers(url):
+  return cache.get(url)
+
+
+def refresh_ice_servers(url):
+  return cache.refresh(url)
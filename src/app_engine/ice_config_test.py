@@ -0,0 +1,127 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+import json
+import time
+import unittest
+
+import constants
+import ice_config
+from test_util import CapturingFunction
+from test_util import FakeFetchResult
+from test_util import ReplaceFunction
+
+from google.appengine.api import urlfetch
+from google.appengine.ext import testbed
+
+URL = 'https://ice.example.com/v1alpha/iceconfig?key=foo'
+ICE_SERVERS = [{'urls': ['turn:turn.example.com:3478?transport=udp'],
+                'username': 'user', 'credential': 'secret'}]
+
+
+class IceConfigTest(unittest.TestCase):
+  """Test the cached ICE configurations."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+    self.now = time.time()
+    self.replacements = [
+        ReplaceFunction(time, 'time', lambda: self.now),
+        ReplaceFunction(urlfetch, 'fetch', self.fetch)]
+    self.num_fetches = 0
+    self.set_response(ICE_SERVERS, '1000s')
+    self.cache = ice_config.IceConfigCache()
+
+  def tearDown(self):
+    del self.replacements[:]
+    self.testbed.deactivate()
+
+  def fetch(self, url, **kwargs):
+    self.num_fetches += 1
+    if isinstance(self.response, Exception):
+      raise self.response
+    return self.response
+
+  def set_response(self, ice_servers, lifetime_duration=None):
+    config = {'iceServers': ice_servers}
+    if lifetime_duration is not None:
+      config['lifetimeDuration'] = lifetime_duration
+    self.response = FakeFetchResult(200, json.dumps(config))
+
+  def testFetchIceConfig(self):
+    fetch = CapturingFunction(
+        FakeFetchResult(200, json.dumps({'iceServers': ICE_SERVERS})))
+    replacement = ReplaceFunction(urlfetch, 'fetch', fetch)
+    try:
+      self.assertEqual(
+          (ICE_SERVERS, constants.ICE_CONFIG_DEFAULT_LIFETIME_SEC),
+          ice_config.fetch_ice_config(URL))
+      self.assertEqual(URL, fetch.last_args[0])
+      self.assertEqual(urlfetch.POST, fetch.last_kwargs['method'])
+    finally:
+      del replacement
+
+  def testFetchIceConfigFailures(self):
+    for response in [urlfetch.DownloadError(),
+                     FakeFetchResult(500, ''),
+                     FakeFetchResult(200, 'not json'),
+                     FakeFetchResult(200, '{"iceServers": []}')]:
+      self.response = response
+      self.assertEqual((None, None), ice_config.fetch_ice_config(URL))
+
+  def testParseLifetime(self):
+    self.assertEqual(86400, ice_config.parse_lifetime('86400.000s'))
+    for lifetime_duration in [None, 'foo', '0s']:
+      self.assertEqual(constants.ICE_CONFIG_DEFAULT_LIFETIME_SEC,
+                       ice_config.parse_lifetime(lifetime_duration))
+
+  def testGetDoesNotFetch(self):
+    self.assertIsNone(self.cache.get(URL))
+    self.assertEqual(0, self.num_fetches)
+
+  def testCachedInProcessAndMemcache(self):
+    self.assertTrue(self.cache.refresh(URL))
+    self.assertEqual(ICE_SERVERS, self.cache.get(URL))
+    # Other instances read the servers from memcache.
+    self.assertEqual(ICE_SERVERS, ice_config.IceConfigCache().get(URL))
+    self.assertEqual(1, self.num_fetches)
+
+  def testRefreshAhead(self):
+    self.cache.refresh(URL)
+    ttl_sec = 1000 * constants.ICE_CONFIG_TTL_LIFETIME_FRACTION
+    refresh_sec = ttl_sec * constants.ICE_CONFIG_REFRESH_AHEAD_FRACTION
+    self.now += refresh_sec - 1
+    self.assertFalse(self.cache.refresh(URL))
+    self.assertEqual(1, self.num_fetches)
+
+    self.now += 1
+    new_ice_servers = [{'urls': ['stun:stun.example.com:19302']}]
+    self.set_response(new_ice_servers)
+    self.assertTrue(self.cache.refresh(URL))
+    self.assertEqual(new_ice_servers, self.cache.get(URL))
+
+  def testFailedRefreshKeepsServers(self):
+    self.cache.refresh(URL)
+    self.now += 1000 * constants.ICE_CONFIG_TTL_LIFETIME_FRACTION - 1
+    self.response = urlfetch.DownloadError()
+    self.assertTrue(self.cache.refresh(URL))
+    self.assertEqual(ICE_SERVERS, self.cache.get(URL))
+
+    # Expired servers are not served.
+    self.now += 1
+    self.assertIsNone(self.cache.get(URL))
+
+  def testFailedFetchIsRetried(self):
+    self.response = FakeFetchResult(500, '')
+    self.cache.refresh(URL)
+    self.assertIsNone(self.cache.get(URL))
+
+    self.set_response(ICE_SERVERS)
+    self.assertTrue(self.cache.refresh(URL))
+    self.assertEqual(2, self.num_fetches)
+    self.assertEqual(ICE_SERVERS, ice_config.IceConfigCache().get(URL))
+
+
+if __name__ == '__main__':
+  unittest.main()
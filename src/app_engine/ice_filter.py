@@ -0,0 +1,174 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+"""AppRTC ICE Server Filtering.
+
+Filters and orders the URLs of ICE servers for a client, so that it gathers
+candidates from fewer and better servers:
+
+  - With tt=<transport>, only URLs of that transport are kept, as the client
+    does in filterIceServersUrls of util.js.
+  - With it=relay, STUN URLs are dropped since only relay candidates are used.
+  - URLs of servers reported down are dropped.
+  - The remaining URLs are ordered by the address family of the client, then
+    STUN before TURN and TURN over TLS, UDP before TCP, and the reported
+    round trip time.
+
+Nothing that would leave the client without URLs is dropped. Server health is
+reported to /admin/ice_server_health by monitoring, and expires after
+constants.ICE_SERVER_HEALTH_EXPIRATION_SEC. Results are cached for every
+combination of servers, health, parameters and address family.
+"""
+
+import re
+
+from google.appengine.api import memcache
+
+import constants
+import lru_cache
+import ttl_cache
+
+IPV4 = 4
+IPV6 = 6
+IPV4_RE = re.compile(r'^\d+\.\d+\.\d+\.\d+$')
+SCHEME_RANKS = {'stun': 0, 'turn': 1, 'turns': 2}
+TRANSPORT_RANKS = {'udp': 0, 'tcp': 1}
+
+# The health of no server, e.g. when none was reported.
+NO_HEALTH = {}
+
+health_cache = ttl_cache.TtlCache(constants.ICE_SERVER_HEALTH_CACHE_TTL_SEC)
+# Maps (servers ID, health ID, transport, ICE transports, address family) to
+# (servers, health, result), so that entries of freed servers are not used.
+filtered_ice_servers_cache = lru_cache.LruCache(
+    constants.ICE_SERVER_FILTER_CACHE_SIZE)
+
+
+def get_address_family(address):
+  if address and ':' in address:
+    return IPV6
+  return IPV4
+
+
+def parse_url(url):
+  """Returns the scheme, host:port, address family of a literal host or None,
+  and transport of an ICE server URL."""
+  scheme, _, rest = url.partition(':')
+  host_port, _, query = rest.partition('?')
+  family = None
+  if host_port.startswith('['):
+    family = IPV6
+  elif IPV4_RE.match(host_port.rsplit(':', 1)[0]):
+    family = IPV4
+  transport = 'udp'
+  for parameter in query.split('&'):
+    if parameter.startswith('transport='):
+      transport = parameter[len('transport='):]
+  return scheme, host_port, family, transport
+
+
+def get_health():
+  """Returns the reported health of ICE servers by host:port."""
+  return health_cache.get(
+      constants.ICE_SERVER_HEALTH_KEY,
+      lambda: memcache.get(constants.ICE_SERVER_HEALTH_KEY) or NO_HEALTH)
+
+
+def is_valid_health(health):
+  if not isinstance(health, dict):
+    return False
+  for server_health in health.values():
+    if (not isinstance(server_health, dict) or
+        not isinstance(server_health.get('is_up', True), bool) or
+        not isinstance(server_health.get('rtt_ms', 0), (int, float))):
+      return False
+  return True
+
+
+def set_health(health):
+  """Stores the health of ICE servers, a dict of host:port to dicts with
+  'is_up' and optionally 'rtt_ms'."""
+  memcache.set(constants.ICE_SERVER_HEALTH_KEY, health,
+               time=constants.ICE_SERVER_HEALTH_EXPIRATION_SEC)
+  health_cache.set(constants.ICE_SERVER_HEALTH_KEY, health)
+
+
+def get_urls(ice_server):
+  urls = ice_server.get('urls', ice_server.get('url', []))
+  if isinstance(urls, basestring):
+    return [urls]
+  return urls
+
+
+def filter_by_transport(url, transport):
+  """Returns url restricted to transport, or None, as filterIceServersUrls of
+  util.js does."""
+  parameter = 'transport=' + transport
+  if parameter in url:
+    return url
+  if '?transport=' not in url:
+    return url + '?' + parameter
+  return None
+
+
+def keep_unless_empty(urls, predicate):
+  kept = [url for url in urls if predicate(url)]
+  return kept or urls
+
+
+def filter_and_order(ice_servers, transport, ice_transports, address_family,
+                     health):
+  """Returns new ICE servers with the filtered and ordered URLs of
+  ice_servers, ordered by their best URL."""
+  # Pairs of server indices and URLs.
+  urls = []
+  for index, ice_server in enumerate(ice_servers):
+    for url in get_urls(ice_server):
+      if transport:
+        url = filter_by_transport(url, transport)
+      if url is not None:
+        urls.append((index, url))
+  if ice_transports == 'relay':
+    urls = keep_unless_empty(
+        urls, lambda (index, url): parse_url(url)[0] != 'stun')
+  urls = keep_unless_empty(
+      urls, lambda (index, url): health.get(
+          parse_url(url)[1], {}).get('is_up', True))
+
+  def get_sort_key((index, url)):
+    scheme, host_port, family, url_transport = parse_url(url)
+    return (family is not None and family != address_family,
+            SCHEME_RANKS.get(scheme, len(SCHEME_RANKS)),
+            TRANSPORT_RANKS.get(url_transport, len(TRANSPORT_RANKS)),
+            health.get(host_port, {}).get('rtt_ms', float('inf')))
+
+  servers = []
+  server_indices = {}
+  for index, url in sorted(urls, key=get_sort_key):
+    if index not in server_indices:
+      server = dict(ice_servers[index])
+      server.pop('url', None)
+      server['urls'] = []
+      server_indices[index] = len(servers)
+      servers.append(server)
+    if url not in servers[server_indices[index]]['urls']:
+      servers[server_indices[index]]['urls'].append(url)
+  return servers
+
+
+def get_ice_servers(ice_servers, transport, ice_transports, address):
+  """Returns the filtered and ordered ice_servers for a client. The result is
+  shared and must not be modified."""
+  health = get_health()
+  address_family = get_address_family(address)
+  key = (id(ice_servers), id(health), transport, ice_transports,
+         address_family)
+
+  def load():
+    return (ice_servers, health, filter_and_order(
+        ice_servers, transport, ice_transports, address_family, health))
+
+  cached = filtered_ice_servers_cache.get(key, load)
+  if cached[0] is not ice_servers or cached[1] is not health:
+    cached = load()
+    filtered_ice_servers_cache.set(key, cached)
+  return cached[2]
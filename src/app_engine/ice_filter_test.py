@@ -0,0 +1,144 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+import unittest
+
+import constants
+import ice_filter
+
+from google.appengine.api import memcache
+from google.appengine.ext import testbed
+
+STUN_URL = 'stun:stun.example.com:19302'
+TURN_UDP_URL = 'turn:turn.example.com:3478?transport=udp'
+TURN_TCP_URL = 'turn:turn.example.com:3478?transport=tcp'
+TURNS_URL = 'turns:turn.example.com:443?transport=tcp'
+
+
+class IceFilterTest(unittest.TestCase):
+  """Test the filtering and ordering of ICE servers."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+    ice_filter.health_cache.invalidate()
+    ice_filter.filtered_ice_servers_cache.clear()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def filter(self, urls, transport=None, ice_transports=None,
+             address_family=ice_filter.IPV4, health=ice_filter.NO_HEALTH):
+    return ice_filter.filter_and_order(
+        [{'urls': urls, 'credential': 'secret'}], transport, ice_transports,
+        address_family, health)
+
+  def testParseUrl(self):
+    self.assertEqual(('stun', 'stun.example.com:19302', None, 'udp'),
+                     ice_filter.parse_url(STUN_URL))
+    self.assertEqual(('turn', '1.2.3.4:3478', ice_filter.IPV4, 'tcp'),
+                     ice_filter.parse_url('turn:1.2.3.4:3478?transport=tcp'))
+    self.assertEqual(('turn', '[::1]:3478', ice_filter.IPV6, 'udp'),
+                     ice_filter.parse_url('turn:[::1]:3478'))
+
+  def testOrder(self):
+    self.assertEqual(
+        [{'urls': [STUN_URL, TURN_UDP_URL, TURN_TCP_URL, TURNS_URL],
+          'credential': 'secret'}],
+        self.filter([TURNS_URL, TURN_TCP_URL, TURN_UDP_URL, STUN_URL]))
+
+  def testServersAreOrderedByTheirBestUrl(self):
+    ice_servers = [{'urls': TURN_UDP_URL}, {'url': STUN_URL}]
+    self.assertEqual(
+        [{'urls': [STUN_URL]}, {'urls': [TURN_UDP_URL]}],
+        ice_filter.filter_and_order(ice_servers, None, None, ice_filter.IPV4,
+                                    ice_filter.NO_HEALTH))
+    # The servers are copied.
+    self.assertEqual([{'urls': TURN_UDP_URL}, {'url': STUN_URL}], ice_servers)
+
+  def testAddressFamily(self):
+    ipv4_url = 'turn:1.2.3.4:3478'
+    ipv6_url = 'turn:[2001:db8::1]:3478'
+    self.assertEqual([ipv4_url, ipv6_url],
+                     self.filter([ipv6_url, ipv4_url])[0]['urls'])
+    self.assertEqual([ipv6_url, ipv4_url],
+                     self.filter([ipv4_url, ipv6_url],
+                                 address_family=ice_filter.IPV6)[0]['urls'])
+
+  def testTransport(self):
+    self.assertEqual([STUN_URL + '?transport=tcp', TURN_TCP_URL],
+                     self.filter([STUN_URL, TURN_UDP_URL, TURN_TCP_URL],
+                                 transport='tcp')[0]['urls'])
+    self.assertEqual([], self.filter([TURN_UDP_URL], transport='tcp'))
+
+  def testRelay(self):
+    self.assertEqual([TURN_UDP_URL],
+                     self.filter([STUN_URL, TURN_UDP_URL],
+                                 ice_transports='relay')[0]['urls'])
+    # STUN servers are better than nothing.
+    self.assertEqual([STUN_URL],
+                     self.filter([STUN_URL], ice_transports='relay')[0]['urls'])
+
+  def testHealth(self):
+    other_url = 'turn:turn2.example.com:3478'
+    health = {'turn.example.com:3478': {'is_up': True, 'rtt_ms': 50},
+              'turn2.example.com:3478': {'is_up': True, 'rtt_ms': 10}}
+    self.assertEqual([other_url, TURN_UDP_URL],
+                     self.filter([TURN_UDP_URL, other_url],
+                                 health=health)[0]['urls'])
+    health['turn2.example.com:3478']['is_up'] = False
+    self.assertEqual([TURN_UDP_URL],
+                     self.filter([TURN_UDP_URL, other_url],
+                                 health=health)[0]['urls'])
+    # Servers reported down are better than nothing.
+    self.assertEqual([other_url],
+                     self.filter([other_url], health=health)[0]['urls'])
+
+  def testHealthIsReadFromMemcache(self):
+    self.assertIs(ice_filter.NO_HEALTH, ice_filter.get_health())
+    health = {'turn.example.com:3478': {'is_up': False}}
+    memcache.set(constants.ICE_SERVER_HEALTH_KEY, health)
+    # Cached until the TTL expires or this instance sets the health.
+    self.assertIs(ice_filter.NO_HEALTH, ice_filter.get_health())
+    ice_filter.health_cache.invalidate()
+    self.assertEqual(health, ice_filter.get_health())
+
+  def testIsValidHealth(self):
+    self.assertTrue(ice_filter.is_valid_health(
+        {'turn.example.com:3478': {'is_up': True, 'rtt_ms': 12.5}}))
+    for health in [None, [], {'turn.example.com:3478': True},
+                   {'turn.example.com:3478': {'is_up': 'no'}},
+                   {'turn.example.com:3478': {'rtt_ms': '12'}}]:
+      self.assertFalse(ice_filter.is_valid_health(health))
+
+  def testResultsAreCachedPerCombination(self):
+    ice_servers = [{'urls': [TURN_UDP_URL, TURN_TCP_URL]}]
+    result = ice_filter.get_ice_servers(ice_servers, None, None, '1.2.3.4')
+    self.assertIs(result, ice_filter.get_ice_servers(
+        ice_servers, None, None, '5.6.7.8'))
+    self.assertIsNot(result, ice_filter.get_ice_servers(
+        ice_servers, None, None, '2001:db8::1'))
+    self.assertEqual(2, ice_filter.filtered_ice_servers_cache.misses)
+
+    # New health is applied.
+    ice_filter.set_health({'turn.example.com:3478': {'is_up': True}})
+    self.assertIsNot(result, ice_filter.get_ice_servers(
+        ice_servers, None, None, '1.2.3.4'))
+    self.assertEqual(
+        {'turn.example.com:3478': {'is_up': True}},
+        memcache.get(constants.ICE_SERVER_HEALTH_KEY))
+
+  def testCachedResultsOfOtherServersAreNotUsed(self):
+    ice_servers = [{'urls': [TURN_UDP_URL]}]
+    ice_filter.get_ice_servers(ice_servers, None, None, None)
+    key = ice_filter.filtered_ice_servers_cache.entries.keys()[0]
+    other_ice_servers = [{'urls': [STUN_URL]}]
+    # As if other_ice_servers reused the ID of freed servers.
+    ice_filter.filtered_ice_servers_cache.set(
+        key, (other_ice_servers, ice_filter.NO_HEALTH, []))
+    self.assertEqual(ice_servers,
+                     ice_filter.get_ice_servers(ice_servers, None, None, None))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,46 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+"""AppRTC ID Allocator.
+
+Generates random IDs from the operating system CSPRNG. Random bytes are read
+in bulk and every byte is mapped to one of 64 URL safe characters, so an ID
+of n characters carries 6n bits of entropy. 64 divides 256, so every
+character is equally likely.
+"""
+
+import os
+import string
+import threading
+
+import constants
+
+ALPHABET = string.ascii_letters + string.digits + '-_'
+# Maps every byte value to a character of ALPHABET, for str.translate.
+BYTE_TO_CHARACTER = ''.join(ALPHABET[byte % len(ALPHABET)]
+                            for byte in xrange(256))
+
+
+class IdAllocator(object):
+  """Hands out IDs from a pool of random bytes, refilled pool_size bytes at a
+  time."""
+
+  def __init__(self, pool_size):
+    self.pool_size = pool_size
+    self.lock = threading.Lock()
+    self.pool = ''
+
+  def generate(self, length):
+    """Returns a random ID of length characters of ALPHABET."""
+    with self.lock:
+      if len(self.pool) < length:
+        self.pool += os.urandom(max(self.pool_size, length))
+      random_bytes = self.pool[:length]
+      self.pool = self.pool[length:]
+    return random_bytes.translate(BYTE_TO_CHARACTER)
+
+
+id_allocator = IdAllocator(constants.ID_ALLOCATOR_POOL_BYTES)
+
+
+def generate_id(length):
+  return id_allocator.generate(length)
@@ -0,0 +1,49 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+import os
+import unittest
+
+import id_allocator
+from test_util import ReplaceFunction
+
+
+class IdAllocatorTest(unittest.TestCase):
+  """Test the ID allocator."""
+
+  def testIdsUseAlphabet(self):
+    allocator = id_allocator.IdAllocator(16)
+    for length in [1, 8, 17, 100]:
+      new_id = allocator.generate(length)
+      self.assertEqual(length, len(new_id))
+      self.assertTrue(all(c in id_allocator.ALPHABET for c in new_id))
+
+  def testEveryCharacterIsEquallyLikely(self):
+    counts = {}
+    for c in id_allocator.BYTE_TO_CHARACTER:
+      counts[c] = counts.get(c, 0) + 1
+    self.assertEqual(64, len(counts))
+    self.assertEqual(set([4]), set(counts.values()))
+
+  def testRandomBytesAreReadInBulk(self):
+    calls = []
+    def urandom(size):
+      calls.append(size)
+      return '\0' * size
+    replacement = ReplaceFunction(os, 'urandom', urandom)
+    try:
+      allocator = id_allocator.IdAllocator(32)
+      for _ in xrange(4):
+        self.assertEqual('aaaaaaaa', allocator.generate(8))
+      self.assertEqual([32], calls)
+      allocator.generate(8)
+      self.assertEqual([32, 32], calls)
+    finally:
+      del replacement
+
+  def testIdsAreDistinct(self):
+    ids = set(id_allocator.generate_id(8) for _ in xrange(1000))
+    self.assertEqual(1000, len(ids))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,54 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+"""AppRTC LRU Cache.
+
+A process-local cache holding at most a fixed number of values, evicting the
+least recently used one when full. Used for values derived from a small set
+of request variants, such as room parameters.
+"""
+
+import collections
+import threading
+
+
+class LruCache(object):
+  """A thread-safe cache of at most max_size entries."""
+
+  def __init__(self, max_size):
+    self.max_size = max_size
+    self.lock = threading.Lock()
+    self.entries = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key, load):
+    """Returns the value of key, calling load() to get it if it is missing.
+    Cached values are shared, so callers must not modify them."""
+    with self.lock:
+      if key in self.entries:
+        value = self.entries.pop(key)
+        self.entries[key] = value
+        self.hits += 1
+        return value
+      self.misses += 1
+    # Loaded without the lock. Concurrent misses may load the same value more
+    # than once.
+    value = load()
+    self.set(key, value)
+    return value
+
+  def set(self, key, value):
+    with self.lock:
+      self.entries.pop(key, None)
+      self.entries[key] = value
+      while len(self.entries) > self.max_size:
+        self.entries.popitem(last=False)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.hits = 0
+      self.misses = 0
+
+  def __len__(self):
+    return len(self.entries)
@@ -0,0 +1,42 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+import unittest
+
+import lru_cache
+from test_util import CapturingFunction
+
+
+class LruCacheTest(unittest.TestCase):
+  """Test the LRU cache."""
+
+  def testLoadsOnce(self):
+    cache = lru_cache.LruCache(2)
+    load = CapturingFunction('a')
+    self.assertEqual('a', cache.get('foo', load))
+    self.assertEqual('a', cache.get('foo', load))
+    self.assertEqual(1, load.num_calls)
+    self.assertEqual(1, cache.hits)
+    self.assertEqual(1, cache.misses)
+
+  def testEvictsLeastRecentlyUsed(self):
+    cache = lru_cache.LruCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    # Using 'a' makes 'b' the least recently used entry.
+    cache.get('a', CapturingFunction())
+    cache.set('c', 3)
+    self.assertEqual(2, len(cache))
+    self.assertEqual(1, cache.get('a', CapturingFunction()))
+    self.assertEqual(3, cache.get('c', CapturingFunction()))
+    self.assertEqual('new', cache.get('b', CapturingFunction('new')))
+
+  def testClear(self):
+    cache = lru_cache.LruCache(2)
+    cache.set('a', 1)
+    cache.clear()
+    self.assertEqual(0, len(cache))
+    self.assertEqual(2, cache.get('a', CapturingFunction(2)))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,274 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+"""AppRTC Message Inbox.
+
+Messages sent by a client while it is alone in a room are kept in a per-client
+inbox until the other client joins, instead of inside the room itself. Every
+message is stored under its own key, numbered by a sequence counter, so
+saving a message writes only that message and never conflicts with the room.
+Large messages are stored compressed, see encode_message. The number and size
+of the messages of an inbox are capped, so an abandoned room holds a bounded
+amount of memory.
+
+The inbox is handed off without locks:
+  1. A sender reserves a sequence number with incr(), then add()s its message
+     under that number.
+  2. The joining client seals the inbox by adding SEALED_OFFSET to the
+     counter. Senders that reserve a number after that see a number above
+     SEALED_OFFSET, and forward their message instead.
+  3. The joining client reads every message up to the counter value it saw,
+     and add()s SEALED_MESSAGE to the slots that are reserved but not written
+     yet. The add() of a late sender then fails, and it forwards its message
+     instead.
+"""
+
+import json
+import logging
+import zlib
+
+import constants
+
+# Added to the sequence counter of an inbox when it is drained.
+SEALED_OFFSET = 1 << 40
+# Stored in the reserved slots that were not written when the inbox was
+# drained.
+SEALED_MESSAGE = '\0'
+
+# Stored messages start with a flag telling whether they are compressed.
+RAW_MESSAGE_FLAG = 'r'
+COMPRESSED_MESSAGE_FLAG = 'z'
+
+# Results of append_message.
+SAVED = 'SAVED'
+# The inbox was handed off, the message must be forwarded instead.
+HANDED_OFF = 'HANDED_OFF'
+# The inbox holds constants.MAX_SAVED_MESSAGES_PER_CLIENT messages or
+# constants.MAX_SAVED_MESSAGE_BYTES_PER_CLIENT bytes.
+FULL = 'FULL'
+FAILED = 'FAILED'
+
+
+def get_inbox_key(room_key, client_id, epoch):
+  """Returns the key prefix of the inbox of a client. A new epoch starts a
+  new inbox, used when the client is alone in the room again."""
+  return '%s/%s/%d' % (room_key, client_id, epoch)
+
+
+def get_sequence_key(inbox_key):
+  return inbox_key + '/seq'
+
+
+def get_bytes_key(inbox_key):
+  return inbox_key + '/bytes'
+
+
+def get_message_key(inbox_key, sequence):
+  return '%s/%d' % (inbox_key, sequence)
+
+
+def offset_counters(store, mapping):
+  """Adds the offsets of mapping to the counters of an inbox, like
+  store.offset_multi. Missing counters are created first, so that they expire
+  with the messages instead of being kept forever."""
+  counters = store.offset_multi(mapping)
+  missing = dict((key, 0) for key, value in counters.iteritems()
+                 if value is None)
+  if missing:
+    # Another sender may create the same counters first, which is fine.
+    store.add_multi(missing, constants.ROOM_MEMCACHE_EXPIRATION_SEC)
+    counters.update(store.offset_multi(
+        dict((key, mapping[key]) for key in missing)))
+  return counters
+
+
+def encode_message(text):
+  """Returns the stored form of a message. SDP offers are several KB, so
+  messages above constants.MESSAGE_COMPRESSION_THRESHOLD_BYTES are
+  compressed, if that makes them smaller."""
+  if len(text) >= constants.MESSAGE_COMPRESSION_THRESHOLD_BYTES:
+    compressed = zlib.compress(text, constants.MESSAGE_COMPRESSION_LEVEL)
+    if len(compressed) < len(text):
+      return COMPRESSED_MESSAGE_FLAG + compressed
+  return RAW_MESSAGE_FLAG + text
+
+
+def decode_message(value):
+  """Returns the message for a value stored by encode_message."""
+  flag = value[:1]
+  if flag == COMPRESSED_MESSAGE_FLAG:
+    return zlib.decompress(value[1:])
+  if flag == RAW_MESSAGE_FLAG:
+    return value[1:]
+  # Stored before messages were flagged.
+  return value
+
+
+def append_message(store, inbox_key, text):
+  """Appends a message to an inbox. Returns SAVED, HANDED_OFF, FULL or
+  FAILED."""
+  return append_messages(store, inbox_key, [text])[0]
+
+
+def append_messages(store, inbox_key, texts):
+  """Appends messages to an inbox, in order.
+
+  Args:
+    store: The room_store.RoomStore holding the inbox.
+    inbox_key: The key returned by get_inbox_key.
+    texts: The non-empty list of messages.
+
+  Returns:
+    The list of results, SAVED, HANDED_OFF, FULL or FAILED, for the messages.
+  """
+  values = [encode_message(text) for text in texts]
+  sizes = [len(value) for value in values]
+  sequence_key = get_sequence_key(inbox_key)
+  bytes_key = get_bytes_key(inbox_key)
+  # Reserve the slots and account for their size in a single round trip.
+  counters = offset_counters(
+      store, {sequence_key: len(values), bytes_key: sum(sizes)})
+  last_sequence = counters.get(sequence_key)
+  total_bytes = counters.get(bytes_key)
+  if last_sequence is None or total_bytes is None:
+    logging.warning('Failed to reserve message slots in ' + inbox_key)
+    return [FAILED] * len(values)
+  first_sequence = last_sequence - len(values) + 1
+  # All slots are reserved by one incr, so either all or none are sealed.
+  if first_sequence > SEALED_OFFSET:
+    return [HANDED_OFF] * len(values)
+
+  results = []
+  stored_bytes = total_bytes - sum(sizes)
+  returned_bytes = 0
+  new_values = {}
+  sealed_values = {}
+  for index, value in enumerate(values):
+    message_key = get_message_key(inbox_key, first_sequence + index)
+    if first_sequence + index > constants.MAX_SAVED_MESSAGES_PER_CLIENT:
+      logging.warning('Too many messages in ' + inbox_key)
+      results.append(FULL)
+      returned_bytes += sizes[index]
+    elif (stored_bytes + sizes[index] >
+          constants.MAX_SAVED_MESSAGE_BYTES_PER_CLIENT):
+      logging.warning('Too many message bytes in ' + inbox_key)
+      results.append(FULL)
+      returned_bytes += sizes[index]
+      # Seal the slot so that draining the inbox does not wait for it.
+      sealed_values[message_key] = SEALED_MESSAGE
+    else:
+      results.append(SAVED)
+      stored_bytes += sizes[index]
+      new_values[message_key] = value
+
+  if returned_bytes:
+    store.offset_multi({bytes_key: -returned_bytes})
+  if sealed_values:
+    store.add_multi(sealed_values, constants.ROOM_MEMCACHE_EXPIRATION_SEC)
+  if new_values:
+    # Slots sealed by a concurrent drain are not written.
+    handed_off_keys = set(store.add_multi(
+        new_values, constants.ROOM_MEMCACHE_EXPIRATION_SEC))
+    for index in xrange(len(values)):
+      if get_message_key(inbox_key, first_sequence + index) in handed_off_keys:
+        results[index] = HANDED_OFF
+  return results
+
+
+def drain_messages(store, inbox_key):
+  """Seals an inbox and returns its messages, in the order they were sent."""
+  sequence_key = get_sequence_key(inbox_key)
+  sealed_sequence = offset_counters(
+      store, {sequence_key: SEALED_OFFSET})[sequence_key]
+  if sealed_sequence is None:
+    logging.warning('Failed to seal inbox ' + inbox_key)
+    return []
+  count = sealed_sequence - SEALED_OFFSET
+  if count >= SEALED_OFFSET:
+    logging.warning('Inbox drained twice: ' + inbox_key)
+    return []
+  # Slots past the limit are reserved, but never written.
+  count = min(count, constants.MAX_SAVED_MESSAGES_PER_CLIENT)
+
+  keys = [get_message_key(inbox_key, sequence)
+          for sequence in xrange(1, count + 1)]
+  values = store.get_multi(keys) if keys else {}
+  for key in keys:
+    if key in values:
+      continue
+    # The slot is reserved but not written yet. Seal it, unless the sender
+    # wrote it in the meantime.
+    if not store.add(key, SEALED_MESSAGE,
+                     constants.ROOM_MEMCACHE_EXPIRATION_SEC):
+      value = store.get(key)
+      if value is not None:
+        values[key] = value
+
+  messages = []
+  written_keys = []
+  for key in keys:
+    value = values.get(key)
+    if value is not None and value != SEALED_MESSAGE:
+      messages.append(decode_message(value))
+      written_keys.append(key)
+  # Sealed slots are kept until they expire, so late senders still fail.
+  if written_keys:
+    store.delete_multi(written_keys)
+  return messages
+
+
+def has_messages(store, inbox_keys):
+  """Returns whether any of the inboxes holds messages that were not
+  drained."""
+  counts = store.get_multi([get_sequence_key(inbox_key)
+                            for inbox_key in inbox_keys])
+  return any(0 < long(count) < SEALED_OFFSET for count in counts.values())
+
+
+def delete_inbox(store, inbox_key):
+  """Deletes an inbox and the messages it still holds."""
+  sequence_key = get_sequence_key(inbox_key)
+  count = store.get(sequence_key)
+  if count is None:
+    return
+  keys = [sequence_key, get_bytes_key(inbox_key)]
+  count = long(count)
+  if count < SEALED_OFFSET:
+    count = min(count, constants.MAX_SAVED_MESSAGES_PER_CLIENT)
+    keys.extend(get_message_key(inbox_key, sequence)
+                for sequence in xrange(1, count + 1))
+  store.delete_multi(keys)
+
+
+def coalesce_candidates(messages):
+  """Merges runs of consecutive candidate messages into one 'candidates'
+  message, so the joining client gets fewer, larger messages."""
+  coalesced_messages = []
+  # The (message, parsed message) pairs of the current run of candidates.
+  run = []
+
+  def end_run():
+    if len(run) == 1:
+      coalesced_messages.append(run[0][0])
+    elif run:
+      coalesced_messages.append(json.dumps({
+          'type': 'candidates',
+          'candidates': [{'label': candidate.get('label'),
+                          'id': candidate.get('id'),
+                          'candidate': candidate.get('candidate')}
+                         for _, candidate in run]
+      }))
+    del run[:]
+
+  for message in messages:
+    try:
+      message_object = json.loads(message)
+    except ValueError:
+      message_object = None
+    if (isinstance(message_object, dict) and
+        message_object.get('type') == 'candidate'):
+      run.append((message, message_object))
+      continue
+    end_run()
+    coalesced_messages.append(message)
+  end_run()
+  return coalesced_messages
@@ -0,0 +1,242 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+import json
+import time
+import unittest
+
+import constants
+import message_inbox
+import room_store
+from test_util import ReplaceFunction
+
+from google.appengine.ext import testbed
+
+INBOX_KEY = 'http://localhost/room/client/0'
+
+
+class MessageInboxTest(unittest.TestCase):
+  """Test the message inbox against the memcache room store."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+    self.store = self.createStore()
+
+  def tearDown(self):
+    self.store.flush_all()
+    self.testbed.deactivate()
+
+  def createStore(self):
+    return room_store.MemcacheRoomStore()
+
+  def testDrainReturnsMessagesInOrder(self):
+    for message in ['1', '2', '3']:
+      self.assertEqual(
+          message_inbox.SAVED,
+          message_inbox.append_message(self.store, INBOX_KEY, message))
+    self.assertEqual(['1', '2', '3'],
+                     message_inbox.drain_messages(self.store, INBOX_KEY))
+
+  def testDrainEmptyInbox(self):
+    self.assertEqual([], message_inbox.drain_messages(self.store, INBOX_KEY))
+    self.assertEqual(
+        message_inbox.HANDED_OFF,
+        message_inbox.append_message(self.store, INBOX_KEY, '1'))
+
+  def testDrainDeletesMessages(self):
+    message_inbox.append_message(self.store, INBOX_KEY, '1')
+    message_inbox.drain_messages(self.store, INBOX_KEY)
+    message_key = message_inbox.get_message_key(INBOX_KEY, 1)
+    self.assertIsNone(self.store.get(message_key))
+
+  def testAppendAfterDrainIsRejected(self):
+    message_inbox.append_message(self.store, INBOX_KEY, '1')
+    message_inbox.drain_messages(self.store, INBOX_KEY)
+    self.assertEqual(
+        message_inbox.HANDED_OFF,
+        message_inbox.append_message(self.store, INBOX_KEY, '2'))
+    self.assertEqual([], message_inbox.drain_messages(self.store, INBOX_KEY))
+
+  def testDrainSealsReservedSlots(self):
+    message_inbox.append_message(self.store, INBOX_KEY, '1')
+    # A sender reserves slot 2 but has not written it when the inbox drains.
+    sequence_key = message_inbox.get_sequence_key(INBOX_KEY)
+    self.assertEqual(2, self.store.incr(sequence_key))
+    self.assertEqual(['1'],
+                     message_inbox.drain_messages(self.store, INBOX_KEY))
+    # The late write fails, so the sender forwards the message instead.
+    self.assertFalse(self.store.add(
+        message_inbox.get_message_key(INBOX_KEY, 2), '2'))
+
+  def testLargeMessagesAreCompressed(self):
+    offer = ('{"type":"offer","sdp":"' + 'a=candidate:1 1 udp\\r\\n' * 200 +
+             '"}')
+    self.assertEqual(
+        message_inbox.SAVED,
+        message_inbox.append_message(self.store, INBOX_KEY, offer))
+    value = self.store.get(message_inbox.get_message_key(INBOX_KEY, 1))
+    self.assertEqual(message_inbox.COMPRESSED_MESSAGE_FLAG, value[0])
+    self.assertLess(len(value), len(offer))
+    self.assertEqual([offer],
+                     message_inbox.drain_messages(self.store, INBOX_KEY))
+
+  def testSmallMessagesAreNotCompressed(self):
+    message_inbox.append_message(self.store, INBOX_KEY, '{}')
+    value = self.store.get(message_inbox.get_message_key(INBOX_KEY, 1))
+    self.assertEqual(message_inbox.RAW_MESSAGE_FLAG + '{}', value)
+
+  def testDecodeMessage(self):
+    for text in ['', '{}', 'x' * 10000, message_inbox.SEALED_MESSAGE]:
+      self.assertEqual(
+          text, message_inbox.decode_message(
+              message_inbox.encode_message(text)))
+    # Messages stored before they were flagged.
+    self.assertEqual('{}', message_inbox.decode_message('{}'))
+
+  def testMessageCountLimit(self):
+    replacement = ReplaceFunction(
+        constants, 'MAX_SAVED_MESSAGES_PER_CLIENT', 2)
+    try:
+      for message in ['1', '2']:
+        self.assertEqual(
+            message_inbox.SAVED,
+            message_inbox.append_message(self.store, INBOX_KEY, message))
+      self.assertEqual(
+          message_inbox.FULL,
+          message_inbox.append_message(self.store, INBOX_KEY, '3'))
+      self.assertEqual(['1', '2'],
+                       message_inbox.drain_messages(self.store, INBOX_KEY))
+    finally:
+      del replacement
+
+  def testMessageBytesLimit(self):
+    # Every message is stored with a one byte flag.
+    replacement = ReplaceFunction(
+        constants, 'MAX_SAVED_MESSAGE_BYTES_PER_CLIENT', 10)
+    try:
+      self.assertEqual(
+          message_inbox.SAVED,
+          message_inbox.append_message(self.store, INBOX_KEY, '1234'))
+      self.assertEqual(
+          message_inbox.FULL,
+          message_inbox.append_message(self.store, INBOX_KEY, '123456'))
+      # The rejected message does not count against the limit.
+      self.assertEqual(
+          message_inbox.SAVED,
+          message_inbox.append_message(self.store, INBOX_KEY, '1234'))
+      self.assertEqual(['1234', '1234'],
+                       message_inbox.drain_messages(self.store, INBOX_KEY))
+    finally:
+      del replacement
+
+  def testAppendMessages(self):
+    self.assertEqual(
+        [message_inbox.SAVED] * 3,
+        message_inbox.append_messages(self.store, INBOX_KEY, ['1', '2', '3']))
+    message_inbox.append_message(self.store, INBOX_KEY, '4')
+    self.assertEqual(['1', '2', '3', '4'],
+                     message_inbox.drain_messages(self.store, INBOX_KEY))
+    self.assertEqual(
+        [message_inbox.HANDED_OFF] * 2,
+        message_inbox.append_messages(self.store, INBOX_KEY, ['5', '6']))
+
+  def testAppendMessagesOverLimit(self):
+    replacement = ReplaceFunction(
+        constants, 'MAX_SAVED_MESSAGE_BYTES_PER_CLIENT', 10)
+    try:
+      # The second message does not fit, but the third one does.
+      self.assertEqual(
+          [message_inbox.SAVED, message_inbox.FULL, message_inbox.SAVED],
+          message_inbox.append_messages(
+              self.store, INBOX_KEY, ['1234', '123456', '1234']))
+      self.assertEqual(['1234', '1234'],
+                       message_inbox.drain_messages(self.store, INBOX_KEY))
+    finally:
+      del replacement
+
+  def testHasMessages(self):
+    self.assertFalse(message_inbox.has_messages(self.store, [INBOX_KEY]))
+    message_inbox.append_message(self.store, INBOX_KEY, '1')
+    self.assertTrue(message_inbox.has_messages(self.store, [INBOX_KEY]))
+    message_inbox.drain_messages(self.store, INBOX_KEY)
+    self.assertFalse(message_inbox.has_messages(self.store, [INBOX_KEY]))
+
+  def testDeleteInbox(self):
+    message_inbox.append_message(self.store, INBOX_KEY, '1')
+    message_inbox.append_message(self.store, INBOX_KEY, '2')
+    message_inbox.delete_inbox(self.store, INBOX_KEY)
+    self.assertIsNone(
+        self.store.get(message_inbox.get_sequence_key(INBOX_KEY)))
+    self.assertEqual({}, self.store.get_multi([
+        message_inbox.get_message_key(INBOX_KEY, 1),
+        message_inbox.get_message_key(INBOX_KEY, 2)]))
+
+  def testInboxesAreIndependent(self):
+    other_inbox_key = message_inbox.get_inbox_key(
+        'http://localhost/room', 'client', 1)
+    message_inbox.append_message(self.store, INBOX_KEY, '1')
+    message_inbox.append_message(self.store, other_inbox_key, '2')
+    self.assertEqual(['1'],
+                     message_inbox.drain_messages(self.store, INBOX_KEY))
+    self.assertEqual(['2'],
+                     message_inbox.drain_messages(self.store, other_inbox_key))
+
+
+class CoalesceCandidatesTest(unittest.TestCase):
+  """Test merging consecutive candidate messages."""
+
+  def makeCandidate(self, label):
+    return {'label': label, 'id': str(label),
+            'candidate': 'candidate:' + str(label)}
+
+  def testCoalesceCandidates(self):
+    offer = json.dumps({'type': 'offer', 'sdp': 'sdp'})
+    candidates = [
+        json.dumps(dict(type='candidate', **self.makeCandidate(label)))
+        for label in xrange(4)]
+    messages = message_inbox.coalesce_candidates(
+        [candidates[0], offer] + candidates[1:] + ['not json'])
+
+    self.assertEqual(4, len(messages))
+    # A single candidate is left as is.
+    self.assertEqual(candidates[0], messages[0])
+    self.assertEqual(offer, messages[1])
+    self.assertEqual({'type': 'candidates',
+                      'candidates': [self.makeCandidate(1),
+                                     self.makeCandidate(2),
+                                     self.makeCandidate(3)]},
+                     json.loads(messages[2]))
+    self.assertEqual('not json', messages[3])
+
+  def testCoalesceNoMessages(self):
+    self.assertEqual([], message_inbox.coalesce_candidates([]))
+
+
+class InProcessMessageInboxTest(MessageInboxTest):
+  """Test the message inbox against the in-process room store."""
+
+  def createStore(self):
+    return room_store.InProcessRoomStore()
+
+  def testCountersExpire(self):
+    message_inbox.append_message(self.store, INBOX_KEY, '1')
+    other_inbox_key = message_inbox.get_inbox_key(
+        'http://localhost/room', 'client', 1)
+    message_inbox.drain_messages(self.store, other_inbox_key)
+    keys = [message_inbox.get_sequence_key(INBOX_KEY),
+            message_inbox.get_bytes_key(INBOX_KEY),
+            message_inbox.get_sequence_key(other_inbox_key)]
+    self.assertEqual(3, len(self.store.get_multi(keys)))
+
+    now = time.time()
+    replacement = ReplaceFunction(
+        time, 'time', lambda: now + constants.ROOM_MEMCACHE_EXPIRATION_SEC + 1)
+    try:
+      self.assertEqual({}, self.store.get_multi(keys))
+    finally:
+      del replacement
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -8,19 +8,29 @@ This module implements collider prober.
 import json
 import logging
 import numbers
+import time
 
+import cas_retry
 import compute_page
 import constants
+import request_metrics
+import ttl_cache
 import webapp2
 
+from google.appengine.api import apiproxy_stub_map
 from google.appengine.api import app_identity
 from google.appengine.api import mail
 from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 
 
+# Deadline of the whole probe, as the instances are probed concurrently.
 PROBER_FETCH_DEADLINE = 30
 
+# Caches the active collider host read from memcache.
+active_host_cache = ttl_cache.TtlCache(
+    constants.WSS_HOST_ACTIVE_HOST_CACHE_TTL_SEC)
+
 def is_prober_enabled():
   """Check the application ID so that other projects hosting AppRTC code does
   not hit Collider unnecessarily."""
@@ -56,6 +66,99 @@ def has_non_empty_array_value(dictionary, key):
           dictionary[key])
 
 
+def get_active_host():
+  """Returns the active collider host stored by the prober, or None."""
+  return active_host_cache.get(
+      constants.WSS_HOST_ACTIVE_HOST_KEY,
+      lambda: memcache.get(constants.WSS_HOST_ACTIVE_HOST_KEY))
+
+
+def get_elapsed_ms(start_time, end_time):
+  return int((end_time - start_time) * 1000)
+
+
+def is_slow(probing_result):
+  return (probing_result.get(constants.WSS_HOST_RESPONSE_MS_KEY, 0) >
+          constants.WSS_HOST_SLOW_RESPONSE_MS)
+
+
+def is_passed(probing_result):
+  return (probing_result.get(constants.WSS_HOST_IS_UP_KEY, False) and
+          not is_slow(probing_result))
+
+
+def is_failing(history):
+  """Returns whether enough of the last probes of a host failed to replace it
+  as the active host."""
+  recent = history[-constants.WSS_HOST_FAILOVER_WINDOW:]
+  failures = len([entry for entry in recent if not is_passed(entry)])
+  return failures >= constants.WSS_HOST_FAILOVER_FAILURES
+
+
+def is_recovered(history):
+  """Returns whether enough of the last probes of a host passed in a row for
+  it to become the active host."""
+  recent = history[-constants.WSS_HOST_RECOVERY_PROBES:]
+  return (len(recent) == constants.WSS_HOST_RECOVERY_PROBES and
+          all(is_passed(entry) for entry in recent))
+
+
+def get_mean_response_ms(history):
+  recent = history[-constants.WSS_HOST_FAILOVER_WINDOW:]
+  return (sum(entry.get(constants.WSS_HOST_RESPONSE_MS_KEY, 0)
+              for entry in recent) / float(len(recent)))
+
+
+def get_probe_histories():
+  """Returns the recent probing results of every collider host, oldest
+  first."""
+  return memcache.get(constants.WSS_HOST_PROBE_HISTORY_KEY) or {}
+
+
+def add_to_probe_histories(probing_results, now):
+  """Appends probing_results to the histories of the probed hosts, keeping
+  the last constants.WSS_HOST_PROBE_HISTORY_SIZE of each.
+
+  Returns:
+    The updated histories.
+  """
+  memcache_client = memcache.Client()
+
+  def attempt(retries):
+    old_histories = memcache_client.gets(constants.WSS_HOST_PROBE_HISTORY_KEY)
+    if old_histories is None:
+      if not memcache_client.add(constants.WSS_HOST_PROBE_HISTORY_KEY, {}):
+        return cas_retry.RETRY
+      old_histories = memcache_client.gets(
+          constants.WSS_HOST_PROBE_HISTORY_KEY)
+      if old_histories is None:
+        return cas_retry.RETRY
+    # Hosts no longer probed are dropped.
+    histories = {}
+    for host, result in probing_results.items():
+      entry = {
+          constants.WSS_HOST_PROBE_TIME_KEY: int(now),
+          constants.WSS_HOST_IS_UP_KEY: result.get(
+              constants.WSS_HOST_IS_UP_KEY, False)
+      }
+      if constants.WSS_HOST_RESPONSE_MS_KEY in result:
+        entry[constants.WSS_HOST_RESPONSE_MS_KEY] = result[
+            constants.WSS_HOST_RESPONSE_MS_KEY]
+      histories[host] = (old_histories.get(host, []) + [entry])[
+          -constants.WSS_HOST_PROBE_HISTORY_SIZE:]
+    if not memcache_client.cas(constants.WSS_HOST_PROBE_HISTORY_KEY,
+                               histories):
+      return cas_retry.RETRY
+    return histories
+
+  try:
+    return cas_retry.run_cas_loop(constants.WSS_HOST_PROBE_HISTORY_KEY,
+                                  attempt)
+  except cas_retry.CasRetryLimitExceeded:
+    logging.error('Failed to save the collider probe history')
+    return dict((host, [result]) for host, result in probing_results.items())
+
+
 def get_collider_probe_success_key(instance_host):
   """Returns the memcache key for the last collider instance probing result."""
   return 'last_collider_probe_success_' + instance_host
@@ -117,57 +220,113 @@ class ProbeColliderPage(webapp2.RequestHandler):
 
   def store_instance_state(self, probing_results):
     # Store an active collider host to memcache to be served to clients.
-    # If the currently active host is still up, keep it. If not, pick a
-    # new active host that is up.
+    # Keep the currently active host until it fails enough probes, then pick
+    # the fastest host that recovered.
+    histories = add_to_probe_histories(probing_results, time.time())
     memcache_client = memcache.Client()
-    for retries in xrange(constants.MEMCACHE_RETRY_LIMIT):
+
+    def attempt(retries):
       active_host = memcache_client.gets(constants.WSS_HOST_ACTIVE_HOST_KEY)
       if active_host is None:
         memcache_client.set(constants.WSS_HOST_ACTIVE_HOST_KEY, '')
         active_host = memcache_client.gets(constants.WSS_HOST_ACTIVE_HOST_KEY)
-      active_host = self.create_collider_active_host(active_host,
-                                                     probing_results)
-      if memcache_client.cas(constants.WSS_HOST_ACTIVE_HOST_KEY, active_host):
-        logging.info('collider active host saved to memcache: ' +
-                     str(active_host))
-        break
-      logging.warning('retry # ' + str(retries) + ' to set collider status')
-
-  def create_collider_active_host(self, old_active_host, probing_results):
-    # If the old_active_host is still up, keep it. If not, pick a new active
-    # host that is up.
+      new_active_host = self.create_collider_active_host(active_host,
+                                                         histories)
+      if new_active_host != active_host:
+        logging.info('collider active host changed from %s to %s' %
+                     (active_host, new_active_host))
+      if not memcache_client.cas(constants.WSS_HOST_ACTIVE_HOST_KEY,
+                                 new_active_host):
+        logging.warning('retry # ' + str(retries) + ' to set collider status')
+        return cas_retry.RETRY
+      logging.info('collider active host saved to memcache: ' +
+                   str(new_active_host))
+      return new_active_host
+
     try:
-      if (old_active_host in probing_results and
-          probing_results[old_active_host].get(
-              constants.WSS_HOST_IS_UP_KEY, False)):
+      active_host = cas_retry.run_cas_loop(
+          constants.WSS_HOST_ACTIVE_HOST_KEY, attempt)
+      active_host_cache.set(constants.WSS_HOST_ACTIVE_HOST_KEY, active_host)
+    except cas_retry.CasRetryLimitExceeded:
+      logging.error('Failed to save the collider active host')
+      active_host_cache.invalidate(constants.WSS_HOST_ACTIVE_HOST_KEY)
+
+  def create_collider_active_host(self, old_active_host, histories):
+    """Returns the host to make active given the probe histories of the hosts.
+
+    The old active host is kept unless constants.WSS_HOST_FAILOVER_FAILURES
+    of its last constants.WSS_HOST_FAILOVER_WINDOW probes failed, and
+    otherwise replaced by the fastest recovered host. If no host recovered,
+    the fastest host whose last probe passed is picked, then any host that
+    is up.
+    """
+    try:
+      if (old_active_host in histories and
+          not is_failing(histories[old_active_host])):
         return old_active_host
     except TypeError:
       pass
-    for instance in probing_results:
-      if probing_results[instance].get(constants.WSS_HOST_IS_UP_KEY, False):
-        return instance
+    for is_candidate in [
+        is_recovered,
+        lambda history: is_passed(history[-1]),
+        lambda history: history[-1].get(constants.WSS_HOST_IS_UP_KEY, False)]:
+      candidates = [host for host in sorted(histories)
+                    if histories[host] and is_candidate(histories[host])]
+      if candidates:
+        return min(candidates,
+                   key=lambda host: get_mean_response_ms(histories[host]))
     return None
 
   def get(self):
     if not is_prober_enabled():
       return
 
-    results = {}
-    for instance in constants.WSS_INSTANCES:
-      host = instance[constants.WSS_INSTANCE_HOST_KEY]
-      results[host] = self.probe_collider_instance(instance)
+    results = self.probe_collider_instances(constants.WSS_INSTANCES)
     self.response.write(json.dumps(results, indent=2, sort_keys=True))
     self.store_instance_state(results)
 
-  def probe_collider_instance(self, collider_instance):
-    collider_host = collider_instance[constants.WSS_INSTANCE_HOST_KEY]
-    url = 'https://' + collider_host + '/status'
+  def probe_collider_instances(self, collider_instances):
+    """Probes the instances concurrently. Every response is handled once all
+    of them arrived, so that handling one does not delay the others.
 
+    Returns:
+      A dictionary of the results by host, with the milliseconds until the
+      response arrived, and that plus the time to handle it. URL Fetch only
+      returns complete responses, so the former is the closest to the time to
+      first byte.
+    """
+    start_time = time.time()
+    pending = {}
+    for instance in collider_instances:
+      url = 'https://' + instance[constants.WSS_INSTANCE_HOST_KEY] + '/status'
+      rpc = urlfetch.create_rpc(deadline=PROBER_FETCH_DEADLINE)
+      urlfetch.make_fetch_call(rpc, url, method=urlfetch.GET)
+      pending[rpc] = (instance, url)
+
+    # The (rpc, instance, url, response time) tuples, in order of arrival.
+    responses = []
+    while pending:
+      rpc = apiproxy_stub_map.UserRPC.wait_any(pending.keys())
+      instance, url = pending.pop(rpc)
+      responses.append((rpc, instance, url, time.time()))
+
+    results = {}
+    for rpc, instance, url, response_time in responses:
+      handle_start_time = time.time()
+      result = self.handle_collider_rpc(rpc, url, instance)
+      result[constants.WSS_HOST_RESPONSE_MS_KEY] = get_elapsed_ms(
+          start_time, response_time)
+      result[constants.WSS_HOST_TOTAL_MS_KEY] = (
+          result[constants.WSS_HOST_RESPONSE_MS_KEY] +
+          get_elapsed_ms(handle_start_time, time.time()))
+      results[instance[constants.WSS_INSTANCE_HOST_KEY]] = result
+    return results
+
+  def handle_collider_rpc(self, rpc, url, collider_instance):
     error_message = None
     result = None
     try:
-      result = urlfetch.fetch(
-          url=url, method=urlfetch.GET, deadline=PROBER_FETCH_DEADLINE)
+      result = rpc.get_result()
     except urlfetch.Error as e:
       error_message = ('urlfetch throws exception: %s' % str(e))
       return self.handle_collider_response(
@@ -199,6 +358,6 @@ class ProbeColliderPage(webapp2.RequestHandler):
     return self.handle_collider_response(
         error_message, status_code, collider_instance)
 
-app = webapp2.WSGIApplication([
+app = request_metrics.MetricsMiddleware(webapp2.WSGIApplication([
     ('/probe/collider', ProbeColliderPage),
-], debug=True)
+], debug=True), 'probers')
@@ -1,12 +1,19 @@
 # Copyright 2015 Google Inc. All Rights Reserved.
 
+import json
+import time
 import unittest
 
 import compute_page
 import constants
 import probers
+from test_util import FakeFetchResult
+from test_util import FakeRpc
+from test_util import ReplaceFunction
 
+from google.appengine.api import apiproxy_stub_map
 from google.appengine.api import mail
+from google.appengine.api import urlfetch
 from google.appengine.api import memcache
 from google.appengine.ext import testbed
 
@@ -35,9 +42,13 @@ class ProbersTest(unittest.TestCase):
 
   def verifyActiveHost(self, old_active_host, probing_results,
                        possible_active_hosts):
+    # As if every host had the same result in all its probes.
+    histories = dict(
+        (host, [result] * constants.WSS_HOST_PROBE_HISTORY_SIZE)
+        for host, result in probing_results.items())
     new_active_host = probers.ProbeColliderPage().create_collider_active_host(
         old_active_host,
-        probing_results)
+        histories)
     self.assertIn(new_active_host, possible_active_hosts)
 
   def createEntry(
@@ -105,6 +116,155 @@ class ProbersTest(unittest.TestCase):
     self.verifyActiveHost(old_active_host, probing_results,
                           possible_active_hosts)
 
+  def testSlowActiveHostIsReplaced(self):
+    slow_ms = constants.WSS_HOST_SLOW_RESPONSE_MS + 1
+    probing_results = {
+        'server1': self.createEntry(True),
+        'server2': self.createEntry(True),
+        'server3': self.createEntry(True),
+    }
+    probing_results['server1'][constants.WSS_HOST_RESPONSE_MS_KEY] = slow_ms
+    probing_results['server2'][constants.WSS_HOST_RESPONSE_MS_KEY] = 200
+    probing_results['server3'][constants.WSS_HOST_RESPONSE_MS_KEY] = 100
+    self.verifyActiveHost('server1', probing_results, ['server3'])
+
+    # A slow host is kept if no host is faster.
+    probing_results['server2'][constants.WSS_HOST_RESPONSE_MS_KEY] = slow_ms
+    probing_results['server3'][constants.WSS_HOST_RESPONSE_MS_KEY] = slow_ms
+    self.verifyActiveHost('server1', probing_results, ['server1'])
+
+  def testFailoverHysteresis(self):
+    page = probers.ProbeColliderPage()
+    up = self.createEntry(True)
+    down = self.createEntry(False)
+    histories = {'server1': [up, up, down], 'server2': [up, up, up]}
+    # A single failed probe does not replace the active host.
+    self.assertEqual('server1',
+                     page.create_collider_active_host('server1', histories))
+    histories['server1'].append(down)
+    self.assertEqual('server2',
+                     page.create_collider_active_host('server1', histories))
+
+    # Hosts that did not recover are only picked if no host recovered.
+    histories = {'server1': [down, down], 'server2': [down, up],
+                 'server3': [up, up]}
+    self.assertEqual('server3',
+                     page.create_collider_active_host('server1', histories))
+    del histories['server3']
+    self.assertEqual('server2',
+                     page.create_collider_active_host('server1', histories))
+    # The failed host becomes active again once it recovers.
+    histories['server1'] += [up, up]
+    histories['server2'] += [down, down]
+    self.assertEqual('server1',
+                     page.create_collider_active_host('server2', histories))
+
+  def testProbeHistories(self):
+    self.assertEqual({}, probers.get_probe_histories())
+    for i in range(constants.WSS_HOST_PROBE_HISTORY_SIZE + 1):
+      probing_results = {'server1': self.createEntry(i % 2 == 0, 200)}
+      probing_results['server1'][constants.WSS_HOST_RESPONSE_MS_KEY] = i
+      histories = probers.add_to_probe_histories(probing_results, 1000 + i)
+    self.assertEqual(histories, probers.get_probe_histories())
+
+    # Only the last probes are kept.
+    history = histories['server1']
+    self.assertEqual(constants.WSS_HOST_PROBE_HISTORY_SIZE, len(history))
+    self.assertEqual({constants.WSS_HOST_PROBE_TIME_KEY: 1001,
+                      constants.WSS_HOST_IS_UP_KEY: False,
+                      constants.WSS_HOST_RESPONSE_MS_KEY: 1}, history[0])
+    self.assertEqual(constants.WSS_HOST_PROBE_HISTORY_SIZE,
+                     history[-1][constants.WSS_HOST_RESPONSE_MS_KEY])
+
+    # Hosts no longer probed are dropped.
+    histories = probers.add_to_probe_histories(
+        {'server2': self.createEntry(True)}, 2000)
+    self.assertEqual(['server2'], histories.keys())
+
+  def probeColliders(self, page, responses):
+    """Probes the collider instances with fake RPCs.
+
+    Args:
+      page: The ProbeColliderPage probing.
+      responses: A dict of hosts to the (completion time, result or error) of
+          their fetch, starting at time 1000.
+    """
+    rpcs = []
+    self.now = 1000.0
+
+    def create_rpc(deadline):
+      rpcs.append(FakeRpc(deadline=deadline))
+      return rpcs[-1]
+
+    def make_fetch_call(rpc, url, method):
+      # Every fetch is started before any completes.
+      self.assertEqual(1000.0, self.now)
+      rpc.url = url
+      rpc.complete_time, rpc.result = responses[
+          url[len('https://'):-len('/status')]]
+
+    def wait_any(pending_rpcs):
+      rpc = min(pending_rpcs, key=lambda rpc: rpc.complete_time)
+      self.now = max(self.now, rpc.complete_time)
+      return rpc
+
+    replacements = [
+        ReplaceFunction(urlfetch, 'create_rpc', create_rpc),
+        ReplaceFunction(urlfetch, 'make_fetch_call', make_fetch_call),
+        ReplaceFunction(apiproxy_stub_map.UserRPC, 'wait_any',
+                        staticmethod(wait_any)),
+        ReplaceFunction(time, 'time', lambda: self.now)]
+    try:
+      results = page.probe_collider_instances(constants.WSS_INSTANCES)
+    finally:
+      del replacements[:]
+    self.assertEqual(len(constants.WSS_INSTANCES), len(rpcs))
+    for rpc in rpcs:
+      self.assertEqual(probers.PROBER_FETCH_DEADLINE, rpc.deadline)
+    return results
+
+  def testProbeCollidersConcurrently(self):
+    up_host = constants.WSS_HOST_PORT_PAIRS[0]
+    down_host = constants.WSS_HOST_PORT_PAIRS[1]
+    results = self.probeColliders(probers.ProbeColliderPage(), {
+        up_host: (1000.5, FakeFetchResult(200, json.dumps({'upsec': 1}))),
+        down_host: (1000.0 + probers.PROBER_FETCH_DEADLINE,
+                    urlfetch.DeadlineExceededError())
+    })
+
+    up_result = results[up_host]
+    self.assertTrue(up_result[constants.WSS_HOST_IS_UP_KEY])
+    self.assertEqual(500, up_result[constants.WSS_HOST_RESPONSE_MS_KEY])
+    self.assertEqual(500, up_result[constants.WSS_HOST_TOTAL_MS_KEY])
+    down_result = results[down_host]
+    self.assertFalse(down_result[constants.WSS_HOST_IS_UP_KEY])
+    self.assertEqual(500, down_result[constants.WSS_HOST_STATUS_CODE_KEY])
+    self.assertEqual(probers.PROBER_FETCH_DEADLINE * 1000,
+                     down_result[constants.WSS_HOST_RESPONSE_MS_KEY])
+
+  def testSlowHandlingDoesNotDelayOtherResponses(self):
+    down_host = constants.WSS_HOST_PORT_PAIRS[0]
+    up_host = constants.WSS_HOST_PORT_PAIRS[1]
+    page = probers.ProbeColliderPage()
+    handle_collider_response = page.handle_collider_response
+
+    def slow_handle_collider_response(error_message, status_code, instance):
+      # Sending the alert and restarting the instance takes 5 seconds.
+      if error_message is not None:
+        self.now += 5
+      return handle_collider_response(error_message, status_code, instance)
+
+    page.handle_collider_response = slow_handle_collider_response
+    results = self.probeColliders(page, {
+        down_host: (1000.1, FakeFetchResult(500, '')),
+        up_host: (1000.2, FakeFetchResult(200, json.dumps({'upsec': 1})))
+    })
+
+    self.assertEqual(100, results[down_host][constants.WSS_HOST_RESPONSE_MS_KEY])
+    self.assertEqual(5100, results[down_host][constants.WSS_HOST_TOTAL_MS_KEY])
+    self.assertEqual(200, results[up_host][constants.WSS_HOST_RESPONSE_MS_KEY])
+    self.assertEqual(200, results[up_host][constants.WSS_HOST_TOTAL_MS_KEY])
+
   def testHandleColliderResponse(self):
     status_code = 200
     error = None
@@ -0,0 +1,153 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+"""AppRTC Request Metrics.
+
+WSGI middleware recording, for every route of a webapp2 application, a
+latency histogram with fixed buckets, the number of responses by status code
+and the number of response bytes. The metrics are kept per instance and
+exported in the Prometheus text exposition format by format_metrics.
+"""
+
+import bisect
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS_SEC = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                       5.0, 10.0]
+# Route label of the requests that match no route.
+OTHER_ROUTE = 'other'
+
+
+class RouteMetrics(object):
+  """The metrics of one route."""
+
+  def __init__(self):
+    # The last bucket counts the requests slower than every bound.
+    self.bucket_counts = [0] * (len(LATENCY_BUCKETS_SEC) + 1)
+    self.latency_sum_sec = 0.0
+    self.status_counts = {}
+    self.response_bytes = 0
+
+  def record(self, latency_sec, status, response_bytes):
+    self.bucket_counts[
+        bisect.bisect_left(LATENCY_BUCKETS_SEC, latency_sec)] += 1
+    self.latency_sum_sec += latency_sec
+    self.status_counts[status] = self.status_counts.get(status, 0) + 1
+    self.response_bytes += response_bytes
+
+
+class MetricsRegistry(object):
+  """The metrics of the routes of every application of the instance."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    # Maps (application name, route) pairs to RouteMetrics.
+    self.routes = {}
+
+  def reset(self):
+    with self.lock:
+      self.routes = {}
+
+  def record(self, app_name, route, latency_sec, status, response_bytes):
+    with self.lock:
+      metrics = self.routes.get((app_name, route))
+      if metrics is None:
+        metrics = self.routes[(app_name, route)] = RouteMetrics()
+      metrics.record(latency_sec, status, response_bytes)
+
+  def get_route_metrics(self, app_name, route):
+    with self.lock:
+      return self.routes.get((app_name, route))
+
+  def format_metrics(self):
+    """Returns the metrics in the Prometheus text exposition format."""
+    with self.lock:
+      routes = sorted(self.routes.iteritems())
+      lines = [
+          '# HELP apprtc_request_latency_seconds Request latency by route.',
+          '# TYPE apprtc_request_latency_seconds histogram']
+      for (app_name, route), metrics in routes:
+        labels = 'app="%s",route="%s"' % (app_name, route)
+        cumulative_count = 0
+        for bound, count in zip(LATENCY_BUCKETS_SEC + ['+Inf'],
+                                metrics.bucket_counts):
+          cumulative_count += count
+          lines.append('apprtc_request_latency_seconds_bucket{%s,le="%s"} %d'
+                       % (labels, bound, cumulative_count))
+        lines.append('apprtc_request_latency_seconds_sum{%s} %f'
+                     % (labels, metrics.latency_sum_sec))
+        lines.append('apprtc_request_latency_seconds_count{%s} %d'
+                     % (labels, cumulative_count))
+
+      lines.extend([
+          '# HELP apprtc_responses_total Responses by route and status code.',
+          '# TYPE apprtc_responses_total counter'])
+      for (app_name, route), metrics in routes:
+        for status, count in sorted(metrics.status_counts.iteritems()):
+          lines.append(
+              'apprtc_responses_total{app="%s",route="%s",status="%s"} %d'
+              % (app_name, route, status, count))
+
+      lines.extend([
+          '# HELP apprtc_response_bytes_total Response body bytes by route.',
+          '# TYPE apprtc_response_bytes_total counter'])
+      for (app_name, route), metrics in routes:
+        lines.append('apprtc_response_bytes_total{app="%s",route="%s"} %d'
+                     % (app_name, route, metrics.response_bytes))
+    return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def get_route_prefix(template):
+  """Returns the route label for a route template or request path: its first
+  path segment."""
+  return '/' + template.split('/', 2)[1]
+
+
+class MetricsMiddleware(object):
+  """Records the metrics of the requests handled by a webapp2 application.
+
+  Requests are labeled with the first path segment of their route, e.g.
+  '/join', so that the number of labels does not grow with room IDs.
+  """
+
+  def __init__(self, app, app_name, metrics_registry=None):
+    self.app = app
+    self.app_name = app_name
+    self.registry = metrics_registry or registry
+    self.route_prefixes = frozenset(
+        get_route_prefix(route.template) for route in app.router.match_routes)
+
+  def __getattr__(self, name):
+    # Exposes the router and other attributes of the application.
+    return getattr(self.app, name)
+
+  def __call__(self, environ, start_response):
+    start_time = time.time()
+    response_info = {}
+
+    def recording_start_response(status, headers, exc_info=None):
+      response_info['status'] = status.split(' ', 1)[0]
+      for name, value in headers:
+        if name.lower() == 'content-length':
+          response_info['bytes'] = int(value)
+      if exc_info is None:
+        return start_response(status, headers)
+      return start_response(status, headers, exc_info)
+
+    result = self.app(environ, recording_start_response)
+    latency_sec = time.time() - start_time
+    response_bytes = response_info.get('bytes')
+    if response_bytes is None and isinstance(result, list):
+      response_bytes = sum(len(chunk) for chunk in result)
+
+    route = get_route_prefix(environ.get('PATH_INFO') or '/')
+    if route not in self.route_prefixes:
+      route = OTHER_ROUTE
+    self.registry.record(self.app_name, route, latency_sec,
+                         response_info.get('status', '0'),
+                         response_bytes or 0)
+    return result
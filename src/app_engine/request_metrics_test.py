@@ -0,0 +1,85 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+import unittest
+
+import webapp2
+import webtest
+
+import request_metrics
+
+
+class FooPage(webapp2.RequestHandler):
+  def get(self, foo_id):
+    self.response.write('foo')
+
+
+class ErrorPage(webapp2.RequestHandler):
+  def get(self):
+    self.error(500)
+
+
+class RequestMetricsTest(unittest.TestCase):
+  """Test the request metrics middleware."""
+
+  def setUp(self):
+    self.registry = request_metrics.MetricsRegistry()
+    self.app = request_metrics.MetricsMiddleware(webapp2.WSGIApplication([
+        ('/foo/(\w+)', FooPage),
+        ('/error', ErrorPage),
+    ]), 'test', self.registry)
+    self.test_app = webtest.TestApp(self.app)
+
+  def testRecordsRoutes(self):
+    self.test_app.get('/foo/1')
+    self.test_app.get('/foo/2')
+    self.test_app.get('/error', expect_errors=True)
+    self.test_app.get('/bar', expect_errors=True)
+
+    metrics = self.registry.get_route_metrics('test', '/foo')
+    self.assertEqual(2, sum(metrics.bucket_counts))
+    self.assertEqual({'200': 2}, metrics.status_counts)
+    self.assertEqual(6, metrics.response_bytes)
+    self.assertEqual({'500': 1}, self.registry.get_route_metrics(
+        'test', '/error').status_counts)
+    self.assertEqual({'404': 1}, self.registry.get_route_metrics(
+        'test', request_metrics.OTHER_ROUTE).status_counts)
+
+  def testLatencyBuckets(self):
+    metrics = request_metrics.RouteMetrics()
+    metrics.record(0.001, '200', 0)
+    metrics.record(0.005, '200', 0)
+    metrics.record(0.3, '200', 0)
+    metrics.record(100, '200', 0)
+    self.assertEqual(2, metrics.bucket_counts[0])
+    self.assertEqual(1, metrics.bucket_counts[
+        request_metrics.LATENCY_BUCKETS_SEC.index(0.5)])
+    self.assertEqual(1, metrics.bucket_counts[-1])
+
+  def testFormatMetrics(self):
+    self.registry.record('test', '/foo', 0.02, '200', 3)
+    lines = self.registry.format_metrics().splitlines()
+    labels = 'app="test",route="/foo"'
+    self.assertIn(
+        'apprtc_request_latency_seconds_bucket{%s,le="0.01"} 0' % labels,
+        lines)
+    self.assertIn(
+        'apprtc_request_latency_seconds_bucket{%s,le="0.025"} 1' % labels,
+        lines)
+    self.assertIn(
+        'apprtc_request_latency_seconds_bucket{%s,le="+Inf"} 1' % labels,
+        lines)
+    self.assertIn('apprtc_request_latency_seconds_count{%s} 1' % labels,
+                  lines)
+    self.assertIn('apprtc_responses_total{%s,status="200"} 1' % labels,
+                  lines)
+    self.assertIn('apprtc_response_bytes_total{%s} 3' % labels, lines)
+
+  def testRoutePrefix(self):
+    self.assertEqual('/', request_metrics.get_route_prefix('/'))
+    self.assertEqual('/join',
+                     request_metrics.get_route_prefix('/join/([a-z]+)'))
+    self.assertEqual('/a', request_metrics.get_route_prefix('/a/'))
+
+
+if __name__ == '__main__':
+  unittest.main()
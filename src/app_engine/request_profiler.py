@@ -0,0 +1,137 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+"""AppRTC Request Profiler.
+
+WSGI middleware running cProfile around a sample of the requests to the
+signaling routes in constants.PROFILED_ROUTES. A request is profiled with
+probability constants.PROFILER_SAMPLE_RATE, or when its PROFILE_HEADER
+matches constants.PROFILER_TOKEN. Requests that are not profiled only pay a
+random number draw, and nothing when the sample rate is 0.
+
+The profiles of a route are merged in memcache, as the zlib compressed
+marshal of a pstats dict. get_profile returns it uncompressed, in the format
+of pstats.Stats.dump_stats, so downloaded profiles can be loaded and merged
+with pstats.Stats.
+"""
+
+import cProfile
+import logging
+import marshal
+import pstats
+import random
+import zlib
+
+from google.appengine.api import memcache
+
+import cas_retry
+import constants
+import request_metrics
+
+PROFILE_HEADER = 'X-AppRTC-Profile'
+PROFILE_HEADER_ENVIRON_KEY = 'HTTP_X_APPRTC_PROFILE'
+PROFILE_KEY_PREFIX = 'profile/'
+PROFILE_COUNT_KEY_PREFIX = 'profile_count/'
+
+
+def get_profile_key(route):
+  return PROFILE_KEY_PREFIX + route
+
+
+def get_profile_count_key(route):
+  return PROFILE_COUNT_KEY_PREFIX + route
+
+
+class StoredProfile(object):
+  """A profile loaded from a pstats dict, that pstats.Stats can be created
+  from."""
+
+  def __init__(self, stats):
+    self.stats = stats
+
+  def create_stats(self):
+    pass
+
+
+def save_profile(route, profile):
+  """Merges a profile into the stored profile of a route."""
+  memcache_client = memcache.Client()
+  key = get_profile_key(route)
+  profile.create_stats()
+
+  def attempt(retries):
+    value = memcache_client.gets(key)
+    if value is None:
+      if memcache_client.add(key, zlib.compress(marshal.dumps(profile.stats))):
+        return True
+      return cas_retry.RETRY
+    stats = pstats.Stats(StoredProfile(marshal.loads(zlib.decompress(value))))
+    stats.add(pstats.Stats(StoredProfile(profile.stats)))
+    if not memcache_client.cas(key, zlib.compress(marshal.dumps(stats.stats))):
+      return cas_retry.RETRY
+    return True
+
+  try:
+    cas_retry.run_cas_loop(key, attempt)
+    memcache_client.incr(get_profile_count_key(route), initial_value=0)
+  except cas_retry.CasRetryLimitExceeded:
+    logging.warning('Failed to save the profile of ' + route)
+
+
+def get_profile(route):
+  """Returns the merged profile of a route in the pstats file format, or
+  None."""
+  value = memcache.get(get_profile_key(route))
+  if value is None:
+    return None
+  return zlib.decompress(value)
+
+
+def get_profile_counts():
+  """Returns a dict of the profiled routes to their number of profiles."""
+  keys = [get_profile_count_key(route) for route in constants.PROFILED_ROUTES]
+  counts = memcache.get_multi(keys)
+  return dict((route, int(counts.get(get_profile_count_key(route), 0)))
+              for route in constants.PROFILED_ROUTES)
+
+
+def delete_profiles():
+  memcache.delete_multi(
+      [get_profile_key(route) for route in constants.PROFILED_ROUTES] +
+      [get_profile_count_key(route) for route in constants.PROFILED_ROUTES])
+
+
+def should_profile(environ):
+  if (constants.PROFILER_TOKEN and
+      environ.get(PROFILE_HEADER_ENVIRON_KEY) == constants.PROFILER_TOKEN):
+    return True
+  return (constants.PROFILER_SAMPLE_RATE > 0 and
+          random.random() < constants.PROFILER_SAMPLE_RATE)
+
+
+class ProfilerMiddleware(object):
+  """Profiles a sample of the requests to the profiled routes of a webapp2
+  application."""
+
+  def __init__(self, app):
+    self.app = app
+
+  def __getattr__(self, name):
+    # Exposes the router and other attributes of the application.
+    return getattr(self.app, name)
+
+  def __call__(self, environ, start_response):
+    if not should_profile(environ):
+      return self.app(environ, start_response)
+    route = request_metrics.get_route_prefix(environ.get('PATH_INFO') or '/')
+    if route not in constants.PROFILED_ROUTES:
+      return self.app(environ, start_response)
+
+    profile = cProfile.Profile()
+    try:
+      return profile.runcall(self.app, environ, start_response)
+    finally:
+      try:
+        save_profile(route, profile)
+      except Exception as e:
+        logging.warning('Failed to save the profile of %s: %s'
+                        % (route, str(e)))
@@ -0,0 +1,96 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+import marshal
+import os
+import pstats
+import tempfile
+import unittest
+
+import webapp2
+import webtest
+
+import constants
+import request_profiler
+
+from google.appengine.ext import testbed
+
+
+class JoinPage(webapp2.RequestHandler):
+  def post(self, room_id):
+    self.response.write(room_id)
+
+
+class RequestProfilerTest(unittest.TestCase):
+  """Test the sampled request profiler."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+    self.sample_rate = constants.PROFILER_SAMPLE_RATE
+    self.token = constants.PROFILER_TOKEN
+    constants.PROFILER_SAMPLE_RATE = 0
+    constants.PROFILER_TOKEN = 'secret'
+    self.test_app = webtest.TestApp(request_profiler.ProfilerMiddleware(
+        webapp2.WSGIApplication([
+            ('/join/(\w+)', JoinPage),
+            ('/other/(\w+)', JoinPage),
+        ])))
+
+  def tearDown(self):
+    constants.PROFILER_SAMPLE_RATE = self.sample_rate
+    constants.PROFILER_TOKEN = self.token
+    self.testbed.deactivate()
+
+  def post(self, path, token=None):
+    headers = {}
+    if token is not None:
+      headers[request_profiler.PROFILE_HEADER] = token
+    response = self.test_app.post(path, headers=headers)
+    self.assertEqual('foo', response.body)
+
+  def testNotSampled(self):
+    self.post('/join/foo')
+    self.post('/join/foo', 'wrong')
+    self.assertEqual(0, request_profiler.get_profile_counts()['/join'])
+    self.assertIsNone(request_profiler.get_profile('/join'))
+
+  def testEmptyTokenDisablesForcedMode(self):
+    constants.PROFILER_TOKEN = ''
+    self.post('/join/foo', '')
+    self.assertEqual(0, request_profiler.get_profile_counts()['/join'])
+
+  def testForced(self):
+    self.post('/join/foo', 'secret')
+    self.post('/join/foo', 'secret')
+    self.assertEqual(2, request_profiler.get_profile_counts()['/join'])
+
+    # The profile can be loaded and merged by pstats.
+    handle, path = tempfile.mkstemp()
+    try:
+      with os.fdopen(handle, 'wb') as f:
+        f.write(request_profiler.get_profile('/join'))
+      stats = pstats.Stats(path)
+      stats.add(path)
+    finally:
+      os.remove(path)
+    calls = [stat[1] for (filename, _, name), stat in stats.stats.iteritems()
+             if name == 'post' and filename.endswith('request_profiler_test.py')]
+    self.assertEqual([4], calls)
+
+  def testSampled(self):
+    constants.PROFILER_SAMPLE_RATE = 1
+    self.post('/join/foo')
+    self.post('/other/foo')
+    self.assertEqual(1, request_profiler.get_profile_counts()['/join'])
+    self.assertIsNotNone(marshal.loads(request_profiler.get_profile('/join')))
+
+  def testDeleteProfiles(self):
+    self.post('/join/foo', 'secret')
+    request_profiler.delete_profiles()
+    self.assertEqual(0, request_profiler.get_profile_counts()['/join'])
+    self.assertIsNone(request_profiler.get_profile('/join'))
+
+
+if __name__ == '__main__':
+  unittest.main()
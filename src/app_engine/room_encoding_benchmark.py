@@ -0,0 +1,56 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+"""Benchmarks of the room encoding stored in memcache.
+
+Compares apprtc.encode_room/decode_room to pickling the Room classes as they
+were before the versioned encoding, with the protocol memcache uses.
+"""
+
+import cPickle
+
+import apprtc
+import benchmark_util
+import test_util
+
+NUMBER = 20000
+
+
+def make_old_room():
+  room = test_util.OldRoom()
+  room.clients['12345678'] = test_util.OldClient(True)
+  room.clients['87654321'] = test_util.OldClient(False)
+  return room
+
+
+def make_encoded_room():
+  room = apprtc.Room()
+  room.add_client('12345678', apprtc.Client(True))
+  room.add_client('87654321', apprtc.Client(False))
+  return apprtc.encode_room(room)
+
+
+def benchmark_pickle():
+  room = make_old_room()
+
+  def run():
+    value = cPickle.dumps(room, cPickle.HIGHEST_PROTOCOL)
+    return {
+        'bytes_per_room': len(value),
+        'encode_usec': benchmark_util.time_per_call_usec(
+            lambda: cPickle.dumps(room, cPickle.HIGHEST_PROTOCOL), NUMBER),
+        'decode_usec': benchmark_util.time_per_call_usec(
+            lambda: cPickle.loads(value), NUMBER)
+    }
+  return test_util.run_with_old_room_classes(run)
+
+
+def benchmark_versioned_encoding():
+  value = make_encoded_room()
+  room = apprtc.decode_room(value)
+  return {
+      'bytes_per_room': len(value),
+      'encode_usec': benchmark_util.time_per_call_usec(
+          lambda: apprtc.encode_room(room), NUMBER),
+      'decode_usec': benchmark_util.time_per_call_usec(
+          lambda: apprtc.decode_room(value), NUMBER)
+  }
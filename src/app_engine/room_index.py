@@ -0,0 +1,112 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+"""AppRTC Room Index.
+
+Records the keys of the rooms written recently, so that idle rooms can be
+found and deleted before they expire, see SweepRoomsPage in apprtc.py. A room
+is added whenever a client joins or leaves it, which is also when its last
+activity is updated.
+
+Time is split into buckets of constants.ROOM_INDEX_BUCKET_SEC. Every bucket
+has a counter, and every room added during the bucket gets a slot numbered by
+the counter, stored under its own key. Adding a room therefore writes a few
+bytes and never conflicts with other rooms.
+
+A room can only become idle constants.ROOM_IDLE_TIMEOUT_SEC after it was last
+added, so every bucket is swept once, when that much time has passed since
+its end. Rooms added again since then are found in a later bucket. Sweeping
+costs one bucket of rooms per run, and buckets expire soon after they are
+swept, see get_expiration_sec.
+
+Indexing is best-effort: a room that is not indexed still expires after
+constants.ROOM_MEMCACHE_EXPIRATION_SEC.
+"""
+
+import logging
+
+import constants
+
+KEY_PREFIX = 'room_index/'
+# Holds the last bucket that was swept.
+SWEPT_BUCKET_KEY = KEY_PREFIX + 'swept'
+
+
+def get_expiration_sec():
+  """Returns how long slots are kept: until their bucket is swept, even if
+  the sweeper is behind by constants.ROOM_SWEEP_MAX_BUCKETS."""
+  return (constants.ROOM_IDLE_TIMEOUT_SEC +
+          (constants.ROOM_SWEEP_MAX_BUCKETS + 1) *
+          constants.ROOM_INDEX_BUCKET_SEC)
+
+
+def get_bucket(now):
+  return int(now // constants.ROOM_INDEX_BUCKET_SEC)
+
+
+def get_count_key(bucket):
+  return '%s%d/count' % (KEY_PREFIX, bucket)
+
+
+def get_slot_key(bucket, slot):
+  return '%s%d/%d' % (KEY_PREFIX, bucket, slot)
+
+
+def get_batches(keys):
+  """Splits keys into lists of at most constants.ROOM_SWEEP_BATCH_SIZE, so
+  that every get_multi stays within the limits of memcache."""
+  return [keys[index:index + constants.ROOM_SWEEP_BATCH_SIZE]
+          for index in xrange(0, len(keys), constants.ROOM_SWEEP_BATCH_SIZE)]
+
+
+def add_room(store, room_key, now):
+  """Adds a room to the index. Failures are logged, not raised."""
+  bucket = get_bucket(now)
+  count_key = get_count_key(bucket)
+  try:
+    slot = store.incr(count_key)
+    if slot is None:
+      # The first room of the bucket creates the counter, so that it expires.
+      store.add(count_key, 0, get_expiration_sec())
+      slot = store.incr(count_key)
+    if (slot is None or
+        not store.set(get_slot_key(bucket, slot), room_key,
+                      get_expiration_sec())):
+      logging.warning('Failed to index room ' + room_key)
+  except Exception as e:
+    logging.warning('Failed to index room %s: %s' % (room_key, str(e)))
+
+
+def get_buckets_to_sweep(store, now):
+  """Returns the buckets whose rooms may have become idle since the last
+  sweep, oldest first. A bucket can be swept once ROOM_IDLE_TIMEOUT_SEC
+  passed since its end."""
+  last_bucket = get_bucket(now - constants.ROOM_IDLE_TIMEOUT_SEC) - 1
+  first_bucket = last_bucket - constants.ROOM_SWEEP_MAX_BUCKETS + 1
+  swept_bucket = store.get(SWEPT_BUCKET_KEY)
+  if swept_bucket is not None:
+    first_bucket = max(first_bucket, long(swept_bucket) + 1)
+  return range(first_bucket, last_bucket + 1)
+
+
+def set_swept_bucket(store, bucket):
+  store.set(SWEPT_BUCKET_KEY, bucket, get_expiration_sec())
+
+
+def get_rooms(store, bucket):
+  """Returns the keys of the rooms added during a bucket, in the order they
+  were first added."""
+  count = store.get(get_count_key(bucket))
+  if count is None:
+    return []
+  slot_keys = [get_slot_key(bucket, slot)
+               for slot in xrange(1, long(count) + 1)]
+  room_keys = []
+  seen_room_keys = set()
+  for batch in get_batches(slot_keys):
+    values = store.get_multi(batch)
+    for slot_key in batch:
+      room_key = values.get(slot_key)
+      if room_key is not None and room_key not in seen_room_keys:
+        seen_room_keys.add(room_key)
+        room_keys.append(room_key)
+  return room_keys
@@ -0,0 +1,103 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+import time
+import unittest
+
+import constants
+import room_index
+import room_store
+from test_util import ReplaceFunction
+
+from google.appengine.ext import testbed
+
+
+class RoomIndexTest(unittest.TestCase):
+  """Test the bucketed room index."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+    self.store = room_store.MemcacheRoomStore()
+    # The start of a bucket.
+    self.now = (room_index.get_bucket(time.time()) *
+                constants.ROOM_INDEX_BUCKET_SEC + 1)
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def testAddRooms(self):
+    bucket = room_index.get_bucket(self.now)
+    self.assertEqual([], room_index.get_rooms(self.store, bucket))
+    room_keys = ['http://localhost/room%d' % index for index in xrange(50)]
+    for room_key in room_keys:
+      room_index.add_room(self.store, room_key, self.now)
+    room_index.add_room(self.store, room_keys[0], self.now)
+    room_index.add_room(self.store, 'http://localhost/later',
+                        self.now + constants.ROOM_INDEX_BUCKET_SEC)
+    self.assertEqual(room_keys, room_index.get_rooms(self.store, bucket))
+    self.assertEqual(['http://localhost/later'],
+                     room_index.get_rooms(self.store, bucket + 1))
+
+  def testRoomsAreReadInBatches(self):
+    room_keys = ['http://localhost/room%d' % index for index in xrange(5)]
+    for room_key in room_keys:
+      room_index.add_room(self.store, room_key, self.now)
+    get_multi = self.store.get_multi
+    batch_sizes = []
+    def capture_get_multi(keys):
+      batch_sizes.append(len(keys))
+      return get_multi(keys)
+    replacements = [
+        ReplaceFunction(constants, 'ROOM_SWEEP_BATCH_SIZE', 2),
+        ReplaceFunction(self.store, 'get_multi', capture_get_multi)]
+    try:
+      self.assertEqual(room_keys, room_index.get_rooms(
+          self.store, room_index.get_bucket(self.now)))
+    finally:
+      del replacements[:]
+    self.assertEqual([2, 2, 1], batch_sizes)
+
+  def testAddRoomWritesOneSlot(self):
+    room_index.add_room(self.store, 'http://localhost/room', self.now)
+    bucket = room_index.get_bucket(self.now)
+    self.assertEqual(1, self.store.get(room_index.get_count_key(bucket)))
+    self.assertEqual('http://localhost/room',
+                     self.store.get(room_index.get_slot_key(bucket, 1)))
+
+  def testAddRoomFailuresAreLogged(self):
+    def fail(*args, **kwargs):
+      raise ValueError('Values may not be more than 1000000 bytes in length')
+    replacement = ReplaceFunction(self.store, 'incr', fail)
+    try:
+      room_index.add_room(self.store, 'http://localhost/room', self.now)
+    finally:
+      del replacement
+    self.assertEqual([], room_index.get_rooms(
+        self.store, room_index.get_bucket(self.now)))
+
+  def testBucketsAreSweptOnceAfterTheIdleTimeout(self):
+    bucket = room_index.get_bucket(self.now)
+    # The bucket ends, then the rooms added at its end become idle.
+    now = (self.now + constants.ROOM_INDEX_BUCKET_SEC +
+           constants.ROOM_IDLE_TIMEOUT_SEC)
+    buckets = room_index.get_buckets_to_sweep(self.store, now)
+    self.assertEqual(constants.ROOM_SWEEP_MAX_BUCKETS, len(buckets))
+    self.assertEqual(bucket, buckets[-1])
+    room_index.set_swept_bucket(self.store, bucket)
+    self.assertEqual([], room_index.get_buckets_to_sweep(self.store, now))
+
+    # A sweeper that fell behind catches up a few buckets at a time.
+    now += 10 * constants.ROOM_INDEX_BUCKET_SEC
+    self.assertEqual(range(bucket + 8, bucket + 11),
+                     room_index.get_buckets_to_sweep(self.store, now))
+
+  def testSlotsAreKeptUntilTheirBucketIsSwept(self):
+    self.assertGreater(
+        room_index.get_expiration_sec(),
+        constants.ROOM_IDLE_TIMEOUT_SEC +
+        constants.ROOM_SWEEP_MAX_BUCKETS * constants.ROOM_INDEX_BUCKET_SEC)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,142 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+"""AppRTC Room Statistics.
+
+Counts joins, leaves and messages, and the number of half-full and full
+rooms, in memcache counters. Every counter is split over
+constants.ROOM_STATS_NUM_SHARDS keys and every update picks a random shard,
+so that the counters are not contended. All the counters of an update are
+changed with a single offset_multi.
+
+Counters only grow, since memcache counters cannot go below 0. The number of
+rooms of an occupancy is the difference of a counter of the rooms that
+reached it and a counter of the rooms that left it. Rates are computed by
+get_stats from totals the caller saw before, so that reading the statistics
+changes nothing and readers do not disturb each other. Counters are evicted
+like any memcache value and rooms expire without leaving, so the numbers are
+estimates.
+"""
+
+import logging
+import random
+
+import constants
+
+COUNTER_KEY_PREFIX = 'room_stats/'
+
+# Events, reported as totals and rates.
+JOINS = 'joins'
+LEAVES = 'leaves'
+MESSAGES = 'messages'
+EVENTS = [JOINS, LEAVES, MESSAGES]
+
+# Numbers of rooms, reported as values.
+HALF_FULL_ROOMS = 'half_full_rooms'
+FULL_ROOMS = 'full_rooms'
+GAUGES = [HALF_FULL_ROOMS, FULL_ROOMS]
+
+# Suffixes of the counters of increments and decrements of a gauge.
+GAUGE_UP = '+'
+GAUGE_DOWN = '-'
+
+
+def get_counter_key(name, shard):
+  return '%s%s/%d' % (COUNTER_KEY_PREFIX, name, shard)
+
+
+def get_counter_names():
+  return EVENTS + [gauge + suffix
+                   for gauge in GAUGES for suffix in (GAUGE_UP, GAUGE_DOWN)]
+
+
+def get_occupancy_gauge(occupancy):
+  if occupancy == 1:
+    return HALF_FULL_ROOMS
+  if occupancy == 2:
+    return FULL_ROOMS
+  return None
+
+
+def get_occupancy_changes(old_occupancy, new_occupancy):
+  """Returns the gauge changes for a room going from one occupancy to
+  another."""
+  changes = {}
+  old_gauge = get_occupancy_gauge(old_occupancy)
+  new_gauge = get_occupancy_gauge(new_occupancy)
+  if old_gauge != new_gauge:
+    if old_gauge is not None:
+      changes[old_gauge] = -1
+    if new_gauge is not None:
+      changes[new_gauge] = 1
+  return changes
+
+
+def record(store, changes):
+  """Adds to the counters of events and gauges.
+
+  Args:
+    store: The room_store.RoomStore holding the counters.
+    changes: A dict of event or gauge names to the amount to add to them.
+  """
+  shard = random.randrange(constants.ROOM_STATS_NUM_SHARDS)
+  deltas = {}
+  for name, delta in changes.iteritems():
+    if not delta:
+      continue
+    if name in GAUGES:
+      name += GAUGE_UP if delta > 0 else GAUGE_DOWN
+      delta = abs(delta)
+    deltas[get_counter_key(name, shard)] = delta
+  if not deltas:
+    return
+  results = store.offset_multi(deltas, initial_value=0)
+  if None in results.values():
+    logging.warning('Failed to update room statistics')
+
+
+def get_totals(store):
+  """Returns a dict of the counter names to their sums over all shards."""
+  names = get_counter_names()
+  keys = [get_counter_key(name, shard)
+          for name in names
+          for shard in xrange(constants.ROOM_STATS_NUM_SHARDS)]
+  values = store.get_multi(keys)
+  totals = dict((name, 0) for name in names)
+  for name in names:
+    for shard in xrange(constants.ROOM_STATS_NUM_SHARDS):
+      totals[name] += long(values.get(get_counter_key(name, shard), 0))
+  return totals
+
+
+def get_stats(store, now, previous=None):
+  """Returns the room statistics.
+
+  Args:
+    store: The room_store.RoomStore holding the counters.
+    now: The current time.
+    previous: The 'time' and 'totals' of statistics returned before, or None.
+        Rates are averaged since then, and are None without them.
+
+  Returns:
+    A dict of the numbers of rooms, the totals and rates of events, the
+    interval of the rates and the time.
+  """
+  totals = get_totals(store)
+  rooms = {}
+  for gauge in GAUGES:
+    rooms[gauge] = max(0, totals[gauge + GAUGE_UP] - totals[gauge + GAUGE_DOWN])
+  rates = dict((event, None) for event in EVENTS)
+  interval_sec = None
+  if previous is not None and now > previous['time']:
+    interval_sec = now - previous['time']
+    for event in EVENTS:
+      # Counters reset by eviction would give negative rates.
+      delta = totals[event] - previous['totals'].get(event, 0)
+      rates[event] = max(0, delta) / interval_sec
+  return {
+      'rooms': rooms,
+      'totals': dict((event, totals[event]) for event in EVENTS),
+      'rates_per_sec': rates,
+      'interval_sec': interval_sec,
+      'time': now
+  }
@@ -0,0 +1,77 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+import unittest
+
+import constants
+import room_stats
+import room_store
+
+from google.appengine.ext import testbed
+
+
+class RoomStatsTest(unittest.TestCase):
+  """Test the sharded room statistics counters."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+    self.store = room_store.MemcacheRoomStore()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def testGetOccupancyChanges(self):
+    self.assertEqual({room_stats.HALF_FULL_ROOMS: 1},
+                     room_stats.get_occupancy_changes(0, 1))
+    self.assertEqual({room_stats.HALF_FULL_ROOMS: -1,
+                      room_stats.FULL_ROOMS: 1},
+                     room_stats.get_occupancy_changes(1, 2))
+    self.assertEqual({room_stats.FULL_ROOMS: -1},
+                     room_stats.get_occupancy_changes(2, 0))
+    self.assertEqual({}, room_stats.get_occupancy_changes(1, 1))
+
+  def testStats(self):
+    stats = room_stats.get_stats(self.store, 100)
+    self.assertEqual({room_stats.HALF_FULL_ROOMS: 0,
+                      room_stats.FULL_ROOMS: 0}, stats['rooms'])
+    self.assertIsNone(stats['rates_per_sec'][room_stats.JOINS])
+
+    for _ in xrange(40):
+      room_stats.record(self.store, {room_stats.JOINS: 1,
+                                     room_stats.HALF_FULL_ROOMS: 1})
+    for _ in xrange(10):
+      room_stats.record(self.store, room_stats.get_occupancy_changes(1, 2))
+    room_stats.record(self.store, {room_stats.MESSAGES: 30})
+
+    previous = room_stats.get_stats(self.store, 110, stats)
+    self.assertEqual({room_stats.HALF_FULL_ROOMS: 30,
+                      room_stats.FULL_ROOMS: 10}, previous['rooms'])
+    self.assertEqual({room_stats.JOINS: 40, room_stats.LEAVES: 0,
+                      room_stats.MESSAGES: 30}, previous['totals'])
+    self.assertEqual(10, previous['interval_sec'])
+    self.assertEqual({room_stats.JOINS: 4.0, room_stats.LEAVES: 0.0,
+                      room_stats.MESSAGES: 3.0}, previous['rates_per_sec'])
+
+    # Reading the statistics does not change the rates of other readers.
+    room_stats.record(self.store, {room_stats.JOINS: 10})
+    self.assertEqual(2.0, room_stats.get_stats(self.store, 115, previous)[
+        'rates_per_sec'][room_stats.JOINS])
+    stats = room_stats.get_stats(self.store, 120, previous)
+    self.assertEqual(10, stats['interval_sec'])
+    self.assertEqual(1.0, stats['rates_per_sec'][room_stats.JOINS])
+    stats = room_stats.get_stats(self.store, 120, stats)
+    self.assertIsNone(stats['interval_sec'])
+
+  def testCountersAreSharded(self):
+    for _ in xrange(100):
+      room_stats.record(self.store, {room_stats.JOINS: 1})
+    values = self.store.get_multi([
+        room_stats.get_counter_key(room_stats.JOINS, shard)
+        for shard in xrange(constants.ROOM_STATS_NUM_SHARDS)])
+    self.assertGreater(len(values), 1)
+    self.assertEqual(100, sum(values.values()))
+
+
+if __name__ == '__main__':
+  unittest.main()
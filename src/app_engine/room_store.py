@@ -0,0 +1,327 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+"""AppRTC Room Store.
+
+This module implements the backends used to store room state. Every backend
+exposes the subset of the memcache.Client API used by apprtc.py, including
+the gets/cas pair, so the compare-and-set loops work unchanged on any of them.
+"""
+
+import copy
+import itertools
+import logging
+import threading
+import time
+
+from google.appengine.api import memcache
+
+import constants
+
+# memcache treats expiration times larger than this as absolute timestamps.
+MAX_RELATIVE_EXPIRATION_SEC = 60 * 60 * 24 * 30
+# Expired entries of the in-process backend are dropped when read, and every
+# time this many entries were stored in their stripe, so that entries that are
+# never read again do not pile up.
+PURGE_INTERVAL_STORES = 1024
+
+
+class RoomStore(object):
+  """Interface for room state backends.
+
+  Like memcache.Client, a RoomStore instance keeps the CAS ids of the keys it
+  fetched with gets(), so an instance should not outlive one request.
+  """
+
+  def get(self, key):
+    """Returns the value stored for key, or None."""
+    raise NotImplementedError
+
+  def gets(self, key):
+    """Returns the value stored for key and remembers it for cas()."""
+    raise NotImplementedError
+
+  def set(self, key, value, time=0):
+    """Unconditionally stores value for key. Returns True on success."""
+    raise NotImplementedError
+
+  def add(self, key, value, time=0):
+    """Stores value only if key is not present. Returns True on success."""
+    raise NotImplementedError
+
+  def cas(self, key, value, time=0):
+    """Stores value if key is unchanged since gets(). Returns True if set."""
+    raise NotImplementedError
+
+  def add_multi(self, mapping, time=0):
+    """Stores the values of mapping whose keys are not present. Returns the
+    list of keys that were not stored."""
+    raise NotImplementedError
+
+  def get_multi(self, keys):
+    """Returns a dictionary mapping the keys found to their values."""
+    raise NotImplementedError
+
+  def incr(self, key, delta=1, initial_value=None):
+    """Atomically increments a counter and returns its new value, or None if
+    the key is missing and no initial_value is given."""
+    raise NotImplementedError
+
+  def offset_multi(self, mapping, initial_value=None):
+    """Atomically adds the (possibly negative) offsets of mapping to the
+    counters it names. Returns a dictionary mapping the keys to their new
+    values, or to None when they could not be updated."""
+    raise NotImplementedError
+
+  def delete(self, key):
+    """Deletes key."""
+    raise NotImplementedError
+
+  def delete_multi(self, keys):
+    """Deletes all the keys."""
+    raise NotImplementedError
+
+  def flush_all(self):
+    """Deletes everything in the store."""
+    raise NotImplementedError
+
+
+class MemcacheRoomStore(RoomStore):
+  """Room store backed by the App Engine memcache service."""
+
+  def __init__(self):
+    self.client = memcache.Client()
+
+  def get(self, key):
+    return self.client.get(key)
+
+  def gets(self, key):
+    return self.client.gets(key)
+
+  def set(self, key, value, time=0):
+    return self.client.set(key, value, time)
+
+  def add(self, key, value, time=0):
+    return self.client.add(key, value, time)
+
+  def cas(self, key, value, time=0):
+    return self.client.cas(key, value, time)
+
+  def add_multi(self, mapping, time=0):
+    return self.client.add_multi(mapping, time)
+
+  def get_multi(self, keys):
+    return self.client.get_multi(keys)
+
+  def incr(self, key, delta=1, initial_value=None):
+    return self.client.incr(key, delta, initial_value=initial_value)
+
+  def offset_multi(self, mapping, initial_value=None):
+    return self.client.offset_multi(mapping, initial_value=initial_value)
+
+  def delete(self, key):
+    return self.client.delete(key)
+
+  def delete_multi(self, keys):
+    return self.client.delete_multi(keys)
+
+  def flush_all(self):
+    return self.client.flush_all()
+
+
+class _Stripe(object):
+  """A lock and the entries it guards."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    # Maps key to a (value, cas_id, expiration) tuple.
+    self.entries = {}
+    self.num_stores = 0
+
+  def purge_expired(self, now):
+    # Must be called with the lock held.
+    for key, entry in self.entries.items():
+      if entry[2] is not None and entry[2] <= now:
+        del self.entries[key]
+
+
+class StripedTable(object):
+  """Thread-safe key/value table partitioned into independently locked
+  stripes, so that requests for different rooms rarely wait on each other."""
+
+  def __init__(self, num_stripes):
+    self.stripes = [_Stripe() for _ in xrange(num_stripes)]
+    self.cas_ids = itertools.count(1)
+
+  def get_stripe(self, key):
+    return self.stripes[hash(key) % len(self.stripes)]
+
+  def next_cas_id(self):
+    return next(self.cas_ids)
+
+  def clear(self):
+    for stripe in self.stripes:
+      with stripe.lock:
+        stripe.entries.clear()
+
+
+def get_expiration(time_sec, now):
+  """Converts a memcache style expiration time to an absolute timestamp, or
+  None if the entry never expires."""
+  if not time_sec:
+    return None
+  if time_sec > MAX_RELATIVE_EXPIRATION_SEC:
+    return time_sec
+  return now + time_sec
+
+
+def _now():
+  # The RoomStore methods shadow the time module with their argument name.
+  return time.time()
+
+
+class InProcessRoomStore(RoomStore):
+  """Room store that keeps the state in the memory of the current process.
+
+  All instances share one StripedTable, so this is only correct when a single
+  process serves every request for a room, e.g. on single node or test
+  deployments. Values are copied in and out, like memcache would pickle them.
+  """
+
+  table = StripedTable(constants.ROOM_STORE_NUM_STRIPES)
+
+  def __init__(self):
+    self.cas_ids = {}
+
+  def _get_entry(self, stripe, key, now):
+    # Must be called with stripe.lock held.
+    entry = stripe.entries.get(key)
+    if entry is None:
+      return None
+    expiration = entry[2]
+    if expiration is not None and expiration <= now:
+      del stripe.entries[key]
+      return None
+    return entry
+
+  def _store(self, stripe, key, value, time_sec, now):
+    # Must be called with stripe.lock held.
+    stripe.entries[key] = (copy.deepcopy(value), self.table.next_cas_id(),
+                           get_expiration(time_sec, now))
+    stripe.num_stores += 1
+    if stripe.num_stores % PURGE_INTERVAL_STORES == 0:
+      stripe.purge_expired(now)
+
+  def get(self, key):
+    stripe = self.table.get_stripe(key)
+    with stripe.lock:
+      entry = self._get_entry(stripe, key, _now())
+    if entry is None:
+      return None
+    return copy.deepcopy(entry[0])
+
+  def gets(self, key):
+    stripe = self.table.get_stripe(key)
+    with stripe.lock:
+      entry = self._get_entry(stripe, key, _now())
+    if entry is None:
+      self.cas_ids.pop(key, None)
+      return None
+    self.cas_ids[key] = entry[1]
+    return copy.deepcopy(entry[0])
+
+  def set(self, key, value, time=0):
+    stripe = self.table.get_stripe(key)
+    with stripe.lock:
+      self._store(stripe, key, value, time, _now())
+    return True
+
+  def add(self, key, value, time=0):
+    stripe = self.table.get_stripe(key)
+    with stripe.lock:
+      now = _now()
+      if self._get_entry(stripe, key, now) is not None:
+        return False
+      self._store(stripe, key, value, time, now)
+    return True
+
+  def cas(self, key, value, time=0):
+    cas_id = self.cas_ids.get(key)
+    if cas_id is None:
+      return False
+    stripe = self.table.get_stripe(key)
+    with stripe.lock:
+      now = _now()
+      entry = self._get_entry(stripe, key, now)
+      if entry is None or entry[1] != cas_id:
+        return False
+      self._store(stripe, key, value, time, now)
+    return True
+
+  def add_multi(self, mapping, time=0):
+    return [key for key, value in mapping.iteritems()
+            if not self.add(key, value, time)]
+
+  def get_multi(self, keys):
+    values = {}
+    for key in keys:
+      value = self.get(key)
+      if value is not None:
+        values[key] = value
+    return values
+
+  def incr(self, key, delta=1, initial_value=None):
+    stripe = self.table.get_stripe(key)
+    with stripe.lock:
+      now = _now()
+      entry = self._get_entry(stripe, key, now)
+      if entry is not None:
+        value = long(entry[0]) + delta
+        expiration = entry[2]
+      elif initial_value is not None:
+        value = long(initial_value) + delta
+        expiration = None
+      else:
+        return None
+      # Like memcache, counters are unsigned 64-bit integers that wrap around
+      # when incremented, and stop at zero when decremented.
+      if delta < 0:
+        value = max(value, 0)
+      value %= 2 ** 64
+      stripe.entries[key] = (value, self.table.next_cas_id(), expiration)
+    return value
+
+  def offset_multi(self, mapping, initial_value=None):
+    return dict((key, self.incr(key, delta, initial_value))
+                for key, delta in mapping.iteritems())
+
+  def delete(self, key):
+    stripe = self.table.get_stripe(key)
+    with stripe.lock:
+      stripe.entries.pop(key, None)
+    return True
+
+  def delete_multi(self, keys):
+    for key in keys:
+      self.delete(key)
+    return True
+
+  def flush_all(self):
+    self.table.clear()
+    return True
+
+
+ROOM_STORE_BACKENDS = {
+    constants.ROOM_STORE_BACKEND_MEMCACHE: MemcacheRoomStore,
+    constants.ROOM_STORE_BACKEND_IN_PROCESS: InProcessRoomStore,
+}
+
+
+def create_room_store():
+  """Returns a room store client for the configured backend. Like
+  memcache.Client, the returned object should only be used for one request."""
+  backend = ROOM_STORE_BACKENDS.get(constants.ROOM_STORE_BACKEND)
+  if backend is None:
+    logging.error('Unknown room store backend %s, using memcache',
+                  constants.ROOM_STORE_BACKEND)
+    backend = MemcacheRoomStore
+  return backend()
@@ -0,0 +1,183 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+import time
+import unittest
+
+import constants
+import room_store
+from test_util import ReplaceFunction
+
+from google.appengine.ext import testbed
+
+
+class InProcessRoomStoreTest(unittest.TestCase):
+  """Test the in-process room store backend."""
+
+  def setUp(self):
+    self.store = room_store.InProcessRoomStore()
+    self.store.flush_all()
+
+  def tearDown(self):
+    self.store.flush_all()
+
+  def testGetMissingKey(self):
+    self.assertIsNone(self.store.get('foo'))
+    self.assertIsNone(self.store.gets('foo'))
+
+  def testSetAndGet(self):
+    self.assertTrue(self.store.set('foo', {'a': 1}))
+    self.assertEqual({'a': 1}, self.store.get('foo'))
+    # Instances share the same table.
+    self.assertEqual({'a': 1}, room_store.InProcessRoomStore().get('foo'))
+
+  def testValuesAreCopied(self):
+    value = ['a']
+    self.store.set('foo', value)
+    value.append('b')
+    self.assertEqual(['a'], self.store.get('foo'))
+    self.store.get('foo').append('c')
+    self.assertEqual(['a'], self.store.get('foo'))
+
+  def testAdd(self):
+    self.assertTrue(self.store.add('foo', 1))
+    self.assertFalse(self.store.add('foo', 2))
+    self.assertEqual(1, self.store.get('foo'))
+
+  def testAddMulti(self):
+    self.store.set('foo', 1)
+    self.assertEqual(['foo'], self.store.add_multi({'foo': 2, 'bar': 3}))
+    self.assertEqual({'foo': 1, 'bar': 3},
+                     self.store.get_multi(['foo', 'bar']))
+
+  def testDelete(self):
+    self.store.set('foo', 1)
+    self.store.delete('foo')
+    self.assertIsNone(self.store.get('foo'))
+    self.assertTrue(self.store.add('foo', 2))
+
+  def testIncr(self):
+    self.assertIsNone(self.store.incr('foo'))
+    self.assertEqual(1, self.store.incr('foo', initial_value=0))
+    self.assertEqual(11, self.store.incr('foo', delta=10, initial_value=0))
+    self.assertEqual(11, self.store.get('foo'))
+    self.assertEqual(0, self.store.incr('foo', delta=2 ** 64 - 11))
+
+  def testOffsetMulti(self):
+    self.store.set('foo', 5)
+    self.assertEqual({'foo': 3, 'bar': None},
+                     self.store.offset_multi({'foo': -2, 'bar': 1}))
+    self.assertEqual({'foo': 0, 'bar': 1},
+                     self.store.offset_multi({'foo': -10, 'bar': 1},
+                                             initial_value=0))
+
+  def testGetMulti(self):
+    self.store.set('foo', 1)
+    self.store.set('bar', 2)
+    self.assertEqual({'foo': 1, 'bar': 2},
+                     self.store.get_multi(['foo', 'bar', 'baz']))
+
+  def testDeleteMulti(self):
+    self.store.set('foo', 1)
+    self.store.set('bar', 2)
+    self.store.delete_multi(['foo', 'bar'])
+    self.assertEqual({}, self.store.get_multi(['foo', 'bar']))
+
+  def testCas(self):
+    self.store.set('foo', 1)
+    self.assertEqual(1, self.store.gets('foo'))
+    self.assertTrue(self.store.cas('foo', 2))
+    self.assertEqual(2, self.store.get('foo'))
+    # The CAS id changes with every write.
+    self.assertFalse(self.store.cas('foo', 3))
+
+  def testCasWithoutGets(self):
+    self.store.set('foo', 1)
+    self.assertFalse(self.store.cas('foo', 2))
+    self.assertEqual(1, self.store.get('foo'))
+
+  def testCasConflict(self):
+    other_store = room_store.InProcessRoomStore()
+    self.store.set('foo', 1)
+    self.store.gets('foo')
+    other_store.gets('foo')
+    self.assertTrue(other_store.cas('foo', 2))
+    self.assertFalse(self.store.cas('foo', 3))
+    self.assertEqual(2, self.store.get('foo'))
+
+  def testCasDeletedKey(self):
+    self.store.set('foo', 1)
+    self.store.gets('foo')
+    room_store.InProcessRoomStore().delete('foo')
+    self.assertFalse(self.store.cas('foo', 2))
+    self.assertIsNone(self.store.get('foo'))
+
+  def testExpiration(self):
+    self.store.set('foo', 1, time=10)
+    self.store.set('bar', 1)
+    now = time.time()
+    replacement = ReplaceFunction(time, 'time', lambda: now + 11)
+    try:
+      self.assertIsNone(self.store.get('foo'))
+      self.assertEqual(1, self.store.get('bar'))
+    finally:
+      del replacement
+
+  def testExpiredEntriesArePurged(self):
+    self.store.set('foo', 1, time=10)
+    stripe = self.store.table.get_stripe('foo')
+    now = time.time()
+    replacement = ReplaceFunction(time, 'time', lambda: now + 11)
+    try:
+      # Entries stored in the stripe eventually purge the expired entry.
+      for index in xrange(room_store.PURGE_INTERVAL_STORES):
+        with stripe.lock:
+          self.store._store(stripe, 'bar%d' % index, 1, 10, now + 11)
+      self.assertNotIn('foo', stripe.entries)
+    finally:
+      del replacement
+
+  def testGetExpiration(self):
+    self.assertIsNone(room_store.get_expiration(0, 100))
+    self.assertEqual(110, room_store.get_expiration(10, 100))
+    absolute_time = room_store.MAX_RELATIVE_EXPIRATION_SEC + 1
+    self.assertEqual(absolute_time,
+                     room_store.get_expiration(absolute_time, 100))
+
+
+class CreateRoomStoreTest(unittest.TestCase):
+  """Test the room store backend selection."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def verifyBackend(self, backend, expected_class):
+    replacement = ReplaceFunction(constants, 'ROOM_STORE_BACKEND', backend)
+    try:
+      self.assertIsInstance(room_store.create_room_store(), expected_class)
+    finally:
+      del replacement
+
+  def testCreateRoomStore(self):
+    self.verifyBackend(constants.ROOM_STORE_BACKEND_MEMCACHE,
+                       room_store.MemcacheRoomStore)
+    self.verifyBackend(constants.ROOM_STORE_BACKEND_IN_PROCESS,
+                       room_store.InProcessRoomStore)
+    # Unknown backends fall back to memcache.
+    self.verifyBackend('foo', room_store.MemcacheRoomStore)
+
+  def testMemcacheRoomStoreCas(self):
+    store = room_store.MemcacheRoomStore()
+    store.set('foo', 1)
+    self.assertEqual(1, store.gets('foo'))
+    self.assertTrue(store.cas('foo', 2))
+    self.assertFalse(store.cas('foo', 3))
+    self.assertEqual(2, store.get('foo'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,95 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+"""AppRTC Template Cache.
+
+Page templates are compiled to Jinja bytecode when the package is built, see
+precompile_templates, so instances do not parse and compile them on their
+first requests. Rendered pages are cached by template name and parameters,
+since most page loads use one of a few parameter sets.
+"""
+
+import hashlib
+import json
+import os
+
+import jinja2
+
+import constants
+import lru_cache
+
+# Directory of the bytecode written at build time, next to the templates.
+BYTECODE_DIR_NAME = 'template_bytecode'
+
+
+class PrecompiledBytecodeCache(jinja2.BytecodeCache):
+  """Loads template bytecode from the files written at build time.
+
+  Bytecode written by a different Jinja or Python version is ignored by
+  Jinja, which then compiles the template from source. The App Engine file
+  system is read-only, so bytecode is only written when writable is set.
+  """
+
+  def __init__(self, directory, writable=False):
+    self.directory = directory
+    self.writable = writable
+
+  def get_cache_key(self, name, filename=None):
+    # Templates are in a different directory at build time, so the key only
+    # depends on the name.
+    return hashlib.sha1(name.encode('utf-8')).hexdigest()
+
+  def get_bytecode_path(self, key):
+    return os.path.join(self.directory, key + '.cache')
+
+  def load_bytecode(self, bucket):
+    try:
+      with open(self.get_bytecode_path(bucket.key), 'rb') as f:
+        bucket.load_bytecode(f)
+    except IOError:
+      pass
+
+  def dump_bytecode(self, bucket):
+    if not self.writable:
+      return
+    with open(self.get_bytecode_path(bucket.key), 'wb') as f:
+      bucket.write_bytecode(f)
+
+
+def create_environment(template_dir, writable=False):
+  return jinja2.Environment(
+      loader=jinja2.FileSystemLoader(template_dir),
+      bytecode_cache=PrecompiledBytecodeCache(
+          os.path.join(template_dir, BYTECODE_DIR_NAME), writable))
+
+
+def is_page_template(name):
+  return '/' not in name and name.endswith('_template.html')
+
+
+def precompile_templates(template_dir):
+  """Writes the bytecode of the page templates in template_dir. Returns the
+  names of the compiled templates."""
+  environment = create_environment(template_dir, writable=True)
+  bytecode_dir = os.path.join(template_dir, BYTECODE_DIR_NAME)
+  if not os.path.exists(bytecode_dir):
+    os.makedirs(bytecode_dir)
+  names = environment.list_templates(filter_func=is_page_template)
+  for name in names:
+    environment.get_template(name)
+  return names
+
+
+jinja_environment = create_environment(os.path.dirname(__file__))
+
+# Caches rendered pages by template name and parameters.
+rendered_page_cache = lru_cache.LruCache(constants.RENDERED_PAGE_CACHE_SIZE)
+
+
+def render_page(name, params=None):
+  """Renders a page template. Pages rendered with the same parameters are
+  rendered only once."""
+  if params is None:
+    params = {}
+  key = (name, json.dumps(params, sort_keys=True))
+  return rendered_page_cache.get(
+      key, lambda: jinja_environment.get_template(name).render(params))
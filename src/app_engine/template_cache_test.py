@@ -0,0 +1,86 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import template_cache
+from test_util import CapturingFunction
+from test_util import ReplaceFunction
+
+
+class TemplateCacheTest(unittest.TestCase):
+  """Test template precompilation and the rendered page cache."""
+
+  def setUp(self):
+    self.template_dir = tempfile.mkdtemp()
+    with open(os.path.join(self.template_dir, 'foo_template.html'), 'w') as f:
+      f.write('Hello {{ name }}')
+    template_cache.rendered_page_cache.clear()
+
+  def tearDown(self):
+    shutil.rmtree(self.template_dir)
+    template_cache.rendered_page_cache.clear()
+
+  def testPrecompileTemplates(self):
+    with open(os.path.join(self.template_dir, 'other.html'), 'w') as f:
+      f.write('Not a page template')
+    self.assertEqual(['foo_template.html'],
+                     template_cache.precompile_templates(self.template_dir))
+
+    # The bytecode is loaded instead of compiling the template.
+    environment = template_cache.create_environment(self.template_dir)
+    compile_replacement = ReplaceFunction(
+        environment, 'compile', CapturingFunction())
+    try:
+      template = environment.get_template('foo_template.html')
+      self.assertEqual(0, environment.compile.num_calls)
+      self.assertEqual('Hello you', template.render(name='you'))
+    finally:
+      del compile_replacement
+
+  def testMissingBytecodeIsCompiled(self):
+    environment = template_cache.create_environment(self.template_dir)
+    template = environment.get_template('foo_template.html')
+    self.assertEqual('Hello you', template.render(name='you'))
+    # Runtime environments do not write bytecode.
+    self.assertFalse(os.path.exists(os.path.join(
+        self.template_dir, template_cache.BYTECODE_DIR_NAME)))
+
+  def testBuiltBytecodeIsLoaded(self):
+    # The package the tests run from is built like the deployed one, and the
+    # tests run with the Jinja of the SDK, as instances do.
+    package_dir = os.path.dirname(os.path.abspath(template_cache.__file__))
+    environment = template_cache.create_environment(package_dir)
+    names = environment.list_templates(
+        filter_func=template_cache.is_page_template)
+    self.assertTrue(names)
+    compile_replacement = ReplaceFunction(
+        environment, 'compile', CapturingFunction())
+    try:
+      for name in names:
+        environment.get_template(name)
+      self.assertEqual(0, environment.compile.num_calls)
+    finally:
+      del compile_replacement
+
+  def testRenderedPagesAreCached(self):
+    environment = template_cache.create_environment(self.template_dir)
+    environment_replacement = ReplaceFunction(
+        template_cache, 'jinja_environment', environment)
+    try:
+      self.assertEqual('Hello a', template_cache.render_page(
+          'foo_template.html', {'name': 'a'}))
+      self.assertEqual('Hello a', template_cache.render_page(
+          'foo_template.html', {'name': 'a'}))
+      self.assertEqual('Hello b', template_cache.render_page(
+          'foo_template.html', {'name': 'b'}))
+      self.assertEqual(1, template_cache.rendered_page_cache.hits)
+      self.assertEqual(2, template_cache.rendered_page_cache.misses)
+    finally:
+      del environment_replacement
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -34,3 +34,58 @@ class CapturingFunction(object):
       return self.return_value()
 
     return self.return_value
+
+
+class FakeFetchResult(object):
+  """Fakes the result of a URL fetch."""
+
+  def __init__(self, status_code, content=''):
+    self.status_code = status_code
+    self.content = content
+
+
+class FakeRpc(object):
+  """Fakes the RPC of an asynchronous URL fetch. get_result returns result,
+  or raises it if it is an exception. Tests faking when the fetch completes
+  set url and complete_time."""
+
+  def __init__(self, result=None, deadline=None):
+    self.result = result
+    self.deadline = deadline
+    self.url = None
+    self.complete_time = None
+
+  def get_result(self):
+    if isinstance(self.result, Exception):
+      raise self.result
+    return self.result
+
+class OldClient:
+  """Client class of apprtc as stored before the versioned encoding."""
+
+  def __init__(self, is_initiator):
+    self.is_initiator = is_initiator
+    self.messages = []
+
+
+class OldRoom:
+  """Room class of apprtc as stored before the versioned encoding."""
+
+  def __init__(self):
+    self.clients = {}
+
+
+def run_with_old_room_classes(function):
+  """Returns the result of function, called while OldRoom and OldClient are
+  apprtc.Room and apprtc.Client, so that rooms of them are pickled as they
+  were before the versioned encoding, and unpickled to them."""
+  import apprtc
+  replacements = []
+  for old_class, name in [(OldRoom, 'Room'), (OldClient, 'Client')]:
+    replacements.append(ReplaceFunction(apprtc, name, old_class))
+    replacements.append(ReplaceFunction(old_class, '__module__', 'apprtc'))
+    replacements.append(ReplaceFunction(old_class, '__name__', name))
+  try:
+    return function()
+  finally:
+    del replacements[:]
@@ -0,0 +1,48 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+"""AppRTC TTL Cache.
+
+A process-local cache of values that change rarely, such as the active
+collider host. Every instance keeps its own copy, so a value may be stale for
+up to the TTL on instances other than the one that invalidated it.
+"""
+
+import threading
+import time
+
+
+class TtlCache(object):
+  """A thread-safe cache whose entries expire ttl_sec seconds after they are
+  set."""
+
+  def __init__(self, ttl_sec):
+    self.ttl_sec = ttl_sec
+    self.lock = threading.Lock()
+    # Maps keys to (value, expiration time) tuples.
+    self.entries = {}
+
+  def get(self, key, load):
+    """Returns the value of key, calling load() to get it if it is missing or
+    expired. The value returned by load() is cached, even when it is None."""
+    now = time.time()
+    with self.lock:
+      entry = self.entries.get(key)
+    if entry is not None and entry[1] > now:
+      return entry[0]
+    # Loaded without the lock, so a slow load does not block other keys.
+    # Concurrent misses may load the same value more than once.
+    value = load()
+    self.set(key, value)
+    return value
+
+  def set(self, key, value):
+    with self.lock:
+      self.entries[key] = (value, time.time() + self.ttl_sec)
+
+  def invalidate(self, key=None):
+    """Drops key, or every key if key is None."""
+    with self.lock:
+      if key is None:
+        self.entries.clear()
+      else:
+        self.entries.pop(key, None)
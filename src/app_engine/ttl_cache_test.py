@@ -0,0 +1,53 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+import time
+import unittest
+
+import ttl_cache
+from test_util import CapturingFunction
+from test_util import ReplaceFunction
+
+
+class TtlCacheTest(unittest.TestCase):
+  """Test the TTL cache."""
+
+  def setUp(self):
+    self.now = 1000.0
+    self.time_replacement = ReplaceFunction(time, 'time', lambda: self.now)
+    self.cache = ttl_cache.TtlCache(10)
+
+  def tearDown(self):
+    del self.time_replacement
+
+  def testLoadsOnce(self):
+    load = CapturingFunction('a')
+    self.assertEqual('a', self.cache.get('foo', load))
+    self.assertEqual('a', self.cache.get('foo', load))
+    self.assertEqual(1, load.num_calls)
+
+  def testCachesNone(self):
+    load = CapturingFunction()
+    self.assertIsNone(self.cache.get('foo', load))
+    self.assertIsNone(self.cache.get('foo', load))
+    self.assertEqual(1, load.num_calls)
+
+  def testExpiration(self):
+    load = CapturingFunction('a')
+    self.cache.get('foo', load)
+    self.now += 11
+    load.return_value = 'b'
+    self.assertEqual('b', self.cache.get('foo', load))
+    self.assertEqual(2, load.num_calls)
+
+  def testSetAndInvalidate(self):
+    self.cache.set('foo', 'a')
+    self.cache.set('bar', 'b')
+    self.assertEqual('a', self.cache.get('foo', CapturingFunction('c')))
+    self.cache.invalidate('foo')
+    self.assertEqual('c', self.cache.get('foo', CapturingFunction('c')))
+    self.cache.invalidate()
+    self.assertEqual('d', self.cache.get('bar', CapturingFunction('d')))
+
+
+if __name__ == '__main__':
+  unittest.main()
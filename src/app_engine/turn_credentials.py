@@ -0,0 +1,57 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+"""AppRTC TURN Credentials.
+
+Mints time-limited TURN credentials as described in
+https://tools.ietf.org/html/draft-uberti-behave-turn-rest-00: the username is
+the expiry timestamp and constants.TURN_USERNAME, and the credential is the
+base64 HMAC-SHA1 of the username with constants.TURN_SHARED_SECRET, which the
+TURN servers share, e.g. coturn with use-auth-secret.
+
+Time is split into windows of constants.TURN_CREDENTIAL_WINDOW_SEC, and every
+request of a window gets the same credentials, which expire
+constants.TURN_CREDENTIAL_LIFETIME_SEC after the end of the window. Clients
+therefore always get credentials valid for at least that lifetime, and each
+instance computes one HMAC per window.
+"""
+
+import base64
+import hashlib
+import hmac
+
+import constants
+import lru_cache
+
+# The credentials of the current window, and of the previous one for requests
+# racing with the change of window.
+credentials_cache = lru_cache.LruCache(2)
+
+
+def is_enabled():
+  return bool(constants.TURN_SHARED_SECRET and constants.TURN_SERVER_URLS)
+
+
+def make_credential(secret, username):
+  return base64.b64encode(hmac.new(secret, username, hashlib.sha1).digest())
+
+
+def get_expiry(window):
+  return ((window + 1) * constants.TURN_CREDENTIAL_WINDOW_SEC +
+          constants.TURN_CREDENTIAL_LIFETIME_SEC)
+
+
+def make_ice_servers(window):
+  username = '%d:%s' % (get_expiry(window), constants.TURN_USERNAME)
+  return [{
+      'urls': constants.TURN_SERVER_URLS,
+      'username': username,
+      'credential': make_credential(constants.TURN_SHARED_SECRET, username)
+  }]
+
+
+def get_ice_servers(now):
+  """Returns the ICE servers with the credentials of the window of now, and
+  their expiry timestamp. The servers are shared and must not be modified."""
+  window = int(now // constants.TURN_CREDENTIAL_WINDOW_SEC)
+  return (credentials_cache.get(window, lambda: make_ice_servers(window)),
+          get_expiry(window))
@@ -0,0 +1,59 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+
+import unittest
+
+import constants
+import turn_credentials
+
+
+class TurnCredentialsTest(unittest.TestCase):
+  """Test the minted TURN credentials."""
+
+  def setUp(self):
+    self.secret = constants.TURN_SHARED_SECRET
+    self.urls = constants.TURN_SERVER_URLS
+    constants.TURN_SHARED_SECRET = 'secret'
+    constants.TURN_SERVER_URLS = ['turn:turn.example.com:3478?transport=udp']
+    turn_credentials.credentials_cache.clear()
+
+  def tearDown(self):
+    constants.TURN_SHARED_SECRET = self.secret
+    constants.TURN_SERVER_URLS = self.urls
+    turn_credentials.credentials_cache.clear()
+
+  def testIsEnabled(self):
+    self.assertTrue(turn_credentials.is_enabled())
+    constants.TURN_SERVER_URLS = []
+    self.assertFalse(turn_credentials.is_enabled())
+
+  def testMakeCredential(self):
+    # echo -n '1433895918:apprtc' | openssl dgst -sha1 -hmac secret -binary |
+    # base64
+    self.assertEqual('k6edeQrfaObkWReUKDYgEA+xWJE=',
+                     turn_credentials.make_credential(
+                         'secret', '1433895918:apprtc'))
+
+  def testCredentialsOfWindow(self):
+    window_sec = constants.TURN_CREDENTIAL_WINDOW_SEC
+    start = 1000 * window_sec
+    ice_servers, expiry = turn_credentials.get_ice_servers(start)
+    self.assertEqual(constants.TURN_SERVER_URLS, ice_servers[0]['urls'])
+    self.assertEqual('%d:apprtc' % expiry, ice_servers[0]['username'])
+    self.assertEqual(
+        turn_credentials.make_credential('secret', ice_servers[0]['username']),
+        ice_servers[0]['credential'])
+    self.assertEqual(
+        start + window_sec + constants.TURN_CREDENTIAL_LIFETIME_SEC, expiry)
+
+    # The credentials are minted once per window.
+    self.assertIs(ice_servers,
+                  turn_credentials.get_ice_servers(start + window_sec - 1)[0])
+    self.assertEqual(1, turn_credentials.credentials_cache.misses)
+    next_ice_servers, next_expiry = turn_credentials.get_ice_servers(
+        start + window_sec)
+    self.assertNotEqual(ice_servers, next_ice_servers)
+    self.assertEqual(expiry + window_sec, next_expiry)
+
+
+if __name__ == '__main__':
+  unittest.main()
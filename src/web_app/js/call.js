@@ -9,7 +9,7 @@
 /* More information about these options at jshint.com/docs/options */
 
 /* globals trace, requestIceServers, sendUrlRequest, sendAsyncUrlRequest,
-   SignalingChannel, PeerConnectionClient, setupLoopback,
+   SignalingChannel, PeerConnectionClient,
    parseJSON, apprtc, Constants */
 
 /* exported Call */
@@ -27,6 +27,9 @@ var Call = function(params) {
   this.localStream_ = null;
   this.errorMessageQueue_ = [];
   this.startTime = null;
+  // Messages of the initiator waiting to be posted to GAE together.
+  this.pendingMessages_ = [];
+  this.pendingMessagesTimer_ = null;
 
   // Public callbacks. Keep it sorted.
   this.oncallerstarted = null;
@@ -56,9 +59,6 @@ Call.prototype.isInitiator = function() {
 
 Call.prototype.start = function(roomId) {
   this.connectToRoom_(roomId);
-  if (this.params_.isLoopback) {
-    setupLoopback(this.params_.wssUrl, roomId);
-  }
 };
 
 Call.prototype.restart = function() {
@@ -91,6 +91,7 @@ Call.prototype.hangup = function(async) {
     this.pcClient_.close();
     this.pcClient_ = null;
   }
+  this.clearPendingMessages_();
 
   // Send 'leave' to GAE. This must complete before saying BYE to other client.
   // When the other client sees BYE it attempts to post offer and candidates to
@@ -491,18 +492,84 @@ Call.prototype.sendSignalingMessage_ = function(message) {
     // Initiator posts all messages to GAE. GAE will either store the messages
     // until the other client connects, or forward the message to Collider if
     // the other client is already connected.
-    // Must append query parameters in case we've specified alternate WSS url.
-    var path = this.roomServer_ + '/message/' + this.params_.roomId +
-        '/' + this.params_.clientId + window.location.search;
-    var xhr = new XMLHttpRequest();
-    xhr.open('POST', path, true);
-    xhr.send(msgString);
-    trace('C->GAE: ' + msgString);
+    if (this.params_.isLoopback) {
+      var path = this.getMessageUrl_('/message/');
+      // Ask GAE for the answers of the loopback client in the response.
+      path += (path.indexOf('?') === -1 ? '?' : '&') + 'loopback_answers=true';
+      this.sendLoopbackMessage_(path, msgString);
+      return;
+    }
+    // Trickled candidates come in bursts, so they are held for a short while
+    // and posted together to /messages. Other messages are posted right away,
+    // after the candidates before them.
+    this.pendingMessages_.push(message);
+    if (message.type !== 'candidate' ||
+        this.pendingMessages_.length >= Constants.MESSAGE_BATCH_MAX_MESSAGES) {
+      this.sendPendingMessages_();
+    } else if (this.pendingMessagesTimer_ === null) {
+      this.pendingMessagesTimer_ = window.setTimeout(
+          this.sendPendingMessages_.bind(this),
+          Constants.MESSAGE_BATCH_DELAY_MS);
+    }
   } else {
     this.channel_.send(msgString);
   }
 };
 
+// Must append query parameters in case we've specified alternate WSS url.
+Call.prototype.getMessageUrl_ = function(route) {
+  return this.roomServer_ + route + this.params_.roomId + '/' +
+      this.params_.clientId + window.location.search;
+};
+
+Call.prototype.clearPendingMessages_ = function() {
+  if (this.pendingMessagesTimer_ !== null) {
+    window.clearTimeout(this.pendingMessagesTimer_);
+    this.pendingMessagesTimer_ = null;
+  }
+  var messages = this.pendingMessages_;
+  this.pendingMessages_ = [];
+  return messages;
+};
+
+Call.prototype.sendPendingMessages_ = function() {
+  var messages = this.clearPendingMessages_();
+  if (messages.length === 0) {
+    return;
+  }
+  var xhr = new XMLHttpRequest();
+  var msgString;
+  if (messages.length === 1) {
+    msgString = JSON.stringify(messages[0]);
+    xhr.open('POST', this.getMessageUrl_('/message/'), true);
+  } else {
+    msgString = JSON.stringify(messages);
+    xhr.open('POST', this.getMessageUrl_('/messages/'), true);
+  }
+  xhr.send(msgString);
+  trace('C->GAE: ' + msgString);
+};
+
+// In loopback rooms GAE answers for the loopback client in the response to
+// the message, instead of relaying through Collider back to this browser.
+Call.prototype.sendLoopbackMessage_ = function(path, msgString) {
+  trace('C->GAE: ' + msgString);
+  sendAsyncUrlRequest('POST', path, msgString).then(function(response) {
+    var responseObj = parseJSON(response);
+    if (!responseObj || responseObj.result !== 'SUCCESS') {
+      trace('Failed to send loopback message: ' + response);
+      return;
+    }
+    var messages = responseObj.messages || [];
+    for (var i = 0, len = messages.length; i < len; i++) {
+      trace('GAE->C: ' + messages[i]);
+      this.onRecvSignalingChannelMessage_(messages[i]);
+    }
+  }.bind(this)).catch(function(error) {
+    trace('Failed to send loopback message: ' + error.message);
+  });
+};
+
 Call.prototype.onError_ = function(message) {
   if (this.onerror) {
     this.onerror(message);
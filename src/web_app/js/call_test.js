@@ -11,7 +11,7 @@
 /* globals  describe, Call, expect, it, FAKE_ICE_SERVER, beforeEach, afterEach,
    SignalingChannel:true, MockWindowPort, FAKE_WSS_POST_URL, FAKE_ROOM_ID,
    FAKE_CLIENT_ID, apprtc, Constants, xhrs, MockXMLHttpRequest,
-   XMLHttpRequest:true */
+   XMLHttpRequest:true, jasmine */
 
 'use strict';
 
@@ -133,4 +133,67 @@ describe('Call test', function() {
     expect(call.params_.clientId).toBeNull();
     expect(call.params_.previousRoomId).toEqual(FAKE_ROOM_ID);
   });
+
+  it('Loopback messages are answered in the response', function(done) {
+    this.params_.isInitiator = true;
+    this.params_.isLoopback = true;
+    var call = new Call(this.params_);
+    var answer = JSON.stringify({type: 'answer', sdp: 'sdp'});
+    call.onRecvSignalingChannelMessage_ = function(msg) {
+      expect(msg).toEqual(answer);
+      // Not relayed through Collider.
+      expect(mockSignalingChannels[0].sends.length).toEqual(0);
+      done();
+    };
+
+    call.sendSignalingMessage_({type: 'offer', sdp: 'sdp'});
+    expect(xhrs.length).toEqual(1);
+    expect(xhrs[0].url).toContain('/message/' + FAKE_ROOM_ID + '/' +
+        FAKE_CLIENT_ID);
+    expect(xhrs[0].url).toContain('loopback_answers=true');
+    expect(xhrs[0].body).toEqual(JSON.stringify({type: 'offer', sdp: 'sdp'}));
+    xhrs[0].readyState = 4;
+    xhrs[0].responseText =
+        JSON.stringify({result: 'SUCCESS', messages: [answer]});
+    xhrs[0].onreadystatechange();
+  });
+
+  it('Initiator posts trickled candidates together', function() {
+    jasmine.clock().install();
+    this.params_.isInitiator = true;
+    var call = new Call(this.params_);
+    var offer = {type: 'offer', sdp: 'sdp'};
+    var candidates = [
+      {type: 'candidate', label: 0, id: 'audio', candidate: 'a'},
+      {type: 'candidate', label: 0, id: 'audio', candidate: 'b'},
+      {type: 'candidate', label: 1, id: 'video', candidate: 'c'}
+    ];
+
+    // Messages other than candidates are posted right away.
+    call.sendSignalingMessage_(offer);
+    expect(xhrs.length).toEqual(1);
+    expect(xhrs[0].url).toContain('/message/' + FAKE_ROOM_ID + '/' +
+        FAKE_CLIENT_ID);
+    expect(xhrs[0].body).toEqual(JSON.stringify(offer));
+
+    candidates.forEach(call.sendSignalingMessage_.bind(call));
+    expect(xhrs.length).toEqual(1);
+    jasmine.clock().tick(Constants.MESSAGE_BATCH_DELAY_MS);
+    expect(xhrs.length).toEqual(2);
+    expect(xhrs[1].method).toEqual('POST');
+    expect(xhrs[1].url).toContain('/messages/' + FAKE_ROOM_ID + '/' +
+        FAKE_CLIENT_ID);
+    expect(xhrs[1].body).toEqual(JSON.stringify(candidates));
+
+    // A message after candidates is posted with them, in order.
+    call.sendSignalingMessage_(candidates[0]);
+    call.sendSignalingMessage_({type: 'bye'});
+    expect(xhrs.length).toEqual(3);
+    expect(xhrs[2].body).toEqual(
+        JSON.stringify([candidates[0], {type: 'bye'}]));
+    jasmine.clock().tick(Constants.MESSAGE_BATCH_DELAY_MS);
+    expect(xhrs.length).toEqual(3);
+    expect(mockSignalingChannels[0].sends.length).toEqual(0);
+    jasmine.clock().uninstall();
+  });
 });
@@ -38,5 +38,12 @@ var Constants = {
   // Web socket action type to send a message on the remote web socket.
   WS_SEND_ACTION: 'send',
   // Web socket action type to close the remote web socket.
-  WS_CLOSE_ACTION: 'close'
+  WS_CLOSE_ACTION: 'close',
+
+  // How long the initiator holds trickled candidates before posting them to
+  // GAE in one request.
+  MESSAGE_BATCH_DELAY_MS: 50,
+  // The most messages GAE accepts in one request, see MAX_MESSAGES_PER_BATCH
+  // in constants.py.
+  MESSAGE_BATCH_MAX_MESSAGES: 100
 };
@@ -146,6 +146,17 @@ PeerConnectionClient.prototype.receiveSignalingMessage = function(message) {
     this.messageQueue_.unshift(messageObj);
   } else if (messageObj.type === 'candidate') {
     this.messageQueue_.push(messageObj);
+  } else if (messageObj.type === 'candidates') {
+    // Consecutive candidates batched by the server, see message_inbox.py.
+    for (var i = 0, len = messageObj.candidates.length; i < len; i++) {
+      var candidate = messageObj.candidates[i];
+      this.messageQueue_.push({
+        type: 'candidate',
+        label: candidate.label,
+        id: candidate.id,
+        candidate: candidate.candidate
+      });
+    }
   } else if (messageObj.type === 'bye') {
     if (this.onremotehangup) {
       this.onremotehangup();
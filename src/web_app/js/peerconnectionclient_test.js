@@ -256,6 +256,36 @@ describe('PeerConnectionClient Test', function() {
     pc.resolveLastCreateSdpRequest(fakeAnswer);
   });
 
+  it('Start as callee with batched candidates', function(done) {
+    var pc = peerConnections[0];
+
+    var remoteOffer = {
+      type: 'offer',
+      sdp: FAKE_SDP
+    };
+    var candidates = {
+      type: 'candidates',
+      candidates: [
+        {label: 0, id: 'audio', candidate: FAKE_CANDIDATE},
+        {label: 1, id: 'video', candidate: FAKE_CANDIDATE}
+      ]
+    };
+    this.pcClient.startAsCallee([
+      JSON.stringify(remoteOffer),
+      JSON.stringify(candidates)
+    ]);
+
+    pc.onlocaldescription = function() {
+      expect(pc.remoteIceCandidates.length).toEqual(2);
+      expect(pc.remoteIceCandidates[0].sdpMLineIndex).toEqual(0);
+      expect(pc.remoteIceCandidates[1].sdpMLineIndex).toEqual(1);
+      expect(pc.remoteIceCandidates[1].candidate).toEqual(FAKE_CANDIDATE);
+      done();
+    };
+
+    pc.resolveLastCreateSdpRequest('fake answer');
+  });
+
   it('Receive remote offer before started', function() {
     var remoteOffer = {
       type: 'offer',